@@ -1,54 +1,171 @@
-import requests
-from bs4 import BeautifulSoup
+import codecs
+import logging
+import os
+import re
+
+import http_session
+
+logger = logging.getLogger(__name__)
+
+# Article download configuration, read from the environment:
+#   ARTICLE_MAX_BYTES - pages are read up to this size, the rest is not downloaded (default: 5 MB)
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
 
 
 class ArticleContentExtractor:
+    """
+    Finds the title (the first h1) and the text (paragraphs of the first article element,
+    or else of the first element with the article-body class) of a page.
 
-    def __init__(self, url):
-        self.soup = None
+    Pages are parsed with lxml. Downloads are streamed and stop at ARTICLE_MAX_BYTES,
+    responses that are not HTML are rejected before their body is read.
+    lxml and the HTTP clients are imported with the first page, not with the module.
+
+    With validators (the 'etag' and 'last_modified' of an earlier download) the page is requested
+    conditionally. When the server answers 304, not_modified is set and there is nothing to run.
+    """
+
+    def __init__(self, url, page_content=None, validators=None):
+        import requests
+        self.__init_page()
 
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            self.soup = BeautifulSoup(response.text, 'html.parser')
+            if page_content is None:
+                with http_session.get(url, stream=True, headers=self.__conditional_headers(validators)) as response:
+                    if self.__accept(response.status_code, response.headers):
+                        self.__parse(self.__read_capped(url, response.iter_content(CHUNK_SIZE)), response.headers)
+            else:
+                self.__parse(page_content, {})
         except requests.exceptions.RequestException as e:
-            print(f"Error while downloading page content: {e}")
+            logger.error(f"Error while downloading page content: {e}")
             raise e
         except Exception as e:
-            print(f"Exception occurred: {e}")
+            logger.error(f"Exception occurred: {e}")
             raise e
 
-    def run(self):
-        result = {
-            "title": self.__find_title(),
-            "content": self.__find_content()
-        }
-        print(f"Result: {result}")
-        return result
+    @classmethod
+    async def create_async(cls, url, validators=None):
+        import httpx
+        extractor = cls.__new__(cls)
+        extractor.__init_page()
 
-    def __find_title(self):
-        if self.soup.find('h1'):
-            print("Found 'h1' element")
-            title = self.soup.find('h1').get_text()
-        else:
-            print("Not found title element on page")
+        try:
+            async with http_session.stream_async(url, headers=cls.__conditional_headers(validators)) as response:
+                if extractor.__accept(response.status_code, response.headers):
+                    content = await extractor.__read_capped_async(url, response.aiter_bytes(CHUNK_SIZE))
+                    extractor.__parse(content, response.headers)
+        except httpx.HTTPError as e:
+            logger.error(f"Error while downloading page content: {e}")
+            raise e
+
+        return extractor
+
+    def run(self):
+        title, article, article_body = self.__find_elements()
+        if title is None:
+            logger.warning("Not found title element on page")
             raise Exception(f'Title not found')
-        return title.strip()
-
-
-    def __find_content(self):
-        content = ""
-        if self.soup.find('article'):
-            print("Found 'article' element")
-            texts = self.soup.find('article').find_all('p')
-            content = "\n".join([p.get_text() for p in texts])
-        elif self.soup.find(class_="article-body"):
-            print("Found 'article-body' class element")
-            texts = self.soup.find(class_="article-body").find_all('p')
-            content = "\n".join([p.get_text() for p in texts])
+
+        container = article if article is not None else article_body
+        if container is None:
+            logger.warning("Not found article element on page")
+            content = ""
         else:
-            print("Not found article element on page")
-            pass
-        return content.strip()
+            content = "\n".join(p.text_content() for p in container.iter('p'))
 
+        return {
+            "title": title.text_content().strip(),
+            "content": content.strip()
+        }
+
+    def __init_page(self):
+        self.tree = None
+        self.not_modified = False
+        self.etag = None
+        self.last_modified = None
+
+    def __find_elements(self):
+        # A single pass over the document, stopping once the title and an article element are found
+        from lxml import etree
+
+        title = article = article_body = None
+        for element in self.tree.iter(etree.Element):
+            if element.tag == 'h1' and title is None:
+                title = element
+            elif element.tag == 'article' and article is None:
+                article = element
+            if article_body is None and 'article-body' in (element.get('class') or '').split():
+                article_body = element
+            if title is not None and article is not None:
+                break
+        return title, article, article_body
+
+    @staticmethod
+    def __conditional_headers(validators):
+        headers = {}
+        if validators and validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators and validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def __accept(self, status_code, headers):
+        if status_code == 304:
+            self.not_modified = True
+            return False
+
+        content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type and content_type not in HTML_CONTENT_TYPES:
+            raise Exception(f'Not an HTML page: {content_type}')
 
+        self.etag = headers.get('ETag')
+        self.last_modified = headers.get('Last-Modified')
+        return True
+
+    def __read_capped(self, url, chunks):
+        max_bytes = int(os.getenv('ARTICLE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        content = bytearray()
+        for chunk in chunks:
+            content += chunk
+            if len(content) >= max_bytes:
+                logger.warning(f"Page {url} is larger than {max_bytes} bytes, reading only the beginning")
+                del content[max_bytes:]
+                break
+        return bytes(content)
+
+    async def __read_capped_async(self, url, chunks):
+        max_bytes = int(os.getenv('ARTICLE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        content = bytearray()
+        async for chunk in chunks:
+            content += chunk
+            if len(content) >= max_bytes:
+                logger.warning(f"Page {url} is larger than {max_bytes} bytes, reading only the beginning")
+                del content[max_bytes:]
+                break
+        return bytes(content)
+
+    def __parse(self, page_content, headers):
+        import lxml.html
+
+        if isinstance(page_content, str):
+            self.tree = lxml.html.document_fromstring(page_content)
+        else:
+            parser = lxml.html.HTMLParser(encoding=self.__encoding(page_content, headers))
+            self.tree = lxml.html.document_fromstring(page_content, parser=parser)
+
+    def __encoding(self, page_content, headers):
+        # The charset of the Content-Type header, else of a meta tag, else UTF-8
+        match = re.search(r'charset=["\']?([\w-]+)', headers.get('Content-Type', ''))
+        encoding = match.group(1) if match else None
+        if not encoding:
+            match = META_CHARSET.search(page_content, 0, 4096)
+            encoding = match.group(1).decode('ascii') if match else None
+        try:
+            codecs.lookup(encoding or '')
+        except LookupError:
+            return 'utf-8'
+        return encoding
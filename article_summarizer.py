@@ -1,67 +1,75 @@
-from openai import OpenAI
+import hashlib
+import logging
 
-from cache import ensure_cache_dir, create_cache_json, reuse_cache_json
+import prompts
+from summarization_engine import SummarizationEngine
+
+logger = logging.getLogger(__name__)
+
+
+def article_content_hash(article_title, article_content):
+    """
+    Identifies the extracted text of an article, whichever URL it was read from.
+    """
+    return hashlib.sha256(f'{article_title}\n{article_content}'.encode('utf-8')).hexdigest()
 
 
 class ArticleContentSummarizer:
+    """
+    Summaries are cached by the content hash of the article (see article_content_hash), so links
+    to the same text share one summary. article_content is only read when the summary is not cached,
+    it may be None for an article known to be summarized already.
+    """
+
     def __init__(self):
-        ensure_cache_dir()
-
-        self.client = OpenAI()
-        self.messages = []
-
-    def summarize(self, url, article_title, article_content):
-        print("=== SUMMARIZING ARTICLE ===")
-
-        result = reuse_cache_json(f'{url}_response')
-        if result:
-            return result
-
-        paragraph = self.__ask_assistant_persisting(
-            f"Summarize this article given its content into increasing levels of conciseness. Begin by summarizing it into a single paragraph.\nTitle: {article_title}\nContent: \n```{article_content}```\n\nDo not describe or mention the article itself. Simply summarize the points it makes. Focus on the overall or underlying takeaway, cause, reason, or answer BEYOND what's already in the title and description, which is already shown to the user. PROVIDE NO OTHER OUTPUT OTHER THAN THE PARAGRAPH.")
-        # sentence = self.__ask_assistant_persisting(
-        #     "Now summarize it into a single sentence. Focus on the overall or underlying takeaway, cause, reason, or answer BEYOND what's already in the title and description, which is already shown to the user. Basically, provide a single sentence answer to the question the video poses. PROVIDE NO OTHER OUTPUT OTHER THAN THE SENTENCE.")
-        # question = self.__ask_assistant_persisting(
-        #     f'Rephrase the video title into a single motivating question. Focus on the overall TOPIC or SUBJECT of the video. This could be just the video title verbatim, especially if it is already a question. Don\'t use information outside of the video title. For example, if the title is "This problem ...", the question would be "What problem ...?". As a reminder, here is the video title again: "{video_title}". PROVIDE NO OTHER OUTPUT OTHER THAN THE QUESTION.')
-        # word = self.__ask_assistant_persisting(
-        #     'Answer the question we just asked with just a single phrase, ideally one or two words. Examples: "Is EVOLUTION REAL?" -> "Yes." "Have scientists achieved fusion?" -> "No." "It depends." "Will AI take over the world?" -> "Nobody knows." "Why NO ONE lives here" -> "Poor geography." "Inside Disney\'s $1 BILLION disaster" -> "No market need." "Scientists FEAR this one thing" -> "Climate change." "Why is there war in the middle east?" -> "It\'s complicated." "Have we unlocked the secret to QUANTUM COMPUTING?" -> "Not really." "A day from Hell" -> "1999 Moore tornado" ... -> "Mostly." ... -> "Usually." PROVIDE NO OTHER OUTPUT OTHER THAN THE WORD(S) OF THE ANSWER.')
-        # search_term = self.__ask_assistant_persisting(
-        #     'Now suggest a search term for a Wikipedia search that replaces watching the video. Make the search SPECIFIC to the TOPIC of the video. For example: "The $6 Billion Transit Project with No Ridership" -> "FasTracks"; "Why NOBODY lives in this part of China" -> "Gobi Desert"; "This unknown professor REVOLUTIONIZED ..." -> "Joseph-Louis Lagrange"; "Every Computer Can Be Hacked!" -> "Zero-Day Vulnerability"; Provide the Wikipedia page name with no special punctuation:')
-        paragraph_pl = self.__ask_assistant_persisting(
-            f"Translate below text from English to Polish. Under no circumstances DO NOT change content, just provide translation.\n---\n{paragraph}")
-
-        response = {
-            'title': article_title,
-            'paragraph': paragraph,
-            'paragraph_pl': paragraph_pl,
-            # 'sentence': sentence,
-            # 'question': question,
-            # 'word': f'{word} ({search_term})',
-            # 'wikipedia': 'https://en.wikipedia.org/w/index.php?search=' + quote_plus(search_term)
-        }
-
-        create_cache_json(f'{article_title}_response', response)
-
-        return response
-
-    def __ask_assistant_persisting(self, instruction):
-        self.messages.append(
-            {
-                "role": "user",
-                "content": instruction
-            }
-        )
-        completion = self.client.chat.completions.create(
-            model="gpt-4o",
-            store=True,
-            messages=self.messages,
-        )
-        answer = completion.choices[0].message.content
-        self.messages.append(
-            {
-                "role": "assistant",
-                "content": answer
-            }
-        )
-        print(answer)
-        return answer
+        self.engine = SummarizationEngine()
+
+    def summarize(self, content_hash, article_title, article_content, on_stage=None):
+        logger.info(f"Summarizing article: {article_title}")
+
+        return self.engine.summarize(self.__cache_key(content_hash), article_title,
+                                     lambda: self.__summary_instruction(article_title, article_content), on_stage)
+
+    async def summarize_async(self, content_hash, article_title, article_content):
+        logger.info(f"Summarizing article: {article_title}")
+
+        return await self.engine.summarize_async(self.__cache_key(content_hash), article_title,
+                                                 lambda: self.__summary_instruction(article_title, article_content))
+
+    def summarize_stream(self, content_hash, article_title, article_content):
+        """
+        Generator variant of summarize, see SummarizationEngine.summarize_stream for the events.
+        """
+        logger.info(f"Summarizing article: {article_title}")
+
+        yield from self.engine.summarize_stream(self.__cache_key(content_hash), article_title,
+                                                lambda: self.__summary_instruction(article_title, article_content))
+
+    def summarize_batch(self, articles, backend):
+        """
+        Summarize many articles through a batch backend, see SummarizationEngine.summarize_batch.
+
+        Args:
+            articles: List of (content_hash, article_title, article_content) tuples
+            backend: Batch backend, e.g. openai_batch.OpenAIBatchBackend
+
+        Returns:
+            Dictionary of summaries keyed by content hash, None for articles that failed
+        """
+        logger.info(f"Summarizing {len(articles)} articles in batch")
+
+        results = self.engine.summarize_batch([
+            (self.__cache_key(content_hash), article_title,
+             lambda title=article_title, content=article_content: self.__summary_instruction(title, content))
+            for content_hash, article_title, article_content in articles
+        ], backend)
+        return {content_hash: results[self.__cache_key(content_hash)] for content_hash, _, _ in articles}
+
+    def is_cached(self, content_hash):
+        return self.engine.is_cached(self.__cache_key(content_hash))
+
+    def __cache_key(self, content_hash):
+        return prompts.summary_cache_key(f'article_{content_hash}')
+
+    def __summary_instruction(self, article_title, article_content):
+        return prompts.article_summary(article_title, article_content)
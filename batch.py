@@ -0,0 +1,244 @@
+import hmac
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import prompts
+from cache import reuse_cache_json
+from openai_batch import OpenAIBatchBackend
+from stage_limits import Overloaded
+from tldw import summarize_video, prepare_video_summary, complete_video_summary
+from youtube_info import YoutubeVideoInfoExtractor
+from youtube_summarizer import YoutubeSummarizer
+
+logger = logging.getLogger(__name__)
+
+# Batch configuration, read from the environment:
+#   BATCH_CONCURRENCY - videos summarized at once by a batch, requests may ask for less but not more (default: 4)
+#   BATCH_API_TOKEN   - bearer token the batch endpoint of the web servers requires, unset keeps the endpoint off
+#   BATCH_MAX_WAIT_SECONDS - how long a video rejected as overloaded (no stage slot, open circuit) is retried
+#                            before it is reported as failed with 'retry_after' (default: 300)
+DEFAULT_BATCH_CONCURRENCY = 4
+DEFAULT_BATCH_MAX_WAIT_SECONDS = 300
+
+STATUS_DONE = 'done'
+STATUS_SKIPPED = 'skipped'
+STATUS_FAILED = 'failed'
+
+
+def get_max_batch_concurrency():
+    return int(os.getenv('BATCH_CONCURRENCY', DEFAULT_BATCH_CONCURRENCY))
+
+
+def is_batch_api_enabled():
+    return bool(os.getenv('BATCH_API_TOKEN'))
+
+
+def is_batch_api_authorized(authorization):
+    """
+    Whether the Authorization header of a request carries the BATCH_API_TOKEN bearer token.
+    """
+    token = os.getenv('BATCH_API_TOKEN')
+    return bool(token) and hmac.compare_digest((authorization or '').encode('utf-8'), f'Bearer {token}'.encode('utf-8'))
+
+
+def is_valid_concurrency(concurrency):
+    return concurrency is None or (isinstance(concurrency, int) and not isinstance(concurrency, bool) and concurrency > 0)
+
+
+def summarize_videos(urls, concurrency=None, skip_cached=True, rate_limit=None):
+    """
+    Summarize many videos, yielding one dict per video as it completes and a final report.
+
+    Playlist and channel URLs are expanded to their videos, video ids are deduplicated and,
+    with skip_cached, videos whose summary is already cached are reported as skipped without running.
+    rate_limit(video_id) is asked before each video without a cached summary runs, it returns 0 to let it run
+    or the seconds to wait, the video is then reported as failed with 'retry_after'.
+
+    Items are {'video_id', 'status': done|skipped|failed, 'result' or 'error', 'seconds'}
+    ('url' instead of 'video_id' for URLs that could not be expanded, 'retry_after' for videos that stayed
+    overloaded for BATCH_MAX_WAIT_SECONDS),
+    the last yielded dict is {'report': {total, done, skipped, failed, seconds, videos_per_minute}}.
+    """
+    start = time.perf_counter()
+    concurrency = __concurrency(concurrency)
+    counts = {STATUS_DONE: 0, STATUS_SKIPPED: 0, STATUS_FAILED: 0}
+
+    pending = []
+    yield from __collect_pending(urls, skip_cached, counts, pending, rate_limit)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = [executor.submit(__summarize, video_id) for video_id in pending]
+        for future in as_completed(futures):
+            item = future.result()
+            counts[item['status']] += 1
+            yield item
+    finally:
+        # Closed early (the client went away), videos not started yet are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    yield __report(counts, start)
+
+
+def summarize_videos_with_openai_batch(urls, concurrency=None, skip_cached=True, backend=None):
+    """
+    Same as summarize_videos, but every completion goes through the OpenAI Batch API
+    (see openai_batch.OpenAIBatchBackend), for backfills that do not need interactive latency.
+
+    Metadata and captions are downloaded with the given concurrency, then all summaries are submitted
+    in one batch and their translations in a second one. Items are yielded when everything finished,
+    'seconds' of an item is the time until its result was available.
+    """
+    start = time.perf_counter()
+    concurrency = __concurrency(concurrency)
+    counts = {STATUS_DONE: 0, STATUS_SKIPPED: 0, STATUS_FAILED: 0}
+
+    pending = []
+    yield from __collect_pending(urls, skip_cached, counts, pending)
+
+    videos = {}
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for video_id, prepared in zip(pending, executor.map(__prepare, pending)):
+            if isinstance(prepared, Exception):
+                counts[STATUS_FAILED] += 1
+                yield {'video_id': video_id, **__failure(prepared), 'seconds': round(time.perf_counter() - start, 3)}
+            else:
+                videos[video_id] = prepared
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    summaries = YoutubeSummarizer().summarize_batch([
+        (video_id, caption_text, video_info.get('fulltitle'), video_info.get('description'))
+        for video_id, (video_info, caption_text) in videos.items()
+    ], backend or OpenAIBatchBackend())
+
+    for video_id, (video_info, _) in videos.items():
+        if summaries.get(video_id):
+            item = {'video_id': video_id, 'status': STATUS_DONE,
+                    'result': complete_video_summary(video_info, summaries[video_id])}
+        else:
+            item = {'video_id': video_id, 'status': STATUS_FAILED, 'error': f'Failed to summarize video: {video_id}'}
+        item['seconds'] = round(time.perf_counter() - start, 3)
+        counts[item['status']] += 1
+        yield item
+
+    yield __report(counts, start)
+
+
+def __concurrency(concurrency):
+    return max(1, min(concurrency or get_max_batch_concurrency(), get_max_batch_concurrency()))
+
+
+def __collect_pending(urls, skip_cached, counts, pending, rate_limit=None):
+    """
+    Yields items of the URLs that failed to expand, of the videos skipped as cached and of the videos refused
+    by rate_limit, appends the rest to pending.
+    """
+    for video_id, url, error in __expand_video_ids(urls):
+        if error:
+            counts[STATUS_FAILED] += 1
+            yield {'url': url, 'status': STATUS_FAILED, 'error': error, 'seconds': 0}
+            continue
+
+        cached = bool(reuse_cache_json(prompts.summary_cache_key(video_id)))
+        retry_after = rate_limit(video_id) if rate_limit and not cached else 0
+        if skip_cached and cached:
+            counts[STATUS_SKIPPED] += 1
+            yield {'video_id': video_id, 'status': STATUS_SKIPPED, 'seconds': 0}
+        elif retry_after:
+            counts[STATUS_FAILED] += 1
+            yield {'video_id': video_id, 'status': STATUS_FAILED, 'error': 'Rate limit exceeded',
+                   'retry_after': math.ceil(retry_after), 'seconds': 0}
+        else:
+            pending.append(video_id)
+
+
+def __report(counts, start):
+    seconds = time.perf_counter() - start
+    return {'report': {
+        'total': sum(counts.values()),
+        **counts,
+        'seconds': round(seconds, 3),
+        # Only videos that ran the pipeline count towards throughput
+        'videos_per_minute': round(counts[STATUS_DONE] / seconds * 60, 2) if seconds else 0,
+    }}
+
+
+def __expand_video_ids(urls):
+    """
+    Yields (video_id, url, None) for every distinct video of the given URLs,
+    (None, url, error) for URLs that could not be expanded.
+    """
+    extractor = YoutubeVideoInfoExtractor()
+    seen = set()
+    for url in urls:
+        url = url.strip()
+        if not url:
+            continue
+        try:
+            if YoutubeVideoInfoExtractor.is_video_url(url):
+                video_ids = [YoutubeVideoInfoExtractor.extract_video_id(url)]
+            else:
+                video_ids = extractor.extract_playlist_video_ids(url)
+        except Exception as e:
+            yield None, url, str(e)
+            continue
+
+        for video_id in video_ids:
+            if video_id not in seen:
+                seen.add(video_id)
+                yield video_id, url, None
+
+
+def __prepare(video_id):
+    try:
+        return __when_available(video_id, lambda: prepare_video_summary(__video_url(video_id)))
+    except Exception as e:
+        logger.error(f"Error preparing {video_id}: {str(e)}")
+        return e
+
+
+def __video_url(video_id):
+    return f'https://www.youtube.com/watch?v={video_id}'
+
+
+def __summarize(video_id):
+    start = time.perf_counter()
+    try:
+        result = __when_available(video_id, lambda: summarize_video(__video_url(video_id)))
+        item = {'video_id': video_id, 'status': STATUS_DONE, 'result': result}
+    except Exception as e:
+        logger.exception(f"Error summarizing {video_id}: {str(e)}")
+        item = {'video_id': video_id, **__failure(e)}
+
+    item['seconds'] = round(time.perf_counter() - start, 3)
+    return item
+
+
+def __failure(e):
+    failure = {'status': STATUS_FAILED, 'error': str(e)}
+    if isinstance(e, Overloaded):
+        failure['retry_after'] = e.retry_after
+    return failure
+
+
+def __when_available(video_id, fn):
+    """
+    Call fn until it is not rejected with Overloaded (a stage without a free slot, an open circuit),
+    waiting the retry_after of every rejection. A batch has no client to send back, it waits its turn,
+    but for BATCH_MAX_WAIT_SECONDS at most; the last rejection is raised then.
+    """
+    deadline = time.monotonic() + float(os.getenv('BATCH_MAX_WAIT_SECONDS', DEFAULT_BATCH_MAX_WAIT_SECONDS))
+    while True:
+        try:
+            return fn()
+        except Overloaded as e:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise
+            logger.warning(f"Retrying {video_id} in {e.retry_after}s: {str(e)}")
+            time.sleep(min(e.retry_after, remaining))
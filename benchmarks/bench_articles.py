@@ -0,0 +1,118 @@
+"""
+Compare the lxml article extractor with the original BeautifulSoup ('html.parser') implementation.
+
+Checks that both find the same title and content (golden output) and reports their speed
+and peak Python memory per page (the C tree of lxml is not traced).
+
+Usage: python benchmarks/bench_articles.py [--repeat N] [--heavy BLOCKS] [page.html ...]
+
+Without files, runs over the saved pages in benchmarks/fixtures/articles. With --heavy, every page
+is also measured with the given number of navigation, comment and script blocks added around
+the article, the way large news pages look.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from article_content import ArticleContentExtractor  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'articles')
+
+BOILERPLATE_BLOCK = (
+    '<div class="teaser"><a href="/story/{i}"><img src="/img/{i}.jpg" alt="">'
+    '<span class="headline">Related story number {i}</span></a>'
+    '<ul class="tags"><li><a href="/tag/a">a</a></li><li><a href="/tag/b">b</a></li></ul>'
+    '<div class="comment"><p>Comment {i} on an unrelated story.</p></div>'
+    '<script>window.slots = (window.slots || []).concat([{i}]);</script></div>\n'
+)
+
+
+def legacy_extract(page_content):
+    """
+    The BeautifulSoup based implementation the lxml extractor replaced, kept as the reference.
+    """
+    soup = BeautifulSoup(page_content, 'html.parser')
+    if soup.find('h1'):
+        title = soup.find('h1').get_text()
+    else:
+        raise Exception('Title not found')
+
+    content = ""
+    if soup.find('article'):
+        texts = soup.find('article').find_all('p')
+        content = "\n".join([p.get_text() for p in texts])
+    elif soup.find(class_="article-body"):
+        texts = soup.find(class_="article-body").find_all('p')
+        content = "\n".join([p.get_text() for p in texts])
+    return {"title": title.strip(), "content": content.strip()}
+
+
+def extract(page_content):
+    return ArticleContentExtractor(None, page_content).run()
+
+
+def make_heavy(page_content, blocks):
+    boilerplate = ''.join(BOILERPLATE_BLOCK.format(i=i) for i in range(blocks)).encode('utf-8')
+    head, separator, rest = page_content.partition(b'<body')
+    body_start = rest.index(b'>') + 1
+    page_content = head + separator + rest[:body_start] + boilerplate + rest[body_start:]
+    return page_content.replace(b'</body>', boilerplate + b'</body>')
+
+
+def measure(parse, content, repeat):
+    tracemalloc.start()
+    parse(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = parse(content)
+    return result, (time.perf_counter() - start) / repeat, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Article extraction benchmark')
+    parser.add_argument('files', nargs='*', help='Saved HTML pages (default: bundled fixtures)')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per page and implementation (default: 20)')
+    parser.add_argument('--heavy', type=int, default=500,
+                        help='Boilerplate blocks added around the article for the heavy variant, 0 skips it '
+                             '(default: 500)')
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.files or sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+        with open(path, 'rb') as f:
+            content = f.read()
+        pages.append((os.path.basename(path), content))
+        if args.heavy:
+            pages.append((f'{os.path.basename(path)} (heavy)', make_heavy(content, args.heavy)))
+
+    results = []
+    for name, content in pages:
+        legacy_result, legacy_seconds, legacy_peak = measure(legacy_extract, content, args.repeat)
+        result, seconds, peak = measure(extract, content, args.repeat)
+        results.append({
+            'page': name,
+            'bytes': len(content),
+            'identical': result == legacy_result,
+            'legacy_ms': round(legacy_seconds * 1000, 3),
+            'lxml_ms': round(seconds * 1000, 3),
+            'speedup': round(legacy_seconds / seconds, 1),
+            'legacy_peak_bytes': legacy_peak,
+            'lxml_peak_bytes': peak,
+        })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
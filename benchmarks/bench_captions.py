@@ -0,0 +1,311 @@
+"""
+Compare the caption parser with the original webvtt-py based implementation.
+
+Checks that both produce identical text (golden output) and reports their speed and peak memory.
+Generated manual captions are also rendered as srt, json3, srv3 and ttml, and each native parser
+is checked against the text of the VTT path and timed; this only round-trips the cues through
+render_captions.
+
+Automatic captions are checked against tracks of the same video in YouTube's own layouts
+(fixtures/captions/asr: NAME.vtt with NAME.json3 and/or NAME.srv3). Every format preferred over vtt
+for automatic captions (AUTOMATIC_CAPTION_FORMAT_PRIORITIES) has to give the text of the vtt track.
+
+Usage: python benchmarks/bench_captions.py [--minutes N] [captions.vtt ...]
+
+Without files, runs over generated YouTube-style captions (automatic rolling captions and
+manual subtitles) of the given length.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import webvtt  # noqa: E402
+
+from time_utils import ts_to_secs, seconds_to_timestamp, timestamp_to_seconds  # noqa: E402
+from youtube_captions import (  # noqa: E402
+    AUTOMATIC_CAPTION_FORMAT_PRIORITIES, CAPTION_PARSERS, iter_vtt_cues, dedupe_yt_cues, join_cues)
+
+ASR_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'captions', 'asr')
+
+WORDS = ('the rocket engine pushes exhaust gas out of nozzle and pressure turns into thrust while '
+         'every kilogram of fuel has to lift all fuel burned after it so we build stages').split()
+
+
+def parse_captions(content):
+    return join_cues(dedupe_yt_cues(iter_vtt_cues(content)))
+
+
+def legacy_parse_captions(content):
+    """
+    The webvtt-py based implementation the single-pass parser replaced, kept as the reference.
+    """
+    captions = webvtt.from_string(content)
+    result = ''
+
+    captions = list(legacy_dedupe_yt_captions(captions))
+
+    for i, caption in enumerate(captions):
+        current_text = caption.text.replace('\n', ' ').strip()
+
+        if i > 0:
+            prev_end = timestamp_to_seconds(captions[i - 1].end)
+            current_start = timestamp_to_seconds(caption.start)
+            time_diff = current_start - prev_end
+
+            if time_diff >= 2:
+                result += '\n\n'
+            elif time_diff >= 1:
+                result += '\n'
+            else:
+                result += ' '
+
+        result += current_text
+
+    return ' '.join(re.split(' +', result))
+
+
+def legacy_dedupe_yt_captions(subs_iter):
+    previous_subtitle = None
+    for subtitle in subs_iter:
+
+        if previous_subtitle is None:
+            previous_subtitle = subtitle
+            continue
+
+        subtitle.text = subtitle.text.strip()
+
+        if len(subtitle.text) == 0:
+            continue
+
+        if (ts_to_secs(subtitle.start_time) - ts_to_secs(subtitle.end_time) < 0.15 and
+                subtitle.text in previous_subtitle.text):
+            previous_subtitle.end = subtitle.end
+            continue
+
+        current_lines = subtitle.text.split("\n")
+        last_lines = previous_subtitle.text.split("\n")
+
+        singleword = False
+
+        if current_lines[0] == last_lines[-1]:
+            if len(last_lines) == 1:
+                if len(last_lines[0].split(" ")) < 2 and len(last_lines[0]) > 2:
+                    singleword = True
+                    subtitle.text = current_lines[0] + " " + "\n".join(current_lines[1:])
+                else:
+                    subtitle.text = "\n".join(current_lines[1:])
+            else:
+                subtitle.text = "\n".join(current_lines[1:])
+        else:
+            if len(subtitle.text.split(" ")) <= 2:
+                previous_subtitle.end = subtitle.end
+                title_text = subtitle.text
+                if title_text[0] != " ":
+                    title_text = " " + title_text
+
+                previous_subtitle.text += title_text
+                continue
+
+        if ts_to_secs(subtitle.start_time) <= ts_to_secs(previous_subtitle.end_time):
+            new_time = max(ts_to_secs(subtitle.start_time) - 0.001, 0)
+            previous_subtitle.end = seconds_to_timestamp(new_time)
+        if ts_to_secs(subtitle.start_time) >= ts_to_secs(subtitle.end_time):
+            subtitle.start, subtitle.end = subtitle.end, subtitle.start
+
+        if not singleword:
+            yield previous_subtitle
+        previous_subtitle = subtitle
+    yield previous_subtitle
+
+
+def generate_automatic_captions(minutes, seed=1):
+    """
+    Rolling two-line captions with word-level timing tags, like YouTube automatic captions.
+    """
+    rnd = random.Random(seed)
+    lines = ['WEBVTT', 'Kind: captions', 'Language: en', '']
+    previous_line = ''
+    ms = 0
+    while ms < minutes * 60000:
+        words = [rnd.choice(WORDS) for _ in range(rnd.randint(1, 8))]
+        duration = rnd.randint(800, 3500)
+        tagged = words[0] + ''.join(
+            f'<{seconds_to_timestamp((ms + (i + 1) * duration // len(words)) / 1000)}><c> {word}</c>'
+            for i, word in enumerate(words[1:]))
+
+        lines += [f'{seconds_to_timestamp(ms / 1000)} --> {seconds_to_timestamp((ms + duration) / 1000)} '
+                  f'align:start position:0%', previous_line or ' ', tagged, '']
+        ms += duration
+        plain = ' '.join(words)
+        lines += [f'{seconds_to_timestamp(ms / 1000)} --> {seconds_to_timestamp((ms + 10) / 1000)} '
+                  f'align:start position:0%', plain, ' ', '']
+        ms += 10 + rnd.choice([0, 0, 0, 0, 400, 1200, 2500])
+        previous_line = plain
+
+    return '\n'.join(lines)
+
+
+def generate_manual_captions(minutes, seed=2):
+    rnd = random.Random(seed)
+    lines = ['WEBVTT', '']
+    ms = 0
+    index = 1
+    while ms < minutes * 60000:
+        duration = rnd.randint(1000, 5000)
+        text = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 14)))
+        if rnd.random() < 0.3:
+            text = text.replace(' ', '\n', 1)
+        lines += [str(index), f'{seconds_to_timestamp(ms / 1000)} --> {seconds_to_timestamp((ms + duration) / 1000)}',
+                  text, '']
+        ms += duration + rnd.choice([0, 0, 200, 1100, 2400])
+        index += 1
+
+    return '\n'.join(lines)
+
+
+def __srt_timestamp(ms):
+    return seconds_to_timestamp(ms / 1000).replace('.', ',')
+
+
+def render_captions(cues, ext):
+    """
+    Render [start_ms, end_ms, text] cues in the given caption format, the way YouTube serves it.
+    """
+    if ext == 'srt':
+        return '\n'.join(f'{i}\n{__srt_timestamp(start)} --> {__srt_timestamp(end)}\n{text}\n'
+                         for i, (start, end, text) in enumerate(cues, 1))
+    if ext == 'json3':
+        return json.dumps({'wireMagic': 'pb3', 'events': [
+            {'tStartMs': start, 'dDurationMs': end - start, 'segs': [{'utf8': text}]}
+            for start, end, text in cues
+        ]})
+    if ext == 'srv3':
+        body = ''.join(f'<p t="{start}" d="{end - start}">{escape(text)}</p>' for start, end, text in cues)
+        return f'<?xml version="1.0" encoding="utf-8" ?><timedtext format="3"><body>{body}</body></timedtext>'
+    if ext == 'ttml':
+        body = ''.join(
+            f'<p begin="{seconds_to_timestamp(start / 1000)}" end="{seconds_to_timestamp(end / 1000)}">'
+            f'{escape(text).replace(chr(10), "<br />")}</p>'
+            for start, end, text in cues)
+        return (f'<?xml version="1.0" encoding="utf-8" ?><tt xml:lang="en" xmlns="http://www.w3.org/ns/ttml">'
+                f'<body><div>{body}</div></body></tt>')
+    raise ValueError(f'Unsupported caption format: {ext}')
+
+
+def compare_automatic_tracks(fixtures_dir):
+    """
+    Text of the json3 and srv3 tracks of each fixture against its vtt track, with the paragraph breaks
+    (pauses of 2 seconds or more) each of them kept.
+    """
+    results = []
+    for file_name in sorted(os.listdir(fixtures_dir)):
+        name, ext = os.path.splitext(file_name)
+        if ext != '.vtt':
+            continue
+        with open(os.path.join(fixtures_dir, file_name), encoding='utf-8') as f:
+            golden = parse_captions(f.read())
+
+        for other in ('json3', 'srv3'):
+            path = os.path.join(fixtures_dir, f'{name}.{other}')
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as f:
+                text = join_cues(dedupe_yt_cues(CAPTION_PARSERS[other](f.read())))
+            results.append({
+                'input': name,
+                'format': other,
+                'identical': text == golden,
+                'paragraph_breaks': text.count('\n\n'),
+                'vtt_paragraph_breaks': golden.count('\n\n'),
+                'preferred_over_vtt': __preferred_over_vtt(other),
+            })
+    return results
+
+
+def __preferred_over_vtt(ext):
+    return AUTOMATIC_CAPTION_FORMAT_PRIORITIES.index(ext) < AUTOMATIC_CAPTION_FORMAT_PRIORITIES.index('vtt')
+
+
+def measure(parse, content, repeat):
+    tracemalloc.start()
+    parse(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = parse(content)
+    return result, (time.perf_counter() - start) / repeat, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Caption parser benchmark')
+    parser.add_argument('files', nargs='*', help='WebVTT files (default: generated captions)')
+    parser.add_argument('--minutes', type=int, default=180, help='Length of generated captions (default: 180)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per input (default: 3)')
+    parser.add_argument('--asr-fixtures', default=ASR_FIXTURES_DIR,
+                        help='Directory of automatic caption tracks of the same videos (default: fixtures/captions/asr)')
+    args = parser.parse_args()
+
+    inputs = []
+    for path in args.files:
+        with open(path, encoding='utf-8') as f:
+            inputs.append((os.path.basename(path), f.read()))
+    if not inputs:
+        inputs = [
+            ('automatic', generate_automatic_captions(args.minutes)),
+            ('manual', generate_manual_captions(args.minutes)),
+        ]
+
+    results = []
+    identical = True
+    for name, content in inputs:
+        legacy_text, legacy_seconds, legacy_peak = measure(legacy_parse_captions, content, args.repeat)
+        text, seconds, peak = measure(parse_captions, content, args.repeat)
+        identical &= text == legacy_text
+        results.append({
+            'input': name,
+            'bytes': len(content),
+            'identical': text == legacy_text,
+            'legacy_seconds': round(legacy_seconds, 4),
+            'seconds': round(seconds, 4),
+            'speedup': round(legacy_seconds / seconds, 2),
+            'legacy_peak_bytes': legacy_peak,
+            'peak_bytes': peak,
+        })
+
+    manual = generate_manual_captions(args.minutes)
+    golden = parse_captions(manual)
+    cues = list(iter_vtt_cues(manual))
+    formats = []
+    for ext, iter_cues in CAPTION_PARSERS.items():
+        content = manual if ext == 'vtt' else render_captions(cues, ext)
+        text, seconds, peak = measure(lambda c: join_cues(dedupe_yt_cues(iter_cues(c))), content, args.repeat)
+        identical &= text == golden
+        formats.append({
+            'format': ext,
+            'bytes': len(content),
+            'identical': text == golden,
+            'seconds': round(seconds, 4),
+            'peak_bytes': peak,
+        })
+
+    automatic_tracks = compare_automatic_tracks(args.asr_fixtures)
+    # A format may only be preferred for automatic captions once it reads them like the vtt track
+    identical &= all(track['identical'] for track in automatic_tracks if track['preferred_over_vtt'])
+
+    print(json.dumps({'inputs': results, 'formats': formats, 'automatic_tracks': automatic_tracks}, indent=4))
+    if not identical:
+        sys.exit('Output differs from the reference output')
+
+
+if __name__ == '__main__':
+    main()
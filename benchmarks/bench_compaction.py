@@ -0,0 +1,56 @@
+"""
+Report how much transcript compaction reduces the input sent to the summarizer.
+
+Usage: python benchmarks/bench_compaction.py [--budget TOKENS] [transcript.txt ...]
+
+Without arguments, runs over the transcripts in benchmarks/fixtures/transcripts.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transcript_compaction import compact_transcript  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'transcripts')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcript compaction benchmark')
+    parser.add_argument('files', nargs='*', help='Transcript files (default: bundled fixtures)')
+    parser.add_argument('--budget', type=int, default=None, help='Token budget passed to compaction')
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.txt')))
+    results = []
+    for path in files:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+
+        start = time.perf_counter()
+        _, stats = compact_transcript(text, args.budget)
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            'file': os.path.basename(path),
+            **stats,
+            'ratio': round(stats['tokens_after'] / max(stats['tokens_before'], 1), 3),
+            'seconds': round(elapsed, 6),
+        })
+
+    tokens_before = sum(result['tokens_before'] for result in results)
+    tokens_after = sum(result['tokens_after'] for result in results)
+    print(json.dumps({
+        'files': results,
+        'tokens_before': tokens_before,
+        'tokens_after': tokens_after,
+        'ratio': round(tokens_after / max(tokens_before, 1), 3),
+    }, indent=4))
+
+
+if __name__ == '__main__':
+    main()
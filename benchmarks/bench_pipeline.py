@@ -0,0 +1,275 @@
+"""
+End-to-end benchmark of the summarization pipeline, without network access or OpenAI costs.
+
+Recorded yt-dlp info dicts (fixtures/videos) are replayed in place of YouTube, caption tracks and
+article pages are served from fixtures by a local stub (see stub_server.py), which also answers
+OpenAI completions deterministically after a fixed latency. Every run starts from an empty cache
+in a temporary directory.
+
+Reports, as JSON:
+    sequential - cold (nothing cached) and warm (result cached) latency of videos and articles
+    stages     - time spent per pipeline stage during the cold runs
+    concurrent - throughput and latency percentiles of the Flask app (tldw-web.py) served by waitress
+    memory     - peak Python allocations of a single cold pipeline run and the peak RSS of the process
+
+Usage: python benchmarks/bench_pipeline.py [--videos N] [--articles N] [--requests N]
+                                           [--concurrency N] [--openai-latency SECONDS] [--output FILE]
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import logging
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_server import StubServer, FIXTURES_DIR  # noqa: E402
+
+VIDEO_TEMPLATES = sorted(glob.glob(os.path.join(FIXTURES_DIR, 'videos', '*.json')))
+ARTICLE_PAGES = sorted(os.path.basename(path) for path in glob.glob(os.path.join(FIXTURES_DIR, 'articles', '*.html')))
+
+
+class FixtureYoutubeDLPool:
+    """
+    Stands in for youtube_info.ydl_pool, extractions return a recorded info dict instead of calling YouTube.
+
+    Video ids are assigned to the templates round-robin, {video_id} and {base_url} are filled in on extraction.
+    Caption tracks are requested with the video id as the stub's permutation seed, so videos sharing a template
+    still have distinct transcripts and do not share prompt prefixes beyond the instructions.
+    """
+
+    def __init__(self, base_url, latency):
+        self.base_url = base_url
+        self.latency = latency
+        self.templates = []
+        for path in VIDEO_TEMPLATES:
+            with open(path, encoding='utf-8') as f:
+                self.templates.append(f.read())
+
+    @contextmanager
+    def acquire(self, ydl_opts):
+        yield self
+
+    def extract_info(self, url, download=False):
+        from youtube_info import YoutubeVideoInfoExtractor
+
+        video_id = YoutubeVideoInfoExtractor.extract_video_id(url)
+        time.sleep(self.latency)
+        template = self.templates[int(video_id[1:]) % len(self.templates)]
+        video_info = json.loads(template.replace('{video_id}', video_id).replace('{base_url}', self.base_url))
+        for tracks in (video_info.get('subtitles') or {}, video_info.get('automatic_captions') or {}):
+            for track in (track for language_tracks in tracks.values() for track in language_tracks):
+                track['url'] += f'?v={video_id}'
+        return video_info
+
+
+def video_url(n):
+    # Synthetic 11 character ids, each run of the benchmark uses its own range
+    return f'https://www.youtube.com/watch?v=b{n:010d}'
+
+
+def article_url(base_url, n):
+    return f'{base_url}/articles/{ARTICLE_PAGES[n % len(ARTICLE_PAGES)]}?n={n}'
+
+
+def latency_stats(latencies):
+    if not latencies:
+        return {'count': 0}
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'p50': __percentile(ordered, 50),
+        'p95': __percentile(ordered, 95),
+        'p99': __percentile(ordered, 99),
+        'max': ordered[-1],
+    }
+
+
+def __percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))]
+
+
+def stage_stats(before, after):
+    """
+    Count and total seconds of every tldw_stage_seconds stage recorded between two metrics snapshots.
+    """
+    totals = {}
+    for snapshot, sign in ((after, 1), (before, -1)):
+        for sample in snapshot.get('tldw_stage_seconds', []):
+            stage = totals.setdefault(sample['labels']['stage'], {'count': 0, 'seconds': 0.0})
+            stage['count'] += sign * sample['count']
+            stage['seconds'] += sign * sample['sum']
+    return {name: {**stage, 'mean': stage['seconds'] / stage['count']}
+            for name, stage in sorted(totals.items()) if stage['count']}
+
+
+def run_sequential(summarize, urls):
+    latencies = []
+    for url in urls:
+        start = time.perf_counter()
+        summarize(url)
+        latencies.append(time.perf_counter() - start)
+    return latency_stats(latencies)
+
+
+def run_concurrent(base_url, path, urls, concurrency):
+    import requests
+
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def post(url):
+        start = time.perf_counter()
+        response = session.post(f'{base_url}{path}', json={'url': url})
+        return response.status_code, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(post, urls))
+    elapsed = time.perf_counter() - start
+    session.close()
+
+    return {
+        'requests': len(results),
+        'errors': len([status for status, _ in results if status != 200]),
+        'seconds': elapsed,
+        'requests_per_second': len(results) / elapsed,
+        'latency': latency_stats([seconds for _, seconds in results]),
+    }
+
+
+def load_web_app():
+    spec = importlib.util.spec_from_file_location('tldw_web', os.path.join(ROOT_DIR, 'tldw-web.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pipeline benchmark over local fixtures')
+    parser.add_argument('--videos', type=int, default=10, help='Videos summarized sequentially (default: 10)')
+    parser.add_argument('--articles', type=int, default=10, help='Articles summarized sequentially (default: 10)')
+    parser.add_argument('--requests', type=int, default=100,
+                        help='Requests per phase of the concurrent run, all distinct videos (default: 100)')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='Concurrent clients and server threads (default: 16)')
+    parser.add_argument('--openai-latency', type=float, default=0.2,
+                        help='Seconds every stub completion takes (default: 0.2)')
+    parser.add_argument('--ytdlp-latency', type=float, default=0.0,
+                        help='Seconds every replayed info extraction takes (default: 0)')
+    parser.add_argument('--languages', default='pl', help='SUMMARY_LANGUAGES of the run (default: pl)')
+    parser.add_argument('--output', help='Also write the results to this file')
+    args = parser.parse_args()
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    stub = StubServer(openai_latency=args.openai_latency).start()
+
+    # The pipeline reads its configuration on import and keeps its cache in ./cache
+    work_dir = tempfile.mkdtemp(prefix='tldw-bench-')
+    os.chdir(work_dir)
+    os.environ.update({
+        'OPENAI_BASE_URL': f'{stub.base_url}/v1',
+        'OPENAI_API_KEY': 'bench',
+        'SUMMARY_LANGUAGES': args.languages,
+        'RATE_LIMIT_MISS_PER_MINUTE': '1000000',
+        'RATE_LIMIT_HIT_PER_MINUTE': '1000000',
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+    })
+    logging.basicConfig(level=os.environ['LOG_LEVEL'])
+
+    import metrics
+    import youtube_info
+    from tldr import summarize_article
+    from tldw import summarize_video
+
+    youtube_info.ydl_pool = FixtureYoutubeDLPool(stub.base_url, args.ytdlp_latency)
+
+    results = {
+        'config': {
+            'videos': args.videos,
+            'articles': args.articles,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'openai_latency': args.openai_latency,
+            'ytdlp_latency': args.ytdlp_latency,
+            'languages': args.languages,
+        },
+    }
+
+    # Sequential, in process
+    video_urls = [video_url(n) for n in range(args.videos)]
+    article_urls = [article_url(stub.base_url, n) for n in range(args.articles)]
+
+    before = metrics.snapshot()
+    video_cold = run_sequential(summarize_video, video_urls)
+    after_videos = metrics.snapshot()
+    article_cold = run_sequential(summarize_article, article_urls)
+    after_articles = metrics.snapshot()
+
+    results['sequential'] = {
+        'youtube': {'cold': video_cold, 'warm': run_sequential(summarize_video, video_urls)},
+        'article': {'cold': article_cold, 'warm': run_sequential(summarize_article, article_urls)},
+    }
+    results['stages'] = {
+        'youtube': stage_stats(before, after_videos),
+        'article': stage_stats(after_videos, after_articles),
+    }
+
+    # Concurrent, through the web app
+    from waitress import create_server
+
+    server = create_server(load_web_app(), host='127.0.0.1', port=0, threads=args.concurrency)
+    # Runs until the benchmark exits, closing the sockets under the running loop makes it fail
+    threading.Thread(target=server.run, daemon=True).start()
+    app_url = f'http://127.0.0.1:{server.effective_port}'
+
+    concurrent_urls = [video_url(args.videos + n) for n in range(args.requests)]
+    results['concurrent'] = {
+        'cold': run_concurrent(app_url, '/api/summarize/youtube', concurrent_urls, args.concurrency),
+        'warm': run_concurrent(app_url, '/api/summarize/youtube', concurrent_urls, args.concurrency),
+    }
+
+    # Memory of a single cold run per fixture
+    peaks = []
+    for n in range(len(VIDEO_TEMPLATES)):
+        tracemalloc.start()
+        summarize_video(video_url(args.videos + args.requests + n))
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    results['memory'] = {
+        'pipeline_peak_bytes': max(peaks),
+        # ru_maxrss is reported in kilobytes on Linux
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+    results['openai'] = {
+        'completions': stub.completions,
+        'tokens': {sample['labels']['type']: sample['value']
+                   for sample in metrics.snapshot().get('tldw_openai_tokens_total', [])},
+    }
+    stub.stop()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Cold start benchmark of the entry points.
+
+Every measurement runs in a fresh interpreter:
+    cli - tldw-cmd.py answering a video whose result is cached, the whole run timed from the outside
+    web - importing tldw-web.py (the app is created, the server is not started)
+
+For both, `python -X importtime` reports the total import time, the slowest modules imported directly
+by the entry point and which of the heavy dependencies (yt-dlp, openai, HTTP clients, lxml) were loaded.
+`python -c pass` is timed as well, the interpreter startup that no change to the code can remove.
+
+Usage: python benchmarks/bench_startup.py [--repeat N] [--top N] [--target-ms MS]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+VIDEO_URL = f'https://www.youtube.com/watch?v={VIDEO_ID}'
+HEAVY_MODULES = ['yt_dlp', 'openai', 'requests', 'httpx', 'lxml', 'bs4']
+
+IMPORT_WEB = (
+    "import importlib.util; "
+    f"spec = importlib.util.spec_from_file_location('tldw_web', {os.path.join(ROOT_DIR, 'tldw-web.py')!r}); "
+    "spec.loader.exec_module(importlib.util.module_from_spec(spec))"
+)
+
+
+def prepare_cache(work_dir):
+    # The result is stored the way summarize_video stores it, so the CLI finds it with the same key
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        from tldw import complete_video_summary
+        complete_video_summary(
+            {'id': VIDEO_ID, 'title': 'Cached video', 'duration': 212, 'webpage_url': VIDEO_URL},
+            {'title': 'Cached video', 'paragraph': 'A cached summary.'})
+    finally:
+        os.chdir(cwd)
+
+
+def run(command, work_dir, env):
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=work_dir, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise Exception(f'{" ".join(command)} failed: {process.stderr}')
+    return elapsed, process.stderr
+
+
+def timings(command, work_dir, env, repeat):
+    seconds = [run(command, work_dir, env)[0] for _ in range(repeat)]
+    return {
+        'min_ms': round(min(seconds) * 1000, 1),
+        'median_ms': round(statistics.median(seconds) * 1000, 1),
+        'max_ms': round(max(seconds) * 1000, 1),
+    }
+
+
+def import_profile(command, work_dir, env, top):
+    """
+    Parse the -X importtime report: 'import time: self [us] | cumulative | imported package',
+    nested imports are indented by two spaces per level.
+    """
+    _, stderr = run([command[0], '-X', 'importtime', *command[1:]], work_dir, env)
+
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+
+    loaded = {name for name, _, _, _ in modules}
+    top_level = sorted((module for module in modules if module[3] == 0), key=lambda module: -module[2])
+    return {
+        'modules': len(modules),
+        'import_ms': round(sum(self_us for _, self_us, _, _ in modules) / 1000, 1),
+        'slowest_top_level': [{'module': name, 'cumulative_ms': round(cumulative_us / 1000, 1)}
+                              for name, _, cumulative_us, _ in top_level[:top]],
+        'heavy_loaded': [name for name in HEAVY_MODULES if name in loaded],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Entry point cold start benchmark')
+    parser.add_argument('--repeat', type=int, default=10, help='Timed runs per entry point (default: 10)')
+    parser.add_argument('--top', type=int, default=10, help='Slowest top-level imports listed (default: 10)')
+    parser.add_argument('--target-ms', type=float, default=200,
+                        help='Median wall time a cached CLI run should stay under (default: 200)')
+    args = parser.parse_args()
+
+    # The entry points keep their cache in ./cache, they run in a temporary directory with one cached video
+    work_dir = tempfile.mkdtemp(prefix='tldw-startup-')
+    env = {**os.environ, 'LOG_LEVEL': 'WARNING', 'PYTHONPATH': ROOT_DIR}
+    try:
+        prepare_cache(work_dir)
+
+        cli = [sys.executable, os.path.join(ROOT_DIR, 'tldw-cmd.py'), VIDEO_URL]
+        web = [sys.executable, '-c', IMPORT_WEB]
+        results = {
+            'interpreter': timings([sys.executable, '-c', 'pass'], work_dir, env, args.repeat),
+            'cli': {**timings(cli, work_dir, env, args.repeat), **import_profile(cli, work_dir, env, args.top)},
+            'web': {**timings(web, work_dir, env, args.repeat), **import_profile(web, work_dir, env, args.top)},
+        }
+        results['cli']['target_ms'] = args.target_ms
+        results['cli']['meets_target'] = results['cli']['median_ms'] < args.target_ms
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,446 @@
+"""
+Local stand-in for the upstreams of the pipeline, used by bench_pipeline.py and the tests.
+
+Serves recorded caption tracks and article pages from benchmarks/fixtures, and a deterministic
+OpenAI-compatible chat completions endpoint: the answer is derived from a hash of the prompt,
+so repeated runs produce the same summaries, every completion takes a fixed latency, and the
+usage reports prompt prefixes seen before as cached tokens.
+
+The server also acts as an HTTP proxy: a GET with an absolute URL is recorded in proxied_urls and
+answered from the routes below, whatever host it names.
+
+Routes:
+    GET  /captions/<name>.<ext>  - fixtures/captions/<name>.vtt, converted to json3, srv3, srt or ttml;
+                                   ?v=<seed> swaps the words of the track for a permutation seeded with it,
+                                   so every video id gets its own transcript with the same timing
+    GET  /articles/<name>.html   - fixtures/articles/<name>.html, with an ETag for conditional requests;
+                                   ?validator=last-modified sends a Last-Modified date instead,
+                                   ?type=<content type> serves the page as another content type
+    GET  /flaky/<key>?fail=N&status=S - answers status S (default: 503) to the first N requests of key, then 200
+    POST /v1/chat/completions    - plain, json_schema (response_format) and streamed (SSE) completions
+    POST /v1/files               - upload of a batch input file (multipart, as the OpenAI client sends it)
+    GET  /v1/files/<id>/content  - content of an uploaded file or of a batch output or error file
+    POST /v1/batches             - runs the chat completions of an input file at once
+    GET  /v1/batches/<id>        - 'in_progress' on the first poll, 'completed' with the output and error files after;
+                                   batch requests whose prompt contains BATCH_FAIL_MARKER fail with a 500
+
+Usage: python benchmarks/stub_server.py [--port N] [--openai-latency SECONDS]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_captions import iter_vtt_cues  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_captions import WORDS as CAPTION_WORDS, render_captions  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+CONTENT_TYPES = {
+    'vtt': 'text/vtt; charset=utf-8',
+    'srt': 'application/x-subrip; charset=utf-8',
+    'json3': 'application/json; charset=utf-8',
+    'srv3': 'text/xml; charset=utf-8',
+    'ttml': 'application/ttml+xml; charset=utf-8',
+}
+
+WORDS = ('the talk explains how engines turn fuel into thrust why stages are dropped on the way to orbit '
+         'what the rocket equation says about mass and how reuse changes the cost of every launch').split()
+
+ANSWER_WORDS = 90
+
+# Prompt caching as OpenAI applies it: the longest previously seen prefix of a prompt, from 1024 tokens on
+# and in steps of 128 tokens, is reported as cached (4 characters count as a token here)
+PROMPT_CACHE_MIN_CHARS = 1024 * 4
+PROMPT_CACHE_STEP_CHARS = 128 * 4
+
+CAPTION_WORD_PATTERN = re.compile(r'\b[a-z]+\b')
+
+BATCH_FAIL_MARKER = 'stub:fail-batch-request'
+
+
+class StubServer:
+    """
+    Runs the stub in a background thread, base_url points at it once started.
+    """
+
+    def __init__(self, port=0, openai_latency=0.0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+        self.server.daemon_threads = True
+        self.server.openai_latency = openai_latency
+        self.server.caption_cache = {}
+        self.server.completions = 0
+        self.server.prompt_prefixes = set()
+        self.server.flaky_attempts = {}
+        self.server.proxied_urls = []
+        self.server.article_responses = []
+        self.server.files = {}
+        self.server.batches = {}
+        self.server.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def completions(self):
+        return self.server.completions
+
+    @property
+    def batches(self):
+        return self.server.batches
+
+    @property
+    def flaky_attempts(self):
+        return self.server.flaky_attempts
+
+    @property
+    def proxied_urls(self):
+        return self.server.proxied_urls
+
+    @property
+    def article_responses(self):
+        return self.server.article_responses
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.scheme:
+            # Absolute URL, the request came through the server as a proxy
+            with self.server.lock:
+                self.server.proxied_urls.append(self.path)
+
+        path = url.path
+        if path.startswith('/captions/'):
+            self.__send_captions(path[len('/captions/'):], parse_qs(url.query).get('v', [None])[0])
+        elif path.startswith('/articles/'):
+            self.__send_article(path[len('/articles/'):], parse_qs(url.query))
+        elif path.startswith('/flaky/'):
+            self.__send_flaky(path[len('/flaky/'):], parse_qs(url.query))
+        elif path.startswith('/v1/files/') and path.endswith('/content'):
+            self.__send_file_content(path[len('/v1/files/'):-len('/content')])
+        elif path.startswith('/v1/batches/'):
+            self.__send_batch(path[len('/v1/batches/'):])
+        else:
+            self.__send(404, b'not found', 'text/plain')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = self.path.split('?', 1)[0]
+        if path == '/v1/chat/completions':
+            self.__send_completion(json.loads(body))
+        elif path == '/v1/files':
+            self.__upload_file(body)
+        elif path == '/v1/batches':
+            self.__create_batch(json.loads(body))
+        else:
+            self.__send_not_found()
+
+    def __send_captions(self, file_name, seed=None):
+        name, _, ext = file_name.rpartition('.')
+        path = os.path.join(FIXTURES_DIR, 'captions', os.path.basename(name) + '.vtt')
+        if ext not in CONTENT_TYPES or not os.path.exists(path):
+            self.__send(404, b'not found', 'text/plain')
+            return
+
+        key = (name, ext, seed)
+        content = self.server.caption_cache.get(key)
+        if content is None:
+            with open(path, encoding='utf-8') as f:
+                content = f.read()
+            if seed is not None:
+                content = self.__permute_words(content, seed)
+            if ext != 'vtt':
+                content = render_captions(list(iter_vtt_cues(content)), ext)
+            content = self.server.caption_cache[key] = content.encode('utf-8')
+        self.__send(200, content, CONTENT_TYPES[ext])
+
+    def __permute_words(self, content, seed):
+        # Only words of the fixture vocabulary are swapped, timestamps, settings and tags stay as they are
+        vocabulary = sorted(set(CAPTION_WORDS))
+        replacements = dict(zip(vocabulary, random.Random(seed).sample(vocabulary, len(vocabulary))))
+        return CAPTION_WORD_PATTERN.sub(lambda match: replacements.get(match.group(0), match.group(0)), content)
+
+    def __send_article(self, file_name, query):
+        path = os.path.join(FIXTURES_DIR, 'articles', os.path.basename(file_name))
+        if not os.path.exists(path):
+            self.__send(404, b'not found', 'text/plain')
+            return
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        # Pages carry a validator, so conditional re-fetches of cached articles are answered with 304
+        if query.get('validator', ['etag'])[0] == 'last-modified':
+            modified = int(os.path.getmtime(path))
+            validator = {'Last-Modified': formatdate(modified, usegmt=True)}
+            not_modified = self.__not_modified_since(modified)
+        else:
+            validator = {'ETag': '"' + hashlib.sha256(content).hexdigest()[:16] + '"'}
+            not_modified = self.headers.get('If-None-Match') == validator['ETag']
+
+        status = 304 if not_modified else 200
+        with self.server.lock:
+            self.server.article_responses.append((self.path, status))
+        if not_modified:
+            self.send_response(304)
+            for name, value in validator.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+        self.__send(200, content, query.get('type', ['text/html; charset=utf-8'])[0], validator)
+
+    def __not_modified_since(self, modified):
+        since = self.headers.get('If-Modified-Since')
+        try:
+            return since is not None and parsedate_to_datetime(since).timestamp() >= modified
+        except (TypeError, ValueError):
+            return False
+
+    def __send_flaky(self, key, query):
+        fail = int(query.get('fail', ['0'])[0])
+        status = int(query.get('status', ['503'])[0])
+        with self.server.lock:
+            attempt = self.server.flaky_attempts[key] = self.server.flaky_attempts.get(key, 0) + 1
+
+        if attempt <= fail:
+            self.__send(status, f'attempt {attempt} failed'.encode('utf-8'), 'text/plain')
+        else:
+            self.__send(200, f'ok after {attempt - 1} failures'.encode('utf-8'), 'text/plain')
+
+    def __send_completion(self, request):
+        time.sleep(self.server.openai_latency)
+        completion, answer, usage = self.__complete(request)
+
+        if not request.get('stream'):
+            self.__send(200, json.dumps(self.__completion_body(completion, answer, usage)).encode('utf-8'),
+                        'application/json')
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        chunk = {**completion, 'object': 'chat.completion.chunk'}
+        for word in answer.split(' '):
+            self.__write_event({**chunk, 'choices': [{'index': 0, 'delta': {'content': word + ' '}}]})
+        self.__write_event({**chunk, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+        if (request.get('stream_options') or {}).get('include_usage'):
+            self.__write_event({**chunk, 'choices': [], 'usage': usage})
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.close_connection = True
+
+    def __complete(self, request):
+        with self.server.lock:
+            self.server.completions += 1
+
+        prompt = self.__prompt(request)
+        answer = self.__answer(prompt, request.get('response_format'))
+        usage = {
+            'prompt_tokens': len(prompt) // 4,
+            'completion_tokens': len(answer) // 4,
+            'total_tokens': len(prompt) // 4 + len(answer) // 4,
+            'prompt_tokens_details': {'cached_tokens': self.__cached_chars(prompt) // 4},
+        }
+        completion = {
+            'id': 'chatcmpl-' + hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:24],
+            'created': 0,
+            'model': request.get('model', 'gpt-4o'),
+        }
+        return completion, answer, usage
+
+    def __prompt(self, request):
+        return ''.join(f"{message.get('role')}: {message.get('content') or ''}\n"
+                       for message in request.get('messages', []))
+
+    def __completion_body(self, completion, answer, usage):
+        return {
+            **completion,
+            'object': 'chat.completion',
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': answer}}],
+            'usage': usage,
+        }
+
+    def __upload_file(self, body):
+        # The client uploads multipart/form-data with the file and its purpose
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            b'Content-Type: ' + self.headers['Content-Type'].encode('latin-1') + b'\r\n\r\n' + body)
+        fields = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+        if 'file' not in fields:
+            self.__send(400, b'{"error": {"message": "file is required"}}', 'application/json')
+            return
+
+        file = self.__store_file(fields['file'].get_payload(decode=True), fields['file'].get_filename(),
+                                 fields['purpose'].get_payload(decode=True).decode('utf-8') if 'purpose' in fields
+                                 else 'batch')
+        self.__send(200, json.dumps(file).encode('utf-8'), 'application/json')
+
+    def __store_file(self, content, file_name, purpose):
+        with self.server.lock:
+            file_id = f'file-{len(self.server.files) + 1}'
+            self.server.files[file_id] = content
+        return {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': 0,
+                'filename': file_name, 'purpose': purpose, 'status': 'processed'}
+
+    def __send_file_content(self, file_id):
+        content = self.server.files.get(file_id)
+        if content is None:
+            self.__send_not_found()
+            return
+        self.__send(200, content, 'application/octet-stream')
+
+    def __create_batch(self, request):
+        content = self.server.files.get(request.get('input_file_id'))
+        if content is None:
+            self.__send_not_found()
+            return
+
+        output_lines = []
+        error_lines = []
+        for line in content.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            batch_request = json.loads(line)
+            result = {'id': f'batch_req_{len(output_lines) + len(error_lines) + 1}',
+                      'custom_id': batch_request['custom_id'], 'error': None}
+            if BATCH_FAIL_MARKER in self.__prompt(batch_request['body']):
+                result['response'] = {'status_code': 500, 'request_id': '',
+                                      'body': {'error': {'message': 'The server had an error', 'type': 'server_error'}}}
+                error_lines.append(json.dumps(result))
+            else:
+                completion, answer, usage = self.__complete(batch_request['body'])
+                result['response'] = {'status_code': 200, 'request_id': '',
+                                      'body': self.__completion_body(completion, answer, usage)}
+                output_lines.append(json.dumps(result))
+
+        # The output and error files are only attached to the batch once it is polled as completed
+        results = [self.__store_file(('\n'.join(lines) + '\n').encode('utf-8'), file_name, purpose)['id']
+                   if lines else None
+                   for lines, file_name, purpose in ((output_lines, 'batch_output.jsonl', 'batch_output'),
+                                                     (error_lines, 'batch_errors.jsonl', 'batch_output'))]
+        with self.server.lock:
+            batch_id = f'batch_{len(self.server.batches) + 1}'
+            self.server.batches[batch_id] = batch = {
+                'id': batch_id,
+                'object': 'batch',
+                'endpoint': request.get('endpoint'),
+                'input_file_id': request['input_file_id'],
+                'completion_window': request.get('completion_window'),
+                'created_at': 0,
+                'status': 'validating',
+                'output_file_id': None,
+                'error_file_id': None,
+                'request_counts': {'total': len(output_lines) + len(error_lines),
+                                   'completed': len(output_lines), 'failed': len(error_lines)},
+                'polls': 0,
+                'results': results,
+            }
+        self.__send(200, json.dumps(self.__batch_object(batch)).encode('utf-8'), 'application/json')
+
+    def __send_batch(self, batch_id):
+        batch = self.server.batches.get(batch_id)
+        if batch is None:
+            self.__send_not_found()
+            return
+
+        with self.server.lock:
+            batch['polls'] += 1
+            if batch['polls'] == 1:
+                batch['status'] = 'in_progress'
+            else:
+                batch['status'] = 'completed'
+                batch['output_file_id'], batch['error_file_id'] = batch['results']
+        self.__send(200, json.dumps(self.__batch_object(batch)).encode('utf-8'), 'application/json')
+
+    def __batch_object(self, batch):
+        return {field: value for field, value in batch.items() if field not in ('polls', 'results')}
+
+    def __cached_chars(self, prompt):
+        cached = 0
+        prefix = hashlib.sha256()
+        data = prompt.encode('utf-8')
+        with self.server.lock:
+            for end in range(PROMPT_CACHE_STEP_CHARS, len(data) + 1, PROMPT_CACHE_STEP_CHARS):
+                prefix.update(data[end - PROMPT_CACHE_STEP_CHARS:end])
+                if end < PROMPT_CACHE_MIN_CHARS:
+                    continue
+                digest = prefix.copy().digest()
+                if digest in self.server.prompt_prefixes:
+                    cached = end
+                self.server.prompt_prefixes.add(digest)
+        return cached
+
+    def __answer(self, prompt, response_format):
+        digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+        text = ' '.join(WORDS[digest[i % len(digest)] % len(WORDS)] for i in range(ANSWER_WORDS)).capitalize() + '.'
+        if not response_format or response_format.get('type') != 'json_schema':
+            return text
+
+        schema = response_format['json_schema']['schema']
+        languages = schema['properties']['translations']['properties']
+        return json.dumps({'paragraph': text, 'translations': {lang: f'[{lang}] {text}' for lang in languages}})
+
+    def __write_event(self, data):
+        self.wfile.write(f'data: {json.dumps(data)}\n\n'.encode('utf-8'))
+
+    def __send_not_found(self):
+        self.__send(404, b'{"error": {"message": "not found"}}', 'application/json')
+
+    def __send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local caption, article and OpenAI stub for benchmarks')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on (default: 8765)')
+    parser.add_argument('--openai-latency', type=float, default=0.0, help='Seconds every completion takes')
+    args = parser.parse_args()
+
+    stub = StubServer(args.port, args.openai_latency)
+    print(f'Serving on {stub.base_url}, OPENAI_BASE_URL={stub.base_url}/v1', file=sys.stderr)
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
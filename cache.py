@@ -1,44 +1,166 @@
+import gzip
 import json
+import logging
 import os
+import threading
+
+import metrics
+from cache_backends import DiskCacheBackend, SqliteCacheBackend, LruCache
+
+logger = logging.getLogger(__name__)
 
 CACHE_DIR = './cache'
 
+# Cache configuration, read from the environment on first use:
+#   CACHE_BACKEND         - 'disk' (default, one file per entry in CACHE_DIR) or 'sqlite'
+#   CACHE_SQLITE_PATH     - database file for the sqlite backend (default: CACHE_DIR/cache.db)
+#   CACHE_LRU_MAX_ENTRIES - entries kept decoded in memory in front of the backend (0 disables)
+#   CACHE_LRU_MAX_BYTES   - total encoded size of the in-memory entries
+DEFAULT_LRU_MAX_ENTRIES = 1024
+DEFAULT_LRU_MAX_BYTES = 64 * 1024 * 1024
 
-def ensure_cache_dir():
-    if not os.path.exists(CACHE_DIR):
-        os.makedirs(CACHE_DIR, exist_ok=True)
-    if not os.path.isdir(CACHE_DIR):
-        raise ValueError(f'{CACHE_DIR} is not a directory')
+__backend = None
+__memory = None
+__lock = threading.Lock()
 
 
-def reuse_cache_json(video_id):
-    cache_file = os.path.join(CACHE_DIR, f'{video_id}.json')
+def get_cache_backend():
+    global __backend, __memory
+
+    if __backend is None:
+        with __lock:
+            if __backend is None:
+                __memory = LruCache(int(os.getenv('CACHE_LRU_MAX_ENTRIES', DEFAULT_LRU_MAX_ENTRIES)),
+                                    int(os.getenv('CACHE_LRU_MAX_BYTES', DEFAULT_LRU_MAX_BYTES)))
+                backend = __create_backend(os.getenv('CACHE_BACKEND', 'disk'))
+                backend.ensure()
+                __backend = backend
+    return __backend
 
-    if os.path.isfile(cache_file):
-        print(f'Reusing cached file: {cache_file}')
 
-        return json.load(open(cache_file))
-    return None
+def __create_backend(name):
+    if name == 'disk':
+        return DiskCacheBackend(CACHE_DIR)
+    if name == 'sqlite':
+        return SqliteCacheBackend(os.getenv('CACHE_SQLITE_PATH', os.path.join(CACHE_DIR, 'cache.db')))
+    raise ValueError(f'Unsupported cache backend: {name}')
+
+
+def ensure_cache_dir():
+    # The backend is prepared once, when it is created
+    get_cache_backend()
+
+
+def reuse_cache_json(video_id):
+    return __reuse(video_id, 'json', lambda data: json.loads(data))
 
 
 def reuse_cache_txt(video_id):
-    cache_file = os.path.join(CACHE_DIR, f'{video_id}.txt')
+    return __reuse(video_id, 'txt', lambda data: data.decode('utf-8'))
 
-    if os.path.isfile(cache_file):
-        print(f'Reusing cached file: {cache_file}')
 
-        with open(cache_file, "r", encoding="utf-8") as f:
-            return f.read()
-    return None
+def reuse_cache_json_gz(video_id):
+    return __reuse(video_id, 'json.gz', lambda data: json.loads(gzip.decompress(data)))
 
 
 def create_cache_json(video_id, content):
-    cache_file = os.path.join(CACHE_DIR, f'{video_id}.json')
-    with open(cache_file, 'w') as f:
-        json.dump(content, f, indent=4)
+    __create(video_id, 'json', content, json.dumps(content, indent=4).encode('utf-8'))
 
 
 def create_cache_txt(video_id, content):
-    cache_file = os.path.join(CACHE_DIR, f'{video_id}.txt')
-    with open(cache_file, 'w', encoding="utf-8") as f:
-        f.write(content)
+    __create(video_id, 'txt', content, content.encode('utf-8'))
+
+
+def create_cache_json_gz(video_id, content):
+    """
+    Compact (no indentation) gzip-compressed JSON, for large records read far more often than inspected.
+    """
+    data = json.dumps(content, separators=(',', ':')).encode('utf-8')
+    __create(video_id, 'json.gz', content, gzip.compress(data, compresslevel=6))
+
+
+def delete_cache_json(video_id):
+    get_cache_backend().delete(video_id, 'json')
+    __memory.discard((video_id, 'json'))
+
+
+def iter_cache_entries():
+    """
+    Yields (key, ext, size, updated_at) of every cached entry as the backend lists them, without their content.
+    """
+    return get_cache_backend().entries()
+
+
+def read_cache_entry(key, ext):
+    """
+    Encoded content of an entry as stored by the backend, None when it does not exist.
+    """
+    return get_cache_backend().read(key, ext)
+
+
+def write_cache_entry(key, ext, data, updated_at=None):
+    """
+    Store encoded content as an entry, updated_at (a Unix timestamp) keeps the age of copied entries.
+    """
+    get_cache_backend().write(key, ext, data, updated_at)
+    __memory.discard((key, ext))
+
+
+def delete_cache_entry(key, ext):
+    get_cache_backend().delete(key, ext)
+    __memory.discard((key, ext))
+
+
+def cache_entry_exists(key, ext):
+    return get_cache_backend().exists(key, ext)
+
+
+def __reuse(key, ext, decode):
+    """
+    Values served from the in-memory tier are shared between callers and must not be mutated.
+    """
+    backend = get_cache_backend()
+
+    value = __memory.get((key, ext))
+    if value is not None:
+        metrics.inc('tldw_cache_requests_total', kind=cache_kind(key, ext), result='hit')
+        return value
+
+    data = backend.read(key, ext)
+    if data is None:
+        metrics.inc('tldw_cache_requests_total', kind=cache_kind(key, ext), result='miss')
+        return None
+
+    metrics.inc('tldw_cache_requests_total', kind=cache_kind(key, ext), result='hit')
+    logger.debug(f'Reusing cached entry: {key}.{ext}')
+    value = decode(data)
+    __memory.put((key, ext), value, len(data))
+    return value
+
+
+def __create(key, ext, content, data):
+    get_cache_backend().write(key, ext, data)
+    __memory.put((key, ext), content, len(data))
+
+
+def cache_kind(key, ext):
+    """
+    Kind of a cache entry for metrics and maintenance, derived from the key conventions of the pipeline.
+    """
+    if ext == 'txt':
+        return 'captions'
+    if ext == 'json.gz':
+        return 'info'
+    if key.startswith('result_'):
+        return 'result'
+    if key.startswith('chunk_'):
+        return 'chunk'
+    if key.startswith('failure_'):
+        return 'failure'
+    if key.startswith('article_page_'):
+        return 'article_page'
+    if key.endswith('_response'):
+        return 'article_summary' if key.startswith('article_') else 'summary'
+    if '_response_' in key:
+        return 'translation'
+    return 'info'  # video info cached before the compact format
@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+# Extensions of cache entries, longest first so `{key}.json.gz` is not read as a `.gz` entry
+ENTRY_EXTS = ('json.gz', 'json', 'txt')
+
+
+def split_entry_name(name: str) -> Optional[Tuple[str, str]]:
+    """
+    Splits a `{key}.{ext}` file name into key and extension, None for files that are not cache entries
+    (temporary files, databases, lock files).
+    """
+    if name.startswith('.') or '/' in name:
+        return None
+    for ext in ENTRY_EXTS:
+        if name.endswith('.' + ext) and len(name) > len(ext) + 1:
+            return name[:-len(ext) - 1], ext
+    return None
+
+
+class DiskCacheBackend:
+    """
+    Flat directory of `{key}.{ext}` files, the original cache layout.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def ensure(self):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        if not os.path.isdir(self.cache_dir):
+            raise ValueError(f'{self.cache_dir} is not a directory')
+
+    def read(self, key: str, ext: str) -> Optional[bytes]:
+        try:
+            with open(self.__path(key, ext), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, ext: str, data: bytes, updated_at: Optional[float] = None):
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o644)
+            if updated_at is not None:
+                os.utime(tmp_path, (updated_at, updated_at))
+            os.replace(tmp_path, self.__path(key, ext))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def delete(self, key: str, ext: str):
+        try:
+            os.remove(self.__path(key, ext))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key: str, ext: str) -> bool:
+        return os.path.isfile(self.__path(key, ext))
+
+    def entries(self) -> Iterator[Tuple[str, str, int, float]]:
+        """
+        Yields (key, ext, size, updated_at) of every entry, reading the directory as a stream.
+        """
+        with os.scandir(self.cache_dir) as directory:
+            for entry in directory:
+                key_ext = split_entry_name(entry.name)
+                if key_ext is None or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # deleted since it was listed
+                yield key_ext[0], key_ext[1], stat.st_size, stat.st_mtime
+
+    def __path(self, key, ext):
+        return os.path.join(self.cache_dir, f'{key}.{ext}')
+
+
+class SqliteCacheBackend:
+    """
+    All entries in a single SQLite file, avoiding one inode per cache entry.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+
+    def ensure(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__connection().execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            ' key TEXT NOT NULL,'
+            ' ext TEXT NOT NULL,'
+            ' value BLOB NOT NULL,'
+            ' updated_at REAL NOT NULL,'
+            ' PRIMARY KEY (key, ext))'
+        )
+
+    def read(self, key: str, ext: str) -> Optional[bytes]:
+        row = self.__connection().execute(
+            'SELECT value FROM cache WHERE key = ? AND ext = ?', (key, ext)).fetchone()
+        return row[0] if row else None
+
+    def write(self, key: str, ext: str, data: bytes, updated_at: Optional[float] = None):
+        with self.__connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache (key, ext, value, updated_at) VALUES (?, ?, ?, ?)',
+                (key, ext, data, time.time() if updated_at is None else updated_at))
+
+    def delete(self, key: str, ext: str):
+        with self.__connection() as connection:
+            connection.execute('DELETE FROM cache WHERE key = ? AND ext = ?', (key, ext))
+
+    def exists(self, key: str, ext: str) -> bool:
+        return self.__connection().execute(
+            'SELECT 1 FROM cache WHERE key = ? AND ext = ?', (key, ext)).fetchone() is not None
+
+    def entries(self) -> Iterator[Tuple[str, str, int, float]]:
+        """
+        Yields (key, ext, size, updated_at) of every entry, without reading the values.
+        """
+        # A connection of its own, the rows are fetched lazily while entries are written or deleted
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield from connection.execute('SELECT key, ext, length(value), updated_at FROM cache')
+        finally:
+            connection.close()
+
+    def __connection(self):
+        # sqlite3 connections cannot be shared between threads, keep one per thread
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+
+class LruCache:
+    """
+    Thread-safe in-process LRU bounded by entry count and total size in bytes.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size: int):
+        if self.max_entries <= 0 or size > self.max_bytes:
+            self.discard(key)
+            return
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def discard(self, key):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
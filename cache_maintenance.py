@@ -0,0 +1,317 @@
+import io
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import tarfile
+import tempfile
+import time
+from contextlib import contextmanager
+
+import prompts
+from cache import (iter_cache_entries, read_cache_entry, write_cache_entry, delete_cache_entry, cache_entry_exists,
+                   cache_kind)
+from cache_backends import split_entry_name
+
+logger = logging.getLogger(__name__)
+
+# Maintenance of the cache, used by tldw-cache.py. Every operation streams the entries of the backend,
+# memory use does not grow with the size of the cache: archives are read and written one entry at a time,
+# and operations that compare or order entries (orphans, size limit) work on an index in a temporary
+# SQLite file (in TMPDIR) instead of in memory.
+
+# Orphans younger than this are left alone, their pipeline may still be running
+DEFAULT_ORPHAN_GRACE = 3600
+# Video ids read by warm_cache are summarized in groups of this size
+WARM_CHUNK_SIZE = 1000
+# Rows inserted into the index per transaction
+INDEX_BATCH_SIZE = 10000
+
+VIDEO_KEY = re.compile(r'[0-9A-Za-z_-]{11}')
+VIDEO_RESPONSE_KEY = re.compile(r'([0-9A-Za-z_-]{11})(?:_v\d+)?_response(?:_[\w-]+)?')
+RESULT_KEY = re.compile(r'result_([0-9A-Za-z_-]{11})_[0-9a-f]+')
+METRIC_LINE = re.compile(r'tldw_cache_requests_total\{kind="(\w+)",result="(\w+)"\} ([\d.e+]+)')
+
+# Entries of a video that are useless without a summary of it, and the summaries that are useless
+# without its info (the video would be extracted again anyway). Final results are complete on their own
+# and never orphans.
+VIDEO_INPUT_KINDS = ('info', 'captions')
+VIDEO_RESPONSE_KINDS = ('summary', 'translation')
+
+
+def cache_stats(metrics_text=None):
+    """
+    Count and size of the cached entries by kind, with their oldest and newest update.
+
+    Args:
+        metrics_text: Prometheus metrics of a running server (GET /api/metrics), adds its hit ratio per kind
+
+    Returns:
+        {'entries', 'bytes', 'oldest', 'newest', 'kinds': {kind: {'entries', 'bytes'[, 'hits', 'misses', 'hit_ratio']}}}
+    """
+    stats = {'entries': 0, 'bytes': 0, 'oldest': None, 'newest': None, 'kinds': {}}
+    for key, ext, size, updated_at in iter_cache_entries():
+        kind = stats['kinds'].setdefault(cache_kind(key, ext), {'entries': 0, 'bytes': 0})
+        kind['entries'] += 1
+        kind['bytes'] += size
+        stats['entries'] += 1
+        stats['bytes'] += size
+        stats['oldest'] = updated_at if stats['oldest'] is None else min(stats['oldest'], updated_at)
+        stats['newest'] = updated_at if stats['newest'] is None else max(stats['newest'], updated_at)
+
+    if metrics_text:
+        for kind, result, value in METRIC_LINE.findall(metrics_text):
+            counts = stats['kinds'].setdefault(kind, {'entries': 0, 'bytes': 0})
+            counts.setdefault('hits', 0)
+            counts.setdefault('misses', 0)
+            counts['hits' if result == 'hit' else 'misses'] += int(float(value))
+        for counts in stats['kinds'].values():
+            lookups = counts.get('hits', 0) + counts.get('misses', 0)
+            if lookups:
+                counts['hit_ratio'] = round(counts['hits'] / lookups, 4)
+
+    return stats
+
+
+def export_cache(fileobj, kinds=None):
+    """
+    Write entries to a gzip-compressed tar stream, one `{key}.{ext}` member per entry with its update time.
+
+    Args:
+        fileobj: Binary file the archive is written to, it does not have to be seekable (e.g. stdout)
+        kinds: Only export entries of these kinds (see cache.cache_kind)
+
+    Returns:
+        {'entries', 'bytes'} exported
+    """
+    report = {'entries': 0, 'bytes': 0}
+    with tarfile.open(fileobj=fileobj, mode='w|gz') as archive:
+        for key, ext, _, updated_at in iter_cache_entries():
+            if kinds and cache_kind(key, ext) not in kinds:
+                continue
+            data = read_cache_entry(key, ext)
+            if data is None:
+                continue  # deleted since it was listed
+
+            member = tarfile.TarInfo(f'{key}.{ext}')
+            member.size = len(data)
+            member.mtime = updated_at
+            member.mode = 0o644
+            archive.addfile(member, io.BytesIO(data))
+            # TarFile remembers every member it wrote, forget them so millions of entries fit in memory
+            archive.members.clear()
+
+            report['entries'] += 1
+            report['bytes'] += len(data)
+    return report
+
+
+def import_cache(fileobj, overwrite=False):
+    """
+    Read entries from an archive written by export_cache, keeping their update times.
+
+    Args:
+        fileobj: Binary file the archive is read from as a stream (any tar compression)
+        overwrite: Replace entries that already exist, by default they are kept
+
+    Returns:
+        {'entries', 'bytes', 'skipped', 'invalid'}
+    """
+    report = {'entries': 0, 'bytes': 0, 'skipped': 0, 'invalid': 0}
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        member = archive.next()
+        while member is not None:
+            key_ext = split_entry_name(member.name) if member.isfile() else None
+            if key_ext is None:
+                logger.warning(f'Skipping {member.name}, not a cache entry')
+                report['invalid'] += 1
+            elif not overwrite and cache_entry_exists(*key_ext):
+                report['skipped'] += 1
+            else:
+                data = archive.extractfile(member).read()
+                write_cache_entry(key_ext[0], key_ext[1], data, member.mtime)
+                report['entries'] += 1
+                report['bytes'] += len(data)
+
+            archive.members.clear()
+            member = archive.next()
+    return report
+
+
+def warm_cache(lines, concurrency=None, skip_cached=True):
+    """
+    Summarize videos given by id or URL, yielding the items of batch.summarize_videos and one final report.
+
+    Videos are run in groups of WARM_CHUNK_SIZE, so lists of any length are read as they are consumed.
+    """
+    from batch import summarize_videos
+
+    start = time.perf_counter()
+    totals = {}
+    urls = (__video_url(line.strip()) for line in lines if line.strip())
+    while True:
+        chunk = list(itertools.islice(urls, WARM_CHUNK_SIZE))
+        if not chunk:
+            break
+        for item in summarize_videos(chunk, concurrency, skip_cached=skip_cached):
+            if 'report' in item:
+                for field in ('total', 'done', 'skipped', 'failed'):
+                    totals[field] = totals.get(field, 0) + item['report'][field]
+            else:
+                yield item
+
+    seconds = time.perf_counter() - start
+    yield {'report': {
+        **totals,
+        'seconds': round(seconds, 3),
+        'videos_per_minute': round(totals.get('done', 0) / seconds * 60, 1) if seconds else 0,
+    }}
+
+
+def collect_garbage(older_than=None, max_bytes=None, orphans=False, kinds=None,
+                    orphan_grace=DEFAULT_ORPHAN_GRACE, dry_run=False):
+    """
+    Delete entries by age, total size or orphan status, the rules apply in this order.
+
+    Args:
+        older_than: Delete entries not updated for this many seconds (of the given kinds, if any)
+        max_bytes: Delete the least recently updated entries until the cache fits this size
+        orphans: Delete video info and captions without any summary, summaries and translations
+            without the video info, translations without their summary and article pages without a summary
+        kinds: Entry kinds older_than applies to
+        orphan_grace: Seconds an orphan has to be old before it is deleted
+        dry_run: Only report what would be deleted
+
+    Returns:
+        {'deleted': {reason: {'entries', 'bytes'}}, 'dry_run'}
+    """
+    report = {'deleted': {}, 'dry_run': dry_run}
+    now = time.time()
+
+    with __entry_index() as index:
+        # Entries are marked with the reason they go first, so every rule sees what the earlier ones removed
+        # (a video whose only summary is a stray translation loses the translation, then its info)
+        if older_than is not None:
+            condition, parameters = 'updated_at < ?', [now - older_than]
+            if kinds:
+                condition += f" AND kind IN ({', '.join('?' * len(kinds))})"
+                parameters += list(kinds)
+            with index:
+                index.execute(f"UPDATE entries SET reason = 'age' WHERE {condition}", parameters)
+
+        if max_bytes is not None:
+            total = index.execute('SELECT COALESCE(SUM(size), 0) FROM entries WHERE reason IS NULL').fetchone()[0]
+            with index:
+                index.execute("""
+                    UPDATE entries SET reason = 'size' WHERE rowid IN (
+                        SELECT rowid FROM (SELECT rowid, size, SUM(size) OVER (ORDER BY updated_at, rowid) AS freed
+                                           FROM entries WHERE reason IS NULL)
+                        WHERE freed - size < ?)""", (total - max_bytes,))
+
+        if orphans:
+            for reason, condition in __orphan_conditions():
+                with index:
+                    index.execute(f'UPDATE entries SET reason = ? WHERE rowid IN ('
+                                  f'SELECT rowid FROM entries e WHERE reason IS NULL AND updated_at < ? AND {condition})',
+                                  (reason, now - orphan_grace))
+
+        for key, ext, size, reason in index.execute(
+                'SELECT key, ext, size, reason FROM entries WHERE reason IS NOT NULL'):
+            __delete(key, ext, size, reason, report, dry_run)
+    return report
+
+
+def __orphan_conditions():
+    inputs = ', '.join(f"'{kind}'" for kind in VIDEO_INPUT_KINDS)
+    responses = ', '.join(f"'{kind}'" for kind in VIDEO_RESPONSE_KINDS)
+    return [
+        ('orphan_summary', f"""
+            kind IN ({responses}) AND owner IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM entries i WHERE i.owner = e.owner AND i.reason IS NULL AND i.kind = 'info')"""),
+        ('orphan_translation', """
+            kind = 'translation' AND base IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM entries s WHERE s.key = e.base AND s.ext = 'json' AND s.reason IS NULL)"""),
+        ('orphan_info', f"""
+            kind IN ({inputs}) AND owner IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM entries r WHERE r.owner = e.owner AND r.reason IS NULL
+                            AND r.kind IN ({responses}, 'result'))"""),
+        ('orphan_article_page', """
+            kind = 'article_page'
+            AND NOT EXISTS (SELECT 1 FROM entries s WHERE s.key = e.base AND s.ext = 'json' AND s.reason IS NULL)"""),
+    ]
+
+
+@contextmanager
+def __entry_index():
+    """
+    Index of all entries in a temporary SQLite file: key, ext, size, updated_at, kind, the video the entry
+    belongs to (owner), for translations and article pages the key of their summary (base),
+    and the reason it is deleted for, once marked.
+    """
+    with tempfile.TemporaryDirectory(prefix='tldw-cache-index-') as directory:
+        index = sqlite3.connect(os.path.join(directory, 'index.db'))
+        try:
+            index.execute('PRAGMA journal_mode=OFF')
+            index.execute('PRAGMA synchronous=OFF')
+            index.execute('CREATE TABLE entries (key TEXT NOT NULL, ext TEXT NOT NULL, size INTEGER NOT NULL,'
+                          ' updated_at REAL NOT NULL, kind TEXT NOT NULL, owner TEXT, base TEXT, reason TEXT)')
+
+            rows = (__index_row(*entry) for entry in iter_cache_entries())
+            while True:
+                batch = list(itertools.islice(rows, INDEX_BATCH_SIZE))
+                if not batch:
+                    break
+                with index:
+                    index.executemany('INSERT INTO entries (key, ext, size, updated_at, kind, owner, base)'
+                                      ' VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+
+            index.execute('CREATE INDEX entries_owner ON entries (owner, kind)')
+            index.execute('CREATE INDEX entries_key ON entries (key, ext)')
+            index.execute('CREATE INDEX entries_updated_at ON entries (updated_at)')
+            yield index
+        finally:
+            index.close()
+
+
+def __index_row(key, ext, size, updated_at):
+    kind = cache_kind(key, ext)
+    owner = base = None
+    if kind in VIDEO_INPUT_KINDS and VIDEO_KEY.fullmatch(key):
+        owner = key
+    elif kind in VIDEO_RESPONSE_KINDS and not key.startswith('article_'):
+        match = VIDEO_RESPONSE_KEY.fullmatch(key)
+        owner = match.group(1) if match else None
+    elif kind == 'result':
+        match = RESULT_KEY.fullmatch(key)
+        owner = match.group(1) if match else None
+
+    if kind == 'translation':
+        base = key[:key.rindex('_response_') + len('_response')]
+    elif kind == 'article_page':
+        base = __article_summary_key(key, ext)
+    return key, ext, size, updated_at, kind, owner, base
+
+
+def __article_summary_key(key, ext):
+    # Page records are small, reading them while indexing keeps the index the only copy of the listing
+    data = read_cache_entry(key, ext)
+    try:
+        content_hash = json.loads(data)['content_hash'] if data else None
+    except (ValueError, KeyError, TypeError):
+        content_hash = None
+    return prompts.summary_cache_key(f'article_{content_hash}') if content_hash else None
+
+
+def __delete(key, ext, size, reason, report, dry_run):
+    deleted = report['deleted'].setdefault(reason, {'entries': 0, 'bytes': 0})
+    deleted['entries'] += 1
+    deleted['bytes'] += size
+    if not dry_run:
+        logger.debug(f'Deleting {key}.{ext} ({reason})')
+        delete_cache_entry(key, ext)
+
+
+def __video_url(line):
+    return line if '/' in line else f'https://www.youtube.com/watch?v={line}'
@@ -0,0 +1,174 @@
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from stage_limits import Overloaded
+
+logger = logging.getLogger(__name__)
+
+# Circuit breakers of the upstream services, read from the environment:
+#   CIRCUIT_FAILURE_THRESHOLD - consecutive upstream failures that open a circuit (default: 5, 0 disables)
+#   CIRCUIT_RESET_TIMEOUT     - seconds an open circuit rejects calls before one probe is let through (default: 30)
+# Breakers are kept per process, every worker notices a failing upstream on its own.
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+
+UPSTREAM_YTDLP = 'ytdlp'
+UPSTREAM_CAPTIONS = 'captions'
+UPSTREAM_OPENAI = 'openai'
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Overloaded):
+    """
+    An upstream failed repeatedly and is not called until its circuit is probed again, in retry_after seconds.
+
+    Handled like Overloaded: web requests are answered with 503 and Retry-After right away.
+    """
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(upstream, retry_after, f'{upstream} is unavailable, try again later')
+        self.upstream = upstream
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an upstream is down instead of letting every request wait for its timeouts.
+
+    After failure_threshold consecutive failures the circuit opens and calls raise CircuitOpen.
+    Once reset_timeout has passed a single call is let through (half open): its success closes
+    the circuit, its failure opens it for another reset_timeout.
+    """
+
+    def __init__(self, upstream, failure_threshold, reset_timeout):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @contextmanager
+    def guard(self, is_failure=lambda e: True):
+        """
+        Run the block as a call to the upstream. Exceptions for which is_failure is false (the upstream
+        answered, the request itself was bad) count as successful calls and are re-raised as they are.
+        Overloaded means the block never got to call the upstream (no stage slot), it counts as neither.
+        """
+        if not self.failure_threshold:
+            yield
+            return
+
+        probe = self.__before_call()
+        try:
+            yield
+        except Overloaded:
+            # A probe that could not run leaves the circuit half open for the next call
+            self.__release_probe(probe)
+            raise
+        except Exception as e:
+            if is_failure(e):
+                self.__on_failure(probe, e)
+            else:
+                self.__on_success(probe)
+            raise
+        except BaseException:
+            # Cancelled or interrupted, says nothing about the upstream
+            self.__release_probe(probe)
+            raise
+        else:
+            self.__on_success(probe)
+
+    def status(self):
+        with self.lock:
+            status = {'state': self.__current_state(time.monotonic()), 'failures': self.failures}
+            if self.opened_at is not None:
+                status['retry_after'] = max(0, math.ceil(self.opened_at + self.reset_timeout - time.monotonic()))
+            return status
+
+    def __before_call(self):
+        with self.lock:
+            now = time.monotonic()
+            state = self.__current_state(now)
+            if state == STATE_CLOSED:
+                return False
+            if state == STATE_HALF_OPEN and not self.probing:
+                self.probing = True
+                logger.info(f'Probing {self.upstream} after {self.reset_timeout}s with the circuit open')
+                return True
+            retry_after = max(1, math.ceil(self.opened_at + self.reset_timeout - now))
+
+        metrics.inc('tldw_circuit_rejected_total', upstream=self.upstream)
+        raise CircuitOpen(self.upstream, retry_after)
+
+    def __on_success(self, probe):
+        with self.lock:
+            if probe:
+                self.probing = False
+                logger.info(f'{self.upstream} recovered, closing its circuit')
+            if self.state == STATE_OPEN and not probe:
+                # A call started before the circuit opened, the probe decides
+                return
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def __on_failure(self, probe, e):
+        with self.lock:
+            if probe:
+                self.probing = False
+            self.failures += 1
+            if probe or (self.state == STATE_CLOSED and self.failures >= self.failure_threshold):
+                if self.state == STATE_CLOSED:
+                    metrics.inc('tldw_circuit_opened_total', upstream=self.upstream)
+                logger.warning(f'Opening the circuit of {self.upstream} for {self.reset_timeout}s '
+                               f'after {self.failures} failures, last: {str(e)}')
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+
+    def __release_probe(self, probe):
+        if probe:
+            with self.lock:
+                self.probing = False
+
+    def __current_state(self, now):
+        if self.state == STATE_OPEN and now - self.opened_at >= self.reset_timeout:
+            return STATE_HALF_OPEN
+        return self.state
+
+
+__breakers = {}
+__lock = threading.Lock()
+
+
+def get_circuit_breaker(upstream):
+    """
+    Returns the process-wide breaker of an upstream (UPSTREAM_YTDLP, UPSTREAM_CAPTIONS or UPSTREAM_OPENAI).
+    """
+    breaker = __breakers.get(upstream)
+    if breaker is None:
+        with __lock:
+            breaker = __breakers.get(upstream)
+            if breaker is None:
+                breaker = __breakers[upstream] = CircuitBreaker(
+                    upstream,
+                    int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', DEFAULT_FAILURE_THRESHOLD)),
+                    float(os.getenv('CIRCUIT_RESET_TIMEOUT', DEFAULT_RESET_TIMEOUT)))
+    return breaker
+
+
+def circuit_states():
+    """
+    State of the breaker of every upstream, as reported by /api/health.
+    """
+    return {upstream: get_circuit_breaker(upstream).status()
+            for upstream in (UPSTREAM_YTDLP, UPSTREAM_CAPTIONS, UPSTREAM_OPENAI)}
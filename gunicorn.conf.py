@@ -0,0 +1,30 @@
+import importlib
+import os
+
+# Production server of tldw-web.py: gunicorn -c gunicorn.conf.py tldw-web:app
+#
+# Configuration, read from the environment:
+#   PORT          - port to listen on (default: 5555)
+#   WEB_WORKERS   - worker processes (default: 2)
+#   WEB_THREADS   - request threads per worker (default: 8)
+#   WEB_TIMEOUT   - seconds a request may take before its worker is restarted (default: 600)
+#   WEB_BACKLOG   - connections waiting to be accepted, beyond that clients are refused (default: 64)
+# Limits of expensive stages across all workers are configured in stage_limits.py.
+# Workers share the cache, set RATE_LIMIT_STORE=sqlite so they also share the rate limits.
+bind = f"0.0.0.0:{os.getenv('PORT', '5555')}"
+workers = int(os.getenv('WEB_WORKERS', 2))
+threads = int(os.getenv('WEB_THREADS', 8))
+worker_class = 'gthread'
+timeout = int(os.getenv('WEB_TIMEOUT', 600))
+graceful_timeout = 30
+keepalive = 5
+backlog = int(os.getenv('WEB_BACKLOG', 64))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'INFO').lower()
+
+
+def post_worker_init(worker):
+    # Every worker drains the shared job database, jobs left by a dead worker are resumed right away
+    importlib.import_module('tldw-web').job_queue.start()
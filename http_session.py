@@ -0,0 +1,179 @@
+import asyncio
+import contextlib
+import os
+import sys
+import threading
+import weakref
+
+# Outgoing HTTP configuration, read from the environment:
+#   PROXY_URL             - proxy for yt-dlp, caption and article downloads (overridden by set_proxy_url)
+#   HTTP_TIMEOUT          - connect and read timeout in seconds (default: 30)
+#   HTTP_RETRIES          - retries of failed connections and 429/5xx responses (default: 3)
+#   HTTP_BACKOFF          - backoff factor, retry n waits HTTP_BACKOFF * 2 ** (n - 1) seconds (default: 0.5)
+#   HTTP_POOL_CONNECTIONS - keep-alive connections pooled per host (default: 10)
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_POOL_CONNECTIONS = 10
+# requests and httpx are imported with the first session or client of their kind, not by a cached request
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+__proxy_url = os.getenv('PROXY_URL') or None
+__sessions = threading.local()
+__async_clients = weakref.WeakKeyDictionary()
+
+
+def set_proxy_url(proxy_url):
+    """
+    Route all outgoing downloads through proxy_url (None for direct connections).
+
+    Sessions and clients created with a different proxy are replaced on their next use.
+    """
+    global __proxy_url
+    __proxy_url = proxy_url or None
+
+
+def get_proxy_url():
+    return __proxy_url
+
+
+def get_session():
+    """
+    Returns the requests session of the calling thread, pooling keep-alive connections
+    and retrying failed connections and 429/5xx responses with exponential backoff.
+
+    requests.Session is not guaranteed to be thread-safe, so every thread gets its own.
+    """
+    session = getattr(__sessions, 'session', None)
+    if session is None or getattr(__sessions, 'proxy_url', None) != __proxy_url:
+        if session is not None:
+            session.close()
+        session = __create_session()
+        __sessions.session = session
+        __sessions.proxy_url = __proxy_url
+    return session
+
+
+def get(url, **kwargs):
+    """
+    GET through the thread's pooled session with the default timeout, raising for error statuses.
+    """
+    kwargs.setdefault('timeout', __timeout())
+    response = get_session().get(url, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+def get_async_client():
+    """
+    Returns the httpx client shared by all requests of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = __async_clients.get(loop)
+    if client is None or client.proxy_url != __proxy_url:
+        import httpx
+        client = httpx.AsyncClient(
+            timeout=__timeout(),
+            follow_redirects=True,
+            limits=httpx.Limits(max_keepalive_connections=__pool_connections()),
+            transport=httpx.AsyncHTTPTransport(retries=__retries(), proxy=__proxy_url),
+        )
+        client.proxy_url = __proxy_url
+        __async_clients[loop] = client
+    return client
+
+
+async def get_async(url, **kwargs):
+    """
+    Async counterpart of get, with the same retries of 429/5xx responses and backoff.
+    Connection failures are retried by the transport.
+    """
+    client = get_async_client()
+    retries = __retries()
+    for attempt in range(retries + 1):
+        response = await client.get(url, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            break
+        await asyncio.sleep(__backoff() * 2 ** attempt)
+
+    response.raise_for_status()
+    return response
+
+
+@contextlib.asynccontextmanager
+async def stream_async(url, **kwargs):
+    """
+    Streaming variant of get_async, the body is read from the yielded response (response.aiter_bytes()).
+    Only 4xx/5xx statuses raise, a 304 answer to a conditional request is returned.
+    """
+    client = get_async_client()
+    retries = __retries()
+    for attempt in range(retries + 1):
+        async with client.stream('GET', url, **kwargs) as response:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                if response.is_error:
+                    response.raise_for_status()
+                yield response
+                return
+        await asyncio.sleep(__backoff() * 2 ** attempt)
+
+
+def __create_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=__retries(),
+        backoff_factor=__backoff(),
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=__pool_connections(), pool_maxsize=__pool_connections(),
+                          max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if __proxy_url:
+        session.proxies = {'http': __proxy_url, 'https': __proxy_url}
+    return session
+
+
+def __timeout():
+    return float(os.getenv('HTTP_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def __retries():
+    return int(os.getenv('HTTP_RETRIES', DEFAULT_RETRIES))
+
+
+def __backoff():
+    return float(os.getenv('HTTP_BACKOFF', DEFAULT_BACKOFF))
+
+
+def __pool_connections():
+    return int(os.getenv('HTTP_POOL_CONNECTIONS', DEFAULT_POOL_CONNECTIONS))
+
+
+def is_upstream_failure(e):
+    """
+    Whether an error of get/get_async means the remote host is failing (connection errors, timeouts,
+    429/5xx answers left after the retries), as opposed to a bad request for one resource.
+    """
+    # An error can only come from a library that was imported, the other one is not loaded for the check
+    requests = sys.modules.get('requests')
+    if requests:
+        if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+            return True
+        if isinstance(e, requests.HTTPError):
+            return e.response is not None and e.response.status_code in RETRY_STATUSES
+
+    httpx = sys.modules.get('httpx')
+    if httpx:
+        if isinstance(e, httpx.TransportError):
+            return True
+        if isinstance(e, httpx.HTTPStatusError):
+            return e.response.status_code in RETRY_STATUSES
+    return False
@@ -0,0 +1,279 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from stage_limits import Overloaded
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# How often idle workers look for jobs submitted by other processes sharing the database
+POLL_INTERVAL = 2.0
+
+# A running job is leased to the process running it: the process renews the lease of its jobs every
+# lease_seconds / HEARTBEATS_PER_LEASE, jobs whose lease ran out are queued again by any process
+DEFAULT_LEASE_SECONDS = 60
+HEARTBEATS_PER_LEASE = 4
+
+__process_token = (None, None)
+
+
+def get_process_token():
+    """
+    Token of the running process, stored with its pid on the jobs it runs. A new one is made after a fork,
+    so workers forked from a server that imported this module do not share it, nor does a worker that got
+    the pid of a previous one.
+    """
+    global __process_token
+
+    pid, token = __process_token
+    if pid != os.getpid():
+        pid, token = __process_token = (os.getpid(), uuid.uuid4().hex)
+    return token
+
+
+class JobQueue:
+    """
+    Persistent job queue backed by a local SQLite file, drained by a bounded pool of worker threads.
+
+    Handlers are called as handler(url, on_stage) and must return a JSON-serializable result;
+    on_stage(stage) records the pipeline stage the job is currently in.
+    A job whose handler raises Overloaded (a stage without a free slot, an open circuit) is queued again
+    and not run before the retry_after it asks for.
+
+    Running jobs carry the pid and the token of the process that claimed them (get_process_token), a pid
+    reused by a restarted worker does not pass for the old owner. Jobs of a process that is gone are queued again
+    on start, others once their lease has not been renewed for lease_seconds.
+    """
+
+    def __init__(self, path, handlers, workers=2, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.path = path
+        self.handlers = handlers
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.running = set()
+        self.running_lock = threading.Lock()
+        self.local = threading.local()
+        self.wakeup = threading.Condition()
+        self.started = False
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        with self.start_lock:
+            if self.started:
+                return
+
+            self.__ensure_schema()
+            self.__requeue_orphaned_jobs()
+
+            for i in range(self.workers):
+                threading.Thread(target=self.__work, name=f'job-worker-{i}', daemon=True).start()
+            threading.Thread(target=self.__heartbeat, name='job-heartbeat', daemon=True).start()
+            self.started = True
+
+    def submit(self, kind, url):
+        if kind not in self.handlers:
+            raise ValueError(f'Unsupported job type: {kind}')
+
+        self.start()
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.__connection() as connection:
+            connection.execute(
+                'INSERT INTO jobs (id, kind, url, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, kind, url, JOB_QUEUED, now, now))
+
+        with self.wakeup:
+            self.wakeup.notify()
+
+        return job_id
+
+    def get(self, job_id):
+        self.start()
+
+        row = self.__connection().execute(
+            'SELECT id, kind, url, status, stage, result, error, created_at, updated_at FROM jobs WHERE id = ?',
+            (job_id,)).fetchone()
+        if not row:
+            return None
+
+        return {
+            'job_id': row[0],
+            'type': row[1],
+            'url': row[2],
+            'status': row[3],
+            'stage': row[4],
+            'result': json.loads(row[5]) if row[5] else None,
+            'error': row[6],
+            'created_at': row[7],
+            'updated_at': row[8],
+        }
+
+    def __work(self):
+        while True:
+            try:
+                job = self.__claim()
+            except Exception as e:
+                # E.g. the database is locked by another process, the worker must not die with it
+                logger.exception(f'Claiming a job failed, retrying in {POLL_INTERVAL}s: {str(e)}')
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            if not job:
+                with self.wakeup:
+                    self.wakeup.wait(POLL_INTERVAL)
+                continue
+
+            try:
+                self.__run(job)
+            except Exception as e:
+                # The job is no longer renewed, so its lease runs out and it is requeued
+                logger.exception(f'Recording the outcome of job {job[0]} failed: {str(e)}')
+                time.sleep(POLL_INTERVAL)
+
+    def __run(self, job):
+        job_id, kind, url = job
+        logger.info(f'Running job {job_id}: {kind} {url}')
+        try:
+            result = json.dumps(self.handlers[kind](url, lambda stage: self.__update(job_id, stage=stage)))
+        except Overloaded as e:
+            logger.warning(f'Job {job_id} retries in {e.retry_after}s: {str(e)}')
+            self.__update(job_id, status=JOB_QUEUED, stage=None, owner=None, owner_token=None, error=str(e),
+                          run_after=time.time() + e.retry_after)
+        except Exception as e:
+            logger.exception(f'Job {job_id} failed: {str(e)}')
+            self.__update(job_id, status=JOB_FAILED, error=str(e))
+        else:
+            self.__update(job_id, status=JOB_DONE, result=result, error=None)
+        finally:
+            with self.running_lock:
+                self.running.discard(job_id)
+
+    def __heartbeat(self):
+        while True:
+            time.sleep(self.lease_seconds / HEARTBEATS_PER_LEASE)
+            try:
+                self.__renew_leases()
+                self.__requeue_orphaned_jobs()
+            except Exception as e:
+                logger.exception(f'Renewing job leases failed: {str(e)}')
+
+    def __renew_leases(self):
+        with self.running_lock:
+            job_ids = list(self.running)
+        if not job_ids:
+            return
+        with self.__connection() as connection:
+            connection.execute(
+                f'UPDATE jobs SET updated_at = ? WHERE owner_token = ? AND status = ? '
+                f'AND id IN ({", ".join("?" * len(job_ids))})',
+                (time.time(), get_process_token(), JOB_RUNNING, *job_ids))
+
+    def __claim(self):
+        connection = self.__connection()
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim the same job
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT id, kind, url FROM jobs WHERE status = ? AND (run_after IS NULL OR run_after <= ?) '
+                'ORDER BY created_at LIMIT 1',
+                (JOB_QUEUED, time.time())).fetchone()
+            if row:
+                connection.execute(
+                    'UPDATE jobs SET status = ?, owner = ?, owner_token = ?, updated_at = ? WHERE id = ?',
+                    (JOB_RUNNING, os.getpid(), get_process_token(), time.time(), row[0]))
+                with self.running_lock:
+                    self.running.add(row[0])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return row
+
+    def __update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self.__connection() as connection:
+            connection.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def __requeue_orphaned_jobs(self):
+        now = time.time()
+        rows = self.__connection().execute(
+            'SELECT id, owner, owner_token, updated_at FROM jobs WHERE status = ?', (JOB_RUNNING,)).fetchall()
+        for job_id, owner, owner_token, updated_at in rows:
+            # The pid of this process with another token belonged to a previous process that got the same pid,
+            # a job of this process is only left unrenewed when recording its outcome failed
+            alive = owner_token == get_process_token() or (owner != os.getpid() and self.__is_process_alive(owner))
+            if alive and updated_at >= now - self.lease_seconds:
+                continue
+            with self.__connection() as connection:
+                requeued = connection.execute(
+                    'UPDATE jobs SET status = ?, stage = NULL, owner = NULL, owner_token = NULL, updated_at = ? '
+                    'WHERE id = ? AND status = ? AND owner_token IS ? AND updated_at = ?',
+                    (JOB_QUEUED, now, job_id, JOB_RUNNING, owner_token, updated_at)).rowcount
+            if requeued:
+                logger.warning(f'Requeueing interrupted job {job_id}')
+
+    def __is_process_alive(self, pid):
+        if not pid:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def __ensure_schema(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.__connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                ' id TEXT PRIMARY KEY,'
+                ' kind TEXT NOT NULL,'
+                ' url TEXT NOT NULL,'
+                ' status TEXT NOT NULL,'
+                ' stage TEXT,'
+                ' result TEXT,'
+                ' error TEXT,'
+                ' owner INTEGER,'
+                ' owner_token TEXT,'
+                ' run_after REAL,'
+                ' created_at REAL NOT NULL,'
+                ' updated_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+
+            # Databases created by earlier versions lack the newer columns
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(jobs)')]
+            for column, column_type in (('run_after', 'REAL'), ('owner_token', 'TEXT')):
+                if column in columns:
+                    continue
+                try:
+                    connection.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+                except sqlite3.OperationalError as e:
+                    # Another process added it first
+                    if 'duplicate column' not in str(e):
+                        raise
+
+    def __connection(self):
+        # sqlite3 connections cannot be shared between threads, keep one per thread
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # Autocommit mode, transactions are managed explicitly where needed
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self.local.connection = connection
+        return connection
@@ -0,0 +1,117 @@
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+# Upper bounds (seconds) of the latency histogram buckets, from warm cache hits to long OpenAI completions
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+DESCRIPTIONS = {
+    'tldw_request_seconds': 'End-to-end latency of summarize requests',
+    'tldw_stage_seconds': 'Latency of pipeline stages',
+    'tldw_openai_request_seconds': 'Latency of OpenAI completions',
+    'tldw_cache_requests_total': 'Cache lookups by entry kind and result',
+    'tldw_openai_tokens_total': 'OpenAI tokens used',
+    'tldw_openai_cost_usd_total': 'Estimated OpenAI cost in USD',
+    'tldw_overloaded_total': 'Requests rejected because a pipeline stage had no free slot',
+    'tldw_circuit_opened_total': 'Times the circuit breaker of an upstream opened',
+    'tldw_circuit_rejected_total': 'Calls rejected because the circuit of their upstream was open',
+}
+
+__lock = threading.Lock()
+__counters = {}
+__histograms = {}
+
+
+def inc(name, value=1, **labels):
+    """
+    Increase a counter, labels are given as keyword arguments.
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with __lock:
+        __counters[key] = __counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """
+    Record a duration in a histogram.
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with __lock:
+        histogram = __histograms.get(key)
+        if histogram is None:
+            histogram = __histograms[key] = {'buckets': [0] * len(DEFAULT_BUCKETS), 'count': 0, 'sum': 0.0}
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+
+
+@contextmanager
+def timed(name, **labels):
+    """
+    Timing span, records the duration of the block (also when it raises).
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, perf_counter() - start, **labels)
+
+
+def snapshot():
+    """
+    Returns counters and histograms as {name: [{'labels', 'value'} or {'labels', 'count', 'sum'}]}.
+    """
+    result = {}
+    with __lock:
+        for (name, labels), value in __counters.items():
+            result.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        for (name, labels), histogram in __histograms.items():
+            result.setdefault(name, []).append(
+                {'labels': dict(labels), 'count': histogram['count'], 'sum': histogram['sum']})
+    return result
+
+
+def render_prometheus():
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    with __lock:
+        counters = sorted(__counters.items())
+        histograms = sorted((key, dict(value, buckets=list(value['buckets']))) for key, value in __histograms.items())
+
+    lines = []
+    described = set()
+    for (name, labels), value in counters:
+        __describe(lines, described, name, 'counter')
+        lines.append(f'{name}{__format_labels(labels)} {value}')
+
+    for (name, labels), histogram in histograms:
+        __describe(lines, described, name, 'histogram')
+        for bound, count in zip(DEFAULT_BUCKETS, histogram['buckets']):
+            lines.append(f'{name}_bucket{__format_labels(labels + (("le", str(bound)),))} {count}')
+        lines.append(f'{name}_bucket{__format_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+        lines.append(f'{name}_sum{__format_labels(labels)} {histogram["sum"]}')
+        lines.append(f'{name}_count{__format_labels(labels)} {histogram["count"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def __describe(lines, described, name, kind):
+    if name in described:
+        return
+    described.add(name)
+    if name in DESCRIPTIONS:
+        lines.append(f'# HELP {name} {DESCRIPTIONS[name]}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def __format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{__escape(value)}"' for key, value in labels) + '}'
+
+
+def __escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
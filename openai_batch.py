@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import time
+
+import openai_clients
+from summarization_engine import MODEL, record_usage
+
+logger = logging.getLogger(__name__)
+
+# OpenAI Batch API configuration, read from the environment:
+#   OPENAI_BATCH_POLL_INTERVAL - seconds between batch status checks (default: 30)
+#   OPENAI_BASE_URL            - read by the OpenAI client, points batches at a compatible or local fake endpoint
+DEFAULT_POLL_INTERVAL = 30
+COMPLETION_WINDOW = '24h'
+ENDPOINT = '/v1/chat/completions'
+
+# Batch API requests are billed at half the price of synchronous ones
+BATCH_PRICE_FACTOR = 0.5
+
+# Limits of a single batch input file
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+
+BATCH_TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class OpenAIBatchBackend:
+    """
+    Runs completions through the OpenAI Batch API: requests are written to JSONL files,
+    uploaded with purpose 'batch', and the batches are polled until they finish.
+
+    Batches cost less than synchronous requests and have their own rate limits,
+    at the price of finishing within the completion window instead of seconds.
+    """
+
+    def __init__(self, client=None, poll_interval=None):
+        self.client = client or openai_clients.get_client()
+        self.poll_interval = poll_interval if poll_interval is not None else float(
+            os.getenv('OPENAI_BATCH_POLL_INTERVAL', DEFAULT_POLL_INTERVAL))
+
+    def complete(self, instructions):
+        """
+        Complete every instruction in batches.
+
+        Args:
+            instructions: Dictionary of prompts (message lists, see prompts.py) keyed by a unique id
+                (used as the batch custom_id)
+
+        Returns:
+            Dictionary of answers keyed by the same ids, ids whose request failed are missing
+        """
+        if not instructions:
+            return {}
+
+        batch_ids = [self.__submit(lines) for lines in self.__split_requests(instructions)]
+
+        answers = {}
+        for batch_id in batch_ids:
+            answers.update(self.__collect(self.__wait(batch_id)))
+
+        logger.info(f'Batch completions: {len(answers)} of {len(instructions)} succeeded')
+        return answers
+
+    def __split_requests(self, instructions):
+        lines = []
+        size = 0
+        for custom_id, instruction in instructions.items():
+            line = json.dumps({
+                'custom_id': custom_id,
+                'method': 'POST',
+                'url': ENDPOINT,
+                'body': {
+                    'model': MODEL,
+                    'messages': instruction,
+                },
+            }).encode('utf-8') + b'\n'
+            if lines and (len(lines) >= MAX_BATCH_REQUESTS or size + len(line) > MAX_BATCH_BYTES):
+                yield lines
+                lines = []
+                size = 0
+            lines.append(line)
+            size += len(line)
+
+        if lines:
+            yield lines
+
+    def __submit(self, lines):
+        input_file = self.client.files.create(file=('batch.jsonl', b''.join(lines)), purpose='batch')
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint=ENDPOINT,
+                                           completion_window=COMPLETION_WINDOW)
+        logger.info(f'Submitted batch {batch.id} with {len(lines)} requests')
+        return batch.id
+
+    def __wait(self, batch_id):
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in BATCH_TERMINAL_STATUSES:
+                logger.info(f'Batch {batch_id} {batch.status}')
+                return batch
+            time.sleep(self.poll_interval)
+
+    def __collect(self, batch):
+        answers = {}
+        if batch.output_file_id:
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get('response') or {}
+                if response.get('status_code') == 200:
+                    answers[result['custom_id']] = response['body']['choices'][0]['message']['content']
+                    record_usage(response['body'].get('usage'), price_factor=BATCH_PRICE_FACTOR)
+                else:
+                    logger.warning(f"Batch request {result['custom_id']} failed: {result.get('error') or response}")
+
+        if batch.error_file_id:
+            errors = self.client.files.content(batch.error_file_id).text.splitlines()
+            logger.warning(f'Batch {batch.id}: {len([line for line in errors if line.strip()])} requests failed')
+
+        return answers
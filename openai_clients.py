@@ -0,0 +1,45 @@
+import asyncio
+import threading
+import weakref
+
+# openai is imported with the first client, answering a cached request does not need it
+
+__lock = threading.Lock()
+__client = None
+__async_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """
+    Returns the process-wide OpenAI client. It is thread-safe and keeps its connections
+    to the API alive, so all requests share one pool instead of opening their own.
+    """
+    global __client
+
+    if __client is None:
+        with __lock:
+            if __client is None:
+                from openai import OpenAI
+                __client = OpenAI()
+    return __client
+
+
+def get_async_client():
+    """
+    Returns the AsyncOpenAI client of the running event loop, its connections cannot be shared between loops.
+    """
+    loop = asyncio.get_running_loop()
+    client = __async_clients.get(loop)
+    if client is None:
+        from openai import AsyncOpenAI
+        client = __async_clients[loop] = AsyncOpenAI()
+    return client
+
+
+def is_upstream_failure(e):
+    """
+    Whether an error of a completion means the API is failing (connection errors, timeouts, rate limits
+    and 5xx answers left after the client's retries), as opposed to a request it rejected.
+    """
+    import openai
+    return isinstance(e, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
@@ -0,0 +1,104 @@
+from typing import Dict, List
+
+# Prompts are laid out for provider-side prompt caching: the instructions, identical for every request,
+# form the system message, and everything specific to a video or article follows in the user message.
+# OpenAI reuses the longest previously seen prefix of a prompt (from 1024 tokens on) at a lower price,
+# the cached part is reported as tldw_openai_tokens_total{type="cached"}. The instructions alone are far
+# below that minimum, so distinct videos do not hit the cache; a prompt sent again does (a retried request,
+# a video requested again before its result was cached).
+
+# Part of the cache keys of summaries and final results. Bump it whenever a template below changes:
+# results of the previous prompts are then no longer served, without clearing the cache.
+PROMPT_VERSION = 2
+
+VIDEO_SUMMARY = (
+    "Summarize the video given its title, description and subtitles into increasing levels of conciseness. "
+    "Begin by summarizing it into a single paragraph.\n\n"
+    "Do not describe or mention the video itself. Simply summarize the points it makes. "
+    "Focus on the overall or underlying takeaway, cause, reason, or answer BEYOND what's already in the title "
+    "and description, which is already shown to the user. PROVIDE NO OTHER OUTPUT OTHER THAN THE PARAGRAPH."
+)
+
+VIDEO_REDUCE = (
+    "Summarize the video given its title, description and summaries of its consecutive parts into increasing "
+    "levels of conciseness. Begin by summarizing it into a single paragraph.\n\n"
+    "Do not describe or mention the video itself. Simply summarize the points it makes. "
+    "Focus on the overall or underlying takeaway, cause, reason, or answer BEYOND what's already in the title "
+    "and description, which is already shown to the user. PROVIDE NO OTHER OUTPUT OTHER THAN THE PARAGRAPH."
+)
+
+VIDEO_CHUNK_SUMMARY = (
+    "Summarize the given part of the subtitles of a video into a single paragraph. Keep every key point, fact "
+    "and argument it makes, they will be combined with summaries of the other parts later.\n\n"
+    "PROVIDE NO OTHER OUTPUT OTHER THAN THE PARAGRAPH."
+)
+
+ARTICLE_SUMMARY = (
+    "Summarize the article given its title and content into increasing levels of conciseness. "
+    "Begin by summarizing it into a single paragraph.\n\n"
+    "Do not describe or mention the article itself. Simply summarize the points it makes. "
+    "Focus on the overall or underlying takeaway, cause, reason, or answer BEYOND what's already in the title "
+    "and description, which is already shown to the user. PROVIDE NO OTHER OUTPUT OTHER THAN THE PARAGRAPH."
+)
+
+TRANSLATION = (
+    "Translate the text from English to the given language. "
+    "Under no circumstances DO NOT change content, just provide translation."
+)
+
+STRUCTURED_TRANSLATIONS = (
+    "\n\nAlso translate the paragraph to: {languages}. Under no circumstances DO NOT change content in "
+    "translations. Respond with JSON containing the English 'paragraph' and its 'translations' keyed by language code."
+)
+
+
+def summary_cache_key(name: str) -> str:
+    """
+    Cache key of a summary made with the current prompts.
+
+    Args:
+        name: Video id, or article_{content hash} for articles
+
+    Returns:
+        Key of the summary, its translations are cached under the key followed by _{lang}
+    """
+    return f'{name}_v{PROMPT_VERSION}_response'
+
+
+def video_summary(subtitles: str, title: str, description: str) -> List[Dict]:
+    return __messages(VIDEO_SUMMARY, f"Title: {title}\nDescription:\n```{description}```\n\nSubtitles:\n{subtitles}")
+
+
+def video_reduce(chunk_summaries: List[str], title: str, description: str) -> List[Dict]:
+    parts = '\n\n'.join(chunk_summaries)
+    return __messages(VIDEO_REDUCE,
+                      f"Title: {title}\nDescription:\n```{description}```\n\nSummaries of the parts:\n{parts}")
+
+
+def video_chunk_summary(chunk: str, title: str) -> List[Dict]:
+    return __messages(VIDEO_CHUNK_SUMMARY, f"Title: {title}\n\nSubtitles part:\n{chunk}")
+
+
+def article_summary(title: str, content: str) -> List[Dict]:
+    return __messages(ARTICLE_SUMMARY, f"Title: {title}\nContent:\n```{content}```")
+
+
+def translation(paragraph: str, language: str) -> List[Dict]:
+    return __messages(TRANSLATION, f"Language: {language}\n---\n{paragraph}")
+
+
+def with_structured_translations(messages: List[Dict], languages: str) -> List[Dict]:
+    """
+    Extend the instructions of a summary prompt with translations to the given languages, answered as JSON.
+
+    The languages only change with the configuration, so the system message stays a stable prefix.
+    """
+    system, *rest = messages
+    return [{**system, 'content': system['content'] + STRUCTURED_TRANSLATIONS.format(languages=languages)}, *rest]
+
+
+def __messages(instructions, content):
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": content},
+    ]
@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import threading
+import time
+
+from cache import CACHE_DIR
+
+# Rate limit configuration, read from the environment:
+#   RATE_LIMIT_MISS_PER_MINUTE - requests per client that have to run the pipeline (default: 5)
+#   RATE_LIMIT_HIT_PER_MINUTE  - requests per client answered from the cache (default: 60)
+#   RATE_LIMIT_BATCH_PER_MINUTE - uncached videos per client run by the token protected batch endpoint
+#                                 (default: 600), stage limits and the batch concurrency do the real throttling
+#   RATE_LIMIT_STORE           - 'memory' (default, per process) or 'sqlite' (shared by processes on one host)
+#   RATE_LIMIT_SQLITE_PATH     - database file for the sqlite store (default: CACHE_DIR/ratelimit.db)
+# Both budgets allow a burst of their per-minute count, then refill continuously.
+# A budget of 0 refuses all requests of its kind, they are told to retry after CLOSED_RETRY_AFTER seconds.
+DEFAULT_MISS_PER_MINUTE = 5
+DEFAULT_HIT_PER_MINUTE = 60
+DEFAULT_BATCH_PER_MINUTE = 600
+CLOSED_RETRY_AFTER = 60
+
+BUDGET_HIT = 'hit'
+BUDGET_MISS = 'miss'
+BUDGET_BATCH = 'batch'
+
+# Buckets untouched for this long are full again and are dropped
+IDLE_TTL = 600
+EVICTION_INTERVAL = 60
+
+
+class MemoryBucketStore:
+    """
+    Token buckets of a single process, [tokens, updated_at] per key.
+    """
+
+    def __init__(self, idle_ttl=IDLE_TTL):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.idle_ttl = idle_ttl
+        self.evicted_at = time.time()
+
+    def take(self, key, capacity, rate, now):
+        with self.lock:
+            self.__evict_idle(now)
+
+            tokens, updated_at = self.buckets.get(key, (capacity, now))
+            tokens, retry_after = take_token(tokens, updated_at, capacity, rate, now)
+            self.buckets[key] = (tokens, now)
+            return retry_after
+
+    def __evict_idle(self, now):
+        if now - self.evicted_at < EVICTION_INTERVAL:
+            return
+        self.evicted_at = now
+        self.buckets = {key: bucket for key, bucket in self.buckets.items() if now - bucket[1] < self.idle_ttl}
+
+
+class SqliteBucketStore:
+    """
+    Token buckets in a SQLite file, so every worker process of the server shares the same limits.
+    """
+
+    def __init__(self, path, idle_ttl=IDLE_TTL):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.local = threading.local()
+        self.evicted_at = time.time()
+
+        with self.__connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)')
+
+    def take(self, key, capacity, rate, now):
+        connection = self.__connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if now - self.evicted_at >= EVICTION_INTERVAL:
+                self.evicted_at = now
+                connection.execute('DELETE FROM buckets WHERE updated_at < ?', (now - self.idle_ttl,))
+
+            row = connection.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated_at = row if row else (capacity, now)
+            tokens, retry_after = take_token(tokens, updated_at, capacity, rate, now)
+            connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return retry_after
+
+    def __connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self.local.connection = connection
+        return connection
+
+
+def take_token(tokens, updated_at, capacity, rate, now):
+    """
+    Refill a bucket for the time elapsed and take one token.
+
+    Returns the remaining tokens and 0 when the token was taken, otherwise the unchanged
+    (refilled) tokens and the seconds until a token is available.
+    """
+    tokens = min(capacity, tokens + (now - updated_at) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class RateLimiter:
+    """
+    Per-client token buckets with separate budgets for requests served from the cache
+    and requests that run the pipeline, since only the latter cost OpenAI and proxy usage.
+    """
+
+    def __init__(self, store, budgets):
+        self.store = store
+        self.budgets = budgets
+
+    def take(self, client, budget):
+        """
+        Returns 0 when the request is allowed, otherwise the seconds the client should wait.
+        """
+        per_minute = self.budgets[budget]
+        if per_minute <= 0:
+            return CLOSED_RETRY_AFTER
+        return self.store.take(f'{budget}:{client}', per_minute, per_minute / 60, time.time())
+
+
+__limiter = None
+__lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global __limiter
+
+    if __limiter is None:
+        with __lock:
+            if __limiter is None:
+                __limiter = RateLimiter(__create_store(os.getenv('RATE_LIMIT_STORE', 'memory')), {
+                    BUDGET_MISS: int(os.getenv('RATE_LIMIT_MISS_PER_MINUTE', DEFAULT_MISS_PER_MINUTE)),
+                    BUDGET_HIT: int(os.getenv('RATE_LIMIT_HIT_PER_MINUTE', DEFAULT_HIT_PER_MINUTE)),
+                    BUDGET_BATCH: int(os.getenv('RATE_LIMIT_BATCH_PER_MINUTE', DEFAULT_BATCH_PER_MINUTE)),
+                })
+    return __limiter
+
+
+def __create_store(name):
+    if name == 'memory':
+        return MemoryBucketStore()
+    if name == 'sqlite':
+        return SqliteBucketStore(os.getenv('RATE_LIMIT_SQLITE_PATH', os.path.join(CACHE_DIR, 'ratelimit.db')))
+    raise ValueError(f'Unsupported rate limit store: {name}')
@@ -0,0 +1,140 @@
+import asyncio
+import fcntl
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import metrics
+from cache import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Limits of concurrent pipeline stages, shared by all worker processes on the host, read from the environment:
+#   YTDLP_MAX_CONCURRENCY  - simultaneous yt-dlp extractions (default: 4)
+#   OPENAI_MAX_CONCURRENCY - simultaneous OpenAI completions (default: 16)
+#   STAGE_QUEUE_TIMEOUT    - seconds a stage waits for a free slot before the request is rejected (default: 5)
+#   STAGE_LOCK_DIR         - directory of the slot lock files (default: CACHE_DIR/locks)
+# A limit of 0 disables it.
+DEFAULT_YTDLP_MAX_CONCURRENCY = 4
+DEFAULT_OPENAI_MAX_CONCURRENCY = 16
+DEFAULT_QUEUE_TIMEOUT = 5
+
+STAGE_YTDLP = 'ytdlp'
+STAGE_OPENAI = 'openai'
+
+# How often a waiting stage retries the slots
+POLL_INTERVAL = 0.05
+
+
+class Overloaded(Exception):
+    """
+    No slot of a stage became free in time, the request should be retried after retry_after seconds.
+    """
+
+    def __init__(self, stage, retry_after, message=None):
+        super().__init__(message or f'Too many concurrent {stage} requests, try again later')
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class StageLimit:
+    """
+    Counting semaphore over slot lock files: a slot is taken by holding an exclusive flock on one of
+    max_concurrency files, so the limit holds across processes sharing lock_dir.
+
+    flock locks belong to the open file, every acquire opens its own, so threads of one process compete
+    for slots like other processes do. The kernel releases the locks of a process that dies,
+    a crashed worker never leaks its slots.
+    """
+
+    def __init__(self, stage, max_concurrency, lock_dir, timeout):
+        self.stage = stage
+        self.max_concurrency = max_concurrency
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        if max_concurrency:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    @contextmanager
+    def acquire(self):
+        if not self.max_concurrency:
+            yield
+            return
+
+        deadline = time.monotonic() + self.timeout
+        slot = self.__try_acquire()
+        while slot is None:
+            if time.monotonic() >= deadline:
+                raise self.__overloaded()
+            time.sleep(POLL_INTERVAL)
+            slot = self.__try_acquire()
+
+        try:
+            yield
+        finally:
+            os.close(slot)
+
+    @asynccontextmanager
+    async def acquire_async(self):
+        if not self.max_concurrency:
+            yield
+            return
+
+        deadline = time.monotonic() + self.timeout
+        slot = self.__try_acquire()
+        while slot is None:
+            if time.monotonic() >= deadline:
+                raise self.__overloaded()
+            await asyncio.sleep(POLL_INTERVAL)
+            slot = self.__try_acquire()
+
+        try:
+            yield
+        finally:
+            os.close(slot)
+
+    def __try_acquire(self):
+        for i in range(self.max_concurrency):
+            fd = os.open(os.path.join(self.lock_dir, f'{self.stage}.{i}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def __overloaded(self):
+        logger.warning(f'No free {self.stage} slot within {self.timeout}s, rejecting the request')
+        metrics.inc('tldw_overloaded_total', stage=self.stage)
+        return Overloaded(self.stage, max(1, math.ceil(self.timeout)))
+
+
+__limits = {}
+__lock = threading.Lock()
+
+
+def get_stage_limit(stage):
+    """
+    Returns the process-wide limit of a stage (STAGE_YTDLP or STAGE_OPENAI).
+    """
+    limit = __limits.get(stage)
+    if limit is None:
+        with __lock:
+            limit = __limits.get(stage)
+            if limit is None:
+                limit = __limits[stage] = StageLimit(
+                    stage, __max_concurrency(stage),
+                    os.getenv('STAGE_LOCK_DIR', os.path.join(CACHE_DIR, 'locks')),
+                    float(os.getenv('STAGE_QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT)))
+    return limit
+
+
+def __max_concurrency(stage):
+    if stage == STAGE_YTDLP:
+        return int(os.getenv('YTDLP_MAX_CONCURRENCY', DEFAULT_YTDLP_MAX_CONCURRENCY))
+    if stage == STAGE_OPENAI:
+        return int(os.getenv('OPENAI_MAX_CONCURRENCY', DEFAULT_OPENAI_MAX_CONCURRENCY))
+    raise ValueError(f'Unsupported stage: {stage}')
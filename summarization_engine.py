@@ -0,0 +1,399 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import openai_clients
+import prompts
+from circuit_breaker import UPSTREAM_OPENAI, get_circuit_breaker
+from stage_limits import STAGE_OPENAI, get_stage_limit
+from cache import ensure_cache_dir, create_cache_json, reuse_cache_json
+
+logger = logging.getLogger(__name__)
+
+MODEL = 'gpt-4o'
+
+# USD per 1M tokens (input, cached input, output), for the cost estimate reported in the metrics
+MODEL_PRICES = {
+    'gpt-4o': (2.50, 1.25, 10.00),
+}
+
+# Summary configuration, read from the environment:
+#   SUMMARY_LANGUAGES - comma separated language codes the English summary is translated to (default: pl)
+#   SUMMARY_MODE      - 'separate' (default) translates in follow-up calls sending only the paragraph,
+#                       'structured' asks for the summary and all translations in a single JSON call
+#   CHUNK_CONCURRENCY - parallel completions when summarizing chunks of a long text (default: 4)
+LANGUAGE_NAMES = {
+    'pl': 'Polish',
+    'de': 'German',
+    'fr': 'French',
+    'es': 'Spanish',
+    'it': 'Italian',
+    'pt': 'Portuguese',
+    'cs': 'Czech',
+    'uk': 'Ukrainian',
+}
+
+
+def get_target_languages():
+    return [lang.strip() for lang in os.getenv('SUMMARY_LANGUAGES', 'pl').split(',') if lang.strip()]
+
+
+def record_usage(usage, model=MODEL, price_factor=1.0):
+    """
+    Count the tokens of a completion and its estimated cost.
+
+    Args:
+        usage: completion.usage, or its dictionary form as found in Batch API results
+        model: Model the completion was made with
+        price_factor: Multiplier of the list price, e.g. 0.5 for the Batch API discount
+    """
+    if not usage:
+        return
+
+    prompt_tokens = __usage_value(usage, 'prompt_tokens')
+    completion_tokens = __usage_value(usage, 'completion_tokens')
+    cached_tokens = __usage_value(__usage_value(usage, 'prompt_tokens_details', None), 'cached_tokens')
+
+    logger.debug(f'Completion usage: {prompt_tokens} prompt tokens ({cached_tokens} cached), '
+                 f'{completion_tokens} completion tokens')
+    metrics.inc('tldw_openai_tokens_total', prompt_tokens, model=model, type='prompt')
+    metrics.inc('tldw_openai_tokens_total', cached_tokens, model=model, type='cached')
+    metrics.inc('tldw_openai_tokens_total', completion_tokens, model=model, type='completion')
+
+    if model in MODEL_PRICES:
+        input_price, cached_price, output_price = MODEL_PRICES[model]
+        cost = ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+                + completion_tokens * output_price) / 1_000_000
+        metrics.inc('tldw_openai_cost_usd_total', cost * price_factor, model=model)
+
+
+def __usage_value(usage, field, default=0):
+    if usage is None:
+        return default
+    value = usage.get(field) if isinstance(usage, dict) else getattr(usage, field, None)
+    return default if value is None else value
+
+
+class SummarizationEngine:
+    """
+    Produces an English summary paragraph and its translations.
+
+    The English summary is cached under cache_key and every translation separately under
+    f'{cache_key}_{lang}', so adding a target language only costs the translation of the paragraph.
+    Returned responses contain 'title', 'paragraph' and a 'paragraph_{lang}' field per target language.
+
+    Instructions are chat message lists built by prompts.py. An instruction may be given as a callable
+    producing it (a coroutine function for summarize_async), so expensive prompt preparation only happens
+    when the summary is not cached.
+
+    OpenAI clients are shared by the whole process (see openai_clients), every completion
+    sends its own message list, so an engine keeps no per-request state and can be reused.
+    """
+
+    def __init__(self):
+        ensure_cache_dir()
+
+        self.client = openai_clients.get_client()
+        self.languages = get_target_languages()
+        self.mode = os.getenv('SUMMARY_MODE', 'separate')
+        self.chunk_concurrency = int(os.getenv('CHUNK_CONCURRENCY', 4))
+
+    def summarize(self, cache_key, title, instruction, on_stage=None):
+        response = reuse_cache_json(cache_key)
+        if not response:
+            self.__report_stage(on_stage, 'summary')
+            with metrics.timed('tldw_stage_seconds', stage='summary'):
+                instruction = instruction() if callable(instruction) else instruction
+                if self.mode == 'structured' and self.languages:
+                    paragraph, translations = self.__parse_structured(self.__complete(
+                        self.__structured_instruction(instruction), self.__structured_response_format()))
+                    self.__store_translations(cache_key, translations)
+                else:
+                    paragraph = self.__complete(instruction)
+                response = self.__store_summary(cache_key, title, paragraph)
+
+        result, missing = self.__collect_translations(cache_key, response)
+        if missing:
+            self.__report_stage(on_stage, 'translation')
+            with metrics.timed('tldw_stage_seconds', stage='translation'), \
+                    ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                translations = dict(zip(missing, executor.map(
+                    lambda lang: self.__complete(self.__translation_instruction(result['paragraph'], lang)),
+                    missing)))
+            self.__store_translations(cache_key, translations)
+            result.update({f'paragraph_{lang}': text for lang, text in translations.items()})
+
+        return result
+
+    async def summarize_async(self, cache_key, title, instruction):
+        response = reuse_cache_json(cache_key)
+        if not response:
+            with metrics.timed('tldw_stage_seconds', stage='summary'):
+                if callable(instruction):
+                    instruction = instruction()
+                    if inspect.isawaitable(instruction):
+                        instruction = await instruction
+                if self.mode == 'structured' and self.languages:
+                    paragraph, translations = self.__parse_structured(await self.__complete_async(
+                        self.__structured_instruction(instruction), self.__structured_response_format()))
+                    self.__store_translations(cache_key, translations)
+                else:
+                    paragraph = await self.__complete_async(instruction)
+                response = self.__store_summary(cache_key, title, paragraph)
+
+        result, missing = self.__collect_translations(cache_key, response)
+        if missing:
+            with metrics.timed('tldw_stage_seconds', stage='translation'):
+                translations = dict(zip(missing, await asyncio.gather(*[
+                    self.__complete_async(self.__translation_instruction(result['paragraph'], lang))
+                    for lang in missing
+                ])))
+            self.__store_translations(cache_key, translations)
+            result.update({f'paragraph_{lang}': text for lang, text in translations.items()})
+
+        return result
+
+    def summarize_stream(self, cache_key, title, instruction):
+        """
+        Generator variant of summarize, yielding (event, data) tuples: ('paragraph', delta) and
+        ('translation', {'language': lang, 'delta': delta}) as tokens arrive, then ('summary', response).
+        """
+        response = reuse_cache_json(cache_key)
+        if not response:
+            instruction = instruction() if callable(instruction) else instruction
+            paragraph = ''
+            for delta in self.__complete_stream(instruction):
+                paragraph += delta
+                yield 'paragraph', delta
+            response = self.__store_summary(cache_key, title, paragraph)
+
+        result, missing = self.__collect_translations(cache_key, response)
+        for lang in missing:
+            translation = ''
+            for delta in self.__complete_stream(self.__translation_instruction(result['paragraph'], lang)):
+                translation += delta
+                yield 'translation', {'language': lang, 'delta': delta}
+            self.__store_translations(cache_key, {lang: translation})
+            result[f'paragraph_{lang}'] = translation
+
+        yield 'summary', result
+
+    def is_cached(self, cache_key):
+        """
+        Whether the summary and all its translations are cached, so summarize makes no completions.
+        """
+        response = reuse_cache_json(cache_key)
+        return bool(response) and not self.__collect_translations(cache_key, response)[1]
+
+    def summarize_chunks(self, instructions):
+        """
+        Run independent chunk summaries with bounded parallelism (map step of a map-reduce summary).
+
+        Each result is cached under a hash of its instruction, so chunks shared between runs are reused.
+        """
+        with ThreadPoolExecutor(max_workers=self.chunk_concurrency) as executor:
+            return list(executor.map(self.__summarize_chunk, instructions))
+
+    async def summarize_chunks_async(self, instructions):
+        semaphore = asyncio.Semaphore(self.chunk_concurrency)
+
+        async def summarize_chunk(instruction):
+            cache_key = self.__chunk_cache_key(instruction)
+            result = reuse_cache_json(cache_key)
+            if result:
+                return result['summary']
+            async with semaphore:
+                summary = await self.__complete_async(instruction)
+            create_cache_json(cache_key, {'summary': summary})
+            return summary
+
+        return await asyncio.gather(*[summarize_chunk(instruction) for instruction in instructions])
+
+    def summarize_batch(self, requests, backend):
+        """
+        Summarize many texts through a batch backend (see openai_batch.OpenAIBatchBackend) in two phases:
+        the uncached summaries first, then the translations they are missing. Results are cached like summarize.
+
+        Batches always translate in the second phase, SUMMARY_MODE does not apply.
+
+        Args:
+            requests: List of (cache_key, title, instruction) tuples, instruction may be a callable
+            backend: Object with complete(instructions), mapping ids to instructions and returning ids to answers
+
+        Returns:
+            Dictionary of results keyed by cache_key, None for requests that failed in the batch
+        """
+        titles = {}
+        instructions = {}
+        for cache_key, title, instruction in requests:
+            if cache_key in instructions or reuse_cache_json(cache_key):
+                continue
+            titles[cache_key] = title
+            instructions[cache_key] = instruction() if callable(instruction) else instruction
+
+        for cache_key, paragraph in backend.complete(instructions).items():
+            self.__store_summary(cache_key, titles[cache_key], paragraph)
+
+        translations = {}
+        for cache_key, _, _ in requests:
+            response = reuse_cache_json(cache_key)
+            if not response:
+                continue
+            result, missing = self.__collect_translations(cache_key, response)
+            for lang in missing:
+                translations[f'{cache_key}_{lang}'] = self.__translation_instruction(result['paragraph'], lang)
+
+        for translation_key, translation in backend.complete(translations).items():
+            create_cache_json(translation_key, {'paragraph': translation})
+
+        results = {}
+        for cache_key, _, _ in requests:
+            response = reuse_cache_json(cache_key)
+            result, missing = self.__collect_translations(cache_key, response) if response else (None, True)
+            results[cache_key] = None if missing else result
+        return results
+
+    def summarize_chunks_batch(self, instructions, backend):
+        """
+        Cache chunk summaries through a batch backend, so summarize_chunks finds them without completions.
+        """
+        pending = {}
+        for instruction in instructions:
+            cache_key = self.__chunk_cache_key(instruction)
+            if not reuse_cache_json(cache_key):
+                pending[cache_key] = instruction
+
+        for cache_key, summary in backend.complete(pending).items():
+            create_cache_json(cache_key, {'summary': summary})
+
+    def __summarize_chunk(self, instruction):
+        cache_key = self.__chunk_cache_key(instruction)
+        result = reuse_cache_json(cache_key)
+        if result:
+            return result['summary']
+        summary = self.__complete(instruction)
+        create_cache_json(cache_key, {'summary': summary})
+        return summary
+
+    def __chunk_cache_key(self, instruction):
+        return f'chunk_{hashlib.sha256(json.dumps(instruction).encode("utf-8")).hexdigest()}'
+
+    def __store_summary(self, cache_key, title, paragraph):
+        response = {
+            'title': title,
+            'paragraph': paragraph,
+        }
+        create_cache_json(cache_key, response)
+        return response
+
+    def __store_translations(self, cache_key, translations):
+        for lang, translation in translations.items():
+            create_cache_json(f'{cache_key}_{lang}', {'paragraph': translation})
+
+    def __collect_translations(self, cache_key, response):
+        """
+        Returns the response extended with the cached translations and the languages still missing.
+        """
+        result = dict(response)
+        missing = []
+        for lang in self.languages:
+            translation = reuse_cache_json(f'{cache_key}_{lang}')
+            if translation:
+                result[f'paragraph_{lang}'] = translation['paragraph']
+            else:
+                missing.append(lang)
+        return result, missing
+
+    def __translation_instruction(self, paragraph, lang):
+        return prompts.translation(paragraph, LANGUAGE_NAMES.get(lang, lang))
+
+    def __structured_instruction(self, instruction):
+        languages = ', '.join(f'{LANGUAGE_NAMES.get(lang, lang)} ({lang})' for lang in self.languages)
+        return prompts.with_structured_translations(instruction, languages)
+
+    def __structured_response_format(self):
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "summary",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "paragraph": {"type": "string"},
+                        "translations": {
+                            "type": "object",
+                            "properties": {lang: {"type": "string"} for lang in self.languages},
+                            "required": self.languages,
+                            "additionalProperties": False,
+                        },
+                    },
+                    "required": ["paragraph", "translations"],
+                    "additionalProperties": False,
+                },
+            },
+        }
+
+    def __parse_structured(self, answer):
+        result = json.loads(answer)
+        return result['paragraph'], result['translations']
+
+    def __report_stage(self, on_stage, stage):
+        if on_stage:
+            on_stage(stage)
+
+    def __complete(self, instruction, response_format=None):
+        with get_circuit_breaker(UPSTREAM_OPENAI).guard(openai_clients.is_upstream_failure), get_stage_limit(STAGE_OPENAI).acquire(), \
+                metrics.timed('tldw_openai_request_seconds', model=MODEL):
+            completion = self.client.chat.completions.create(
+                model=MODEL,
+                store=True,
+                messages=instruction,
+                **({'response_format': response_format} if response_format else {}),
+            )
+        record_usage(completion.usage)
+        answer = completion.choices[0].message.content
+        logger.debug(f"Completion: {answer}")
+        return answer
+
+    async def __complete_async(self, instruction, response_format=None):
+        with get_circuit_breaker(UPSTREAM_OPENAI).guard(openai_clients.is_upstream_failure):
+            async with get_stage_limit(STAGE_OPENAI).acquire_async():
+                with metrics.timed('tldw_openai_request_seconds', model=MODEL):
+                    completion = await openai_clients.get_async_client().chat.completions.create(
+                        model=MODEL,
+                        store=True,
+                        messages=instruction,
+                        **({'response_format': response_format} if response_format else {}),
+                    )
+        record_usage(completion.usage)
+        answer = completion.choices[0].message.content
+        logger.debug(f"Completion: {answer}")
+        return answer
+
+    def __complete_stream(self, instruction):
+        # The slot is held until the whole answer has been streamed
+        with get_circuit_breaker(UPSTREAM_OPENAI).guard(openai_clients.is_upstream_failure), get_stage_limit(STAGE_OPENAI).acquire():
+            stream = self.client.chat.completions.create(
+                model=MODEL,
+                store=True,
+                messages=instruction,
+                stream=True,
+                stream_options={'include_usage': True},
+            )
+            answer = ''
+            for chunk in stream:
+                if not chunk.choices:
+                    # The final chunk carries the usage of the whole completion
+                    record_usage(chunk.usage)
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    answer += delta
+                    yield delta
+        logger.debug(f"Completion: {answer}")
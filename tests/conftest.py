@@ -0,0 +1,48 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+
+import cache
+import stage_limits
+from stub_server import StubServer
+
+
+def load_app(file_name):
+    """
+    The app of tldw-web.py or tldw-asgi.py, whose file names are not importable module names.
+    """
+    spec = importlib.util.spec_from_file_location(file_name.replace('-', '_')[:-3], os.path.join(ROOT_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """
+    Runs the test with an empty disk cache in a temporary directory (the cache lives in ./cache).
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('CACHE_BACKEND', 'disk')
+    # The backend and its in-memory tier are created again on first use
+    monkeypatch.setattr(cache, '__backend', None)
+    monkeypatch.setattr(cache, '__memory', None)
+    # Stage slots are lock files in ./cache/locks
+    monkeypatch.setattr(stage_limits, '__limits', {})
+    return tmp_path / 'cache'
+
+
+@pytest.fixture(scope='session')
+def stub_server():
+    """
+    The local caption, article and OpenAI stub of the benchmarks, shared by the whole test run.
+    """
+    stub = StubServer().start()
+    yield stub
+    stub.stop()
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+
+import pytest
+
+import http_session
+import openai_clients
+from article_content import ArticleContentExtractor
+from tldr import summarize_article
+
+ARTICLE = 'orbital-mechanics.html'
+TITLE = 'Orbital mechanics for the impatient'
+FIRST_SENTENCE = 'An orbit is a fall that keeps missing the ground.'
+LAST_SENTENCE = 'the solar system becomes a map of price tags.'
+# Ends in the second paragraph of the page
+CAPPED_BYTES = 1500
+
+
+@pytest.fixture
+def articles(stub_server, monkeypatch):
+    monkeypatch.delenv('ARTICLE_MAX_BYTES', raising=False)
+    monkeypatch.setattr(http_session, '__sessions', threading.local())
+    return stub_server
+
+
+@pytest.fixture
+def openai_stub(articles, cache_dir, monkeypatch):
+    monkeypatch.setenv('OPENAI_BASE_URL', f'{articles.base_url}/v1')
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setenv('SUMMARY_LANGUAGES', 'pl')
+    monkeypatch.setattr(openai_clients, '__client', None)
+    return articles
+
+
+def article_url(stub, query=''):
+    return f'{stub.base_url}/articles/{ARTICLE}{query}'
+
+
+def extract(url, validators=None, use_async=False):
+    if use_async:
+        return asyncio.run(ArticleContentExtractor.create_async(url, validators=validators))
+    return ArticleContentExtractor(url, validators=validators)
+
+
+def responses_of(stub, url):
+    path = url[len(stub.base_url):]
+    return [status for requested, status in stub.article_responses if requested == path]
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_page_is_extracted_with_its_validators(articles, use_async):
+    extractor = extract(article_url(articles), use_async=use_async)
+
+    article = extractor.run()
+    assert article['title'] == TITLE
+    assert article['content'].startswith(FIRST_SENTENCE)
+    assert article['content'].endswith(LAST_SENTENCE)
+    assert extractor.etag and extractor.last_modified is None
+    assert not extractor.not_modified
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_oversized_page_is_cut_at_the_byte_cap(articles, monkeypatch, use_async):
+    full = extract(article_url(articles)).run()['content']
+    monkeypatch.setenv('ARTICLE_MAX_BYTES', str(CAPPED_BYTES))
+
+    capped = extract(article_url(articles), use_async=use_async).run()
+
+    assert capped['title'] == TITLE
+    assert full.startswith(capped['content']) and len(capped['content']) < len(full)
+    assert 'Going faster' in capped['content'] and LAST_SENTENCE not in capped['content']
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+@pytest.mark.parametrize('content_type', ['application/pdf', 'application/json; charset=utf-8', 'image/png'])
+def test_non_html_page_is_rejected(articles, use_async, content_type):
+    with pytest.raises(Exception, match=f'Not an HTML page: {content_type.split(";")[0]}'):
+        extract(article_url(articles, f'?type={content_type}'), use_async=use_async)
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+@pytest.mark.parametrize('validator, field', [('etag', 'etag'), ('last-modified', 'last_modified')])
+def test_unchanged_page_is_not_downloaded_again(articles, use_async, validator, field):
+    url = article_url(articles, f'?validator={validator}')
+    first = extract(url)
+
+    again = extract(url, validators={field: getattr(first, field)}, use_async=use_async)
+
+    assert getattr(first, field)
+    assert again.not_modified and again.tree is None
+    assert responses_of(articles, url)[-2:] == [200, 304]
+
+
+def test_page_with_a_stale_validator_is_downloaded_again(articles):
+    url = article_url(articles)
+
+    extractor = extract(url, validators={'etag': '"stale"', 'last_modified': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+
+    assert not extractor.not_modified
+    assert extractor.run()['title'] == TITLE
+
+
+@pytest.mark.parametrize('validator', ['etag', 'last-modified'])
+def test_summarized_article_is_revalidated_instead_of_summarized_again(openai_stub, validator):
+    url = article_url(openai_stub, f'?validator={validator}')
+    first = summarize_article(url)
+    completions = openai_stub.completions
+
+    again = summarize_article(url)
+
+    assert again == first
+    assert first['title'] == TITLE and first['summary'] and first['summary_pl']
+    assert openai_stub.completions == completions
+    assert responses_of(openai_stub, url)[-2:] == [200, 304]
+
+
+def test_same_content_at_another_url_reuses_the_summary(openai_stub):
+    first = summarize_article(article_url(openai_stub))
+    completions = openai_stub.completions
+
+    # Another canonical URL, the page is downloaded but its content hash is known
+    other = summarize_article(article_url(openai_stub, '?validator=last-modified&ref=feed'))
+
+    assert other == first
+    assert openai_stub.completions == completions
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+import batch
+from batch import STATUS_DONE, STATUS_FAILED, summarize_videos
+from circuit_breaker import CircuitOpen
+from stage_limits import STAGE_OPENAI, Overloaded
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+VIDEO_URL = f'https://www.youtube.com/watch?v={VIDEO_ID}'
+
+
+class RejectingSummarizer:
+    def __init__(self, rejections):
+        self.rejections = rejections
+        self.calls = 0
+
+    def __call__(self, url):
+        self.calls += 1
+        if self.calls <= self.rejections:
+            raise CircuitOpen('openai', 0.05) if self.calls % 2 else Overloaded(STAGE_OPENAI, 0.05)
+        return {'url': url}
+
+
+@pytest.fixture
+def summarizer(cache_dir, monkeypatch):
+    monkeypatch.setenv('BATCH_MAX_WAIT_SECONDS', '0.3')
+
+    def install(rejections):
+        summarize = RejectingSummarizer(rejections)
+        monkeypatch.setattr(batch, 'summarize_video', summarize)
+        return summarize
+
+    return install
+
+
+def test_overloaded_video_is_retried(summarizer):
+    summarize = summarizer(rejections=2)
+
+    item, report = summarize_videos([VIDEO_URL])
+
+    assert item['status'] == STATUS_DONE
+    assert summarize.calls == 3
+    assert report['report']['done'] == 1
+
+
+def test_video_overloaded_for_too_long_fails_with_retry_after(summarizer):
+    summarize = summarizer(rejections=1000)
+
+    item, report = summarize_videos([VIDEO_URL])
+
+    assert item['status'] == STATUS_FAILED
+    assert item['retry_after'] == 0.05
+    assert item['seconds'] < 1
+    assert 1 < summarize.calls < 1000
+    assert report['report']['failed'] == 1
+
+
+def test_closing_the_stream_drops_videos_not_started(cache_dir, monkeypatch):
+    started = []
+
+    def summarize(url):
+        started.append(url)
+        time.sleep(0.05)
+        return {'url': url}
+
+    monkeypatch.setattr(batch, 'summarize_video', summarize)
+    urls = [f'https://www.youtube.com/watch?v=video{n:06d}' for n in range(20)]
+
+    items = summarize_videos(urls, concurrency=2)
+    assert next(items)['status'] == STATUS_DONE
+    items.close()
+    time.sleep(0.2)
+
+    assert len(started) <= 4
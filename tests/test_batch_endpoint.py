@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import batch
+import rate_limiter
+from conftest import load_app
+from rate_limiter import (BUDGET_BATCH, BUDGET_HIT, BUDGET_MISS, DEFAULT_BATCH_PER_MINUTE, DEFAULT_HIT_PER_MINUTE,
+                          DEFAULT_MISS_PER_MINUTE, MemoryBucketStore, RateLimiter)
+
+TOKEN = 'batch-secret'
+# More uncached videos than the interactive miss budget lets through
+VIDEO_IDS = [f'video{n:06d}' for n in range(DEFAULT_MISS_PER_MINUTE * 2 + 2)]
+
+
+def limiter(batch_per_minute):
+    return RateLimiter(MemoryBucketStore(), {
+        BUDGET_MISS: DEFAULT_MISS_PER_MINUTE,
+        BUDGET_HIT: DEFAULT_HIT_PER_MINUTE,
+        BUDGET_BATCH: batch_per_minute,
+    })
+
+
+@pytest.fixture(params=['tldw-web.py', 'tldw-asgi.py'])
+def client(request, cache_dir, monkeypatch):
+    monkeypatch.setenv('BATCH_API_TOKEN', TOKEN)
+    monkeypatch.setattr(rate_limiter, '__limiter', limiter(DEFAULT_BATCH_PER_MINUTE))
+    monkeypatch.setattr(batch, 'summarize_video', lambda url: {'url': url})
+
+    app = load_app(request.param)
+    if request.param == 'tldw-web.py':
+        return app.test_client()
+
+    from starlette.testclient import TestClient
+    return TestClient(app)
+
+
+def post_batch(client, body, token=TOKEN):
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    return client.post('/api/summarize/youtube/batch', json=body, headers=headers)
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def video_urls():
+    return [f'https://www.youtube.com/watch?v={video_id}' for video_id in VIDEO_IDS]
+
+
+def test_endpoint_is_off_without_a_token(client, monkeypatch):
+    monkeypatch.delenv('BATCH_API_TOKEN')
+
+    assert post_batch(client, {'urls': video_urls()}).status_code == 404
+
+
+@pytest.mark.parametrize('token', [None, 'wrong'])
+def test_endpoint_requires_the_token(client, token):
+    response = post_batch(client, {'urls': video_urls()}, token=token)
+
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize('concurrency', ['4', 0, -2, 1.5, True])
+def test_invalid_concurrency_is_rejected_up_front(client, concurrency):
+    response = post_batch(client, {'urls': video_urls(), 'concurrency': concurrency})
+
+    assert response.status_code == 400
+
+
+def test_batch_is_not_held_to_the_interactive_miss_budget(client):
+    items = ndjson(post_batch(client, {'urls': video_urls(), 'concurrency': 2}))
+
+    assert sorted(item['video_id'] for item in items[:-1]) == VIDEO_IDS
+    assert all(item['status'] == 'done' for item in items[:-1])
+    assert items[-1]['report']['done'] == len(VIDEO_IDS)
+
+
+def test_videos_over_the_batch_budget_are_refused(client, monkeypatch):
+    monkeypatch.setattr(rate_limiter, '__limiter', limiter(2))
+
+    items = ndjson(post_batch(client, {'urls': video_urls(), 'concurrency': 2}))
+
+    limited = [item for item in items if item.get('status') == 'failed']
+    assert len(limited) == len(VIDEO_IDS) - 2
+    assert all(item['error'] == 'Rate limit exceeded' and item['retry_after'] > 0 for item in limited)
+    assert items[-1]['report']['done'] == 2
@@ -0,0 +1,158 @@
+import os
+import threading
+
+import pytest
+
+import cache
+from cache_backends import DiskCacheBackend, LruCache, SqliteCacheBackend
+
+VIDEO_ID = 'abcdefghijk'
+
+
+@pytest.fixture(params=['disk', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'disk':
+        backend = DiskCacheBackend(str(tmp_path / 'cache'))
+    else:
+        backend = SqliteCacheBackend(str(tmp_path / 'cache' / 'cache.db'))
+    backend.ensure()
+    return backend
+
+
+def test_backend_stores_reads_and_deletes_entries(backend):
+    backend.write(VIDEO_ID, 'json.gz', b'\x1f\x8b compact')
+    backend.write(VIDEO_ID, 'txt', b'captions', updated_at=1000000000)
+
+    assert backend.read(VIDEO_ID, 'json.gz') == b'\x1f\x8b compact'
+    assert backend.exists(VIDEO_ID, 'txt')
+    entries = {(key, ext): (size, updated_at) for key, ext, size, updated_at in backend.entries()}
+    assert set(entries) == {(VIDEO_ID, 'json.gz'), (VIDEO_ID, 'txt')}
+    assert entries[(VIDEO_ID, 'json.gz')][0] == 10
+    assert entries[(VIDEO_ID, 'txt')] == (8, 1000000000)
+
+    backend.delete(VIDEO_ID, 'txt')
+    backend.delete(VIDEO_ID, 'txt')
+
+    assert backend.read(VIDEO_ID, 'txt') is None
+    assert not backend.exists(VIDEO_ID, 'txt')
+
+
+def test_backend_replaces_entries(backend):
+    backend.write(VIDEO_ID, 'json', b'first')
+    backend.write(VIDEO_ID, 'json', b'second')
+
+    assert backend.read(VIDEO_ID, 'json') == b'second'
+    assert [entry[:3] for entry in backend.entries()] == [(VIDEO_ID, 'json', 6)]
+
+
+def test_disk_backend_replaces_entries_atomically(tmp_path, monkeypatch):
+    backend = DiskCacheBackend(str(tmp_path / 'cache'))
+    backend.ensure()
+    backend.write(VIDEO_ID, 'json', b'complete')
+
+    def failing_replace(source, destination):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    with pytest.raises(OSError):
+        backend.write(VIDEO_ID, 'json', b'partial')
+
+    # The old entry is intact and the temporary file is gone
+    assert backend.read(VIDEO_ID, 'json') == b'complete'
+    assert os.listdir(backend.cache_dir) == [f'{VIDEO_ID}.json']
+
+
+def test_disk_backend_lists_only_cache_entries(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path / 'cache'))
+    backend.ensure()
+    backend.write(VIDEO_ID, 'txt', b'captions')
+    for name in ['.tmp-abc123', 'cache.db', 'jobs.db-wal']:
+        (tmp_path / 'cache' / name).write_bytes(b'not an entry')
+    (tmp_path / 'cache' / 'locks').mkdir()
+
+    assert [entry[:2] for entry in backend.entries()] == [(VIDEO_ID, 'txt')]
+
+
+def test_sqlite_backend_keeps_a_connection_per_thread(tmp_path):
+    backend = SqliteCacheBackend(str(tmp_path / 'cache.db'))
+    backend.ensure()
+    backend.write(VIDEO_ID, 'json', b'from the main thread')
+    results = {}
+
+    def worker(name):
+        # A connection of another thread would raise sqlite3.ProgrammingError
+        results[name] = backend.read(VIDEO_ID, 'json')
+        backend.write(name, 'json', name.encode('utf-8'))
+
+    threads = [threading.Thread(target=worker, args=(f'thread{n}',)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert set(results.values()) == {b'from the main thread'}
+    assert all(backend.read(name, 'json') == name.encode('utf-8') for name in results)
+
+
+def test_lru_evicts_the_least_recently_used_entries_over_the_byte_bound():
+    lru = LruCache(max_entries=10, max_bytes=100)
+    lru.put('a', 'A', 40)
+    lru.put('b', 'B', 40)
+    lru.get('a')
+
+    lru.put('c', 'C', 40)
+
+    assert lru.get('b') is None
+    assert (lru.get('a'), lru.get('c')) == ('A', 'C')
+    assert lru.size == 80
+
+
+def test_lru_evicts_over_the_entry_bound():
+    lru = LruCache(max_entries=2, max_bytes=100)
+    for key in ['a', 'b', 'c']:
+        lru.put(key, key.upper(), 1)
+
+    assert list(lru.entries) == ['b', 'c']
+    assert lru.size == 2
+
+
+def test_lru_does_not_keep_entries_larger_than_the_byte_bound():
+    lru = LruCache(max_entries=10, max_bytes=100)
+    lru.put('a', 'small', 10)
+
+    lru.put('a', 'large', 101)
+
+    assert lru.get('a') is None
+    assert lru.size == 0
+
+
+def test_lru_replacing_an_entry_updates_the_size():
+    lru = LruCache(max_entries=10, max_bytes=100)
+    lru.put('a', 'first', 60)
+    lru.put('a', 'second', 30)
+    lru.discard('a')
+    lru.discard('a')
+
+    assert lru.size == 0
+    assert not lru.entries
+
+
+def test_lru_without_entries_is_disabled():
+    lru = LruCache(max_entries=0, max_bytes=100)
+    lru.put('a', 'A', 1)
+
+    assert lru.get('a') is None
+
+
+@pytest.mark.parametrize('backend_name', ['disk', 'sqlite'])
+def test_cache_reads_entries_through_the_configured_backend(cache_dir, monkeypatch, backend_name):
+    monkeypatch.setenv('CACHE_BACKEND', backend_name)
+    cache.create_cache_json_gz(VIDEO_ID, {'title': 'Rockets'})
+    cache.create_cache_txt(VIDEO_ID, 'so the rocket engine')
+    # A new process: only the backend has the entries
+    monkeypatch.setattr(cache, '__backend', None)
+    monkeypatch.setattr(cache, '__memory', None)
+
+    assert cache.reuse_cache_json_gz(VIDEO_ID) == {'title': 'Rockets'}
+    assert cache.reuse_cache_txt(VIDEO_ID) == 'so the rocket engine'
+    assert os.path.exists(cache_dir / ('cache.db' if backend_name == 'sqlite' else f'{VIDEO_ID}.txt'))
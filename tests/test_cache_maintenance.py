@@ -0,0 +1,189 @@
+import io
+import tarfile
+import time
+
+import pytest
+
+import cache
+from cache import iter_cache_entries, read_cache_entry, write_cache_entry
+from cache_maintenance import DEFAULT_ORPHAN_GRACE, collect_garbage, export_cache, import_cache
+from prompts import summary_cache_key
+
+DAY = 24 * 3600
+SUMMARIZED = 'summarized1'
+UNSUMMARIZED = 'unsummariz1'
+UNEXTRACTED = 'unextracte1'
+
+
+@pytest.fixture(params=['disk', 'sqlite'])
+def backend_name(request, cache_dir, monkeypatch):
+    monkeypatch.setenv('CACHE_BACKEND', request.param)
+    return request.param
+
+
+def stored():
+    return {(key, ext) for key, ext, _, _ in iter_cache_entries()}
+
+
+def write(key, ext, size=10, age=0, data=None):
+    write_cache_entry(key, ext, data if data is not None else b'x' * size, time.time() - age)
+
+
+def write_pipeline_entries(age):
+    # A summarized video, a video without a summary and a summary whose video info is gone
+    for video_id in (SUMMARIZED, UNSUMMARIZED):
+        write(video_id, 'json.gz', age=age)
+        write(video_id, 'txt', age=age)
+    for video_id in (SUMMARIZED, UNEXTRACTED):
+        write(summary_cache_key(video_id), 'json', age=age)
+        write(f'{summary_cache_key(video_id)}_pl', 'json', age=age)
+    # A translation whose summary is gone
+    write(f'{summary_cache_key(UNSUMMARIZED)}_de', 'json', age=age)
+    # Article pages with and without their summary
+    write(summary_cache_key('article_aa'), 'json', age=age)
+    write('article_page_1', 'json', age=age, data=b'{"content_hash": "aa"}')
+    write('article_page_2', 'json', age=age, data=b'{"content_hash": "bb"}')
+
+
+def test_gc_deletes_entries_by_age(backend_name):
+    write(SUMMARIZED, 'json.gz', age=3 * DAY)
+    write(SUMMARIZED, 'txt', age=3 * DAY)
+    write(summary_cache_key(SUMMARIZED), 'json', age=DAY)
+
+    report = collect_garbage(older_than=2 * DAY)
+
+    assert report['deleted'] == {'age': {'entries': 2, 'bytes': 20}}
+    assert stored() == {(summary_cache_key(SUMMARIZED), 'json')}
+
+
+def test_gc_by_age_keeps_other_kinds(backend_name):
+    write(SUMMARIZED, 'json.gz', age=3 * DAY)
+    write(SUMMARIZED, 'txt', age=3 * DAY)
+
+    collect_garbage(older_than=2 * DAY, kinds=['captions'])
+
+    assert stored() == {(SUMMARIZED, 'json.gz')}
+
+
+@pytest.mark.parametrize('max_bytes, kept', [(700, {'a', 'b', 'c', 'd'}), (699, {'b', 'c', 'd'}), (250, {'c', 'd'}),
+                                              (249, {'d'}), (0, set())])
+def test_gc_deletes_the_least_recently_updated_entries_over_the_size(backend_name, max_bytes, kept):
+    # 700 bytes in all, a is the oldest and largest
+    for age, key in enumerate(['d', 'c', 'b', 'a']):
+        write(key, 'txt', size=100 + age * 50, age=age * DAY)
+
+    report = collect_garbage(max_bytes=max_bytes)
+
+    assert stored() == {(key, 'txt') for key in kept}
+    assert sum(size for _, _, size, _ in iter_cache_entries()) <= max_bytes
+    deleted = report['deleted'].get('size', {'entries': 0})
+    assert deleted['entries'] == 4 - len(kept)
+
+
+def test_gc_size_counts_what_the_age_rule_left(backend_name):
+    write('old', 'txt', size=500, age=3 * DAY)
+    write('older', 'txt', size=100, age=2 * DAY)
+    write('new', 'txt', size=100)
+
+    report = collect_garbage(older_than=2.5 * DAY, max_bytes=200)
+
+    assert stored() == {('older', 'txt'), ('new', 'txt')}
+    assert 'size' not in report['deleted']
+
+
+def test_gc_deletes_orphans(backend_name):
+    write_pipeline_entries(age=2 * DEFAULT_ORPHAN_GRACE)
+
+    report = collect_garbage(orphans=True)
+
+    assert stored() == {
+        (SUMMARIZED, 'json.gz'), (SUMMARIZED, 'txt'),
+        (summary_cache_key(SUMMARIZED), 'json'), (f'{summary_cache_key(SUMMARIZED)}_pl', 'json'),
+        (summary_cache_key('article_aa'), 'json'), ('article_page_1', 'json'),
+    }
+    assert {reason: counts['entries'] for reason, counts in report['deleted'].items()} == {
+        'orphan_summary': 2, 'orphan_translation': 1, 'orphan_info': 2, 'orphan_article_page': 1,
+    }
+
+
+def test_gc_keeps_the_info_of_videos_with_a_result(backend_name):
+    write(UNSUMMARIZED, 'json.gz', age=2 * DEFAULT_ORPHAN_GRACE)
+    write(f'result_{UNSUMMARIZED}_0123abcd', 'json', age=2 * DEFAULT_ORPHAN_GRACE)
+
+    assert collect_garbage(orphans=True)['deleted'] == {}
+
+
+def test_gc_leaves_recent_orphans_alone(backend_name):
+    write_pipeline_entries(age=DEFAULT_ORPHAN_GRACE / 2)
+    before = stored()
+
+    assert collect_garbage(orphans=True)['deleted'] == {}
+    assert stored() == before
+
+
+def test_gc_dry_run_deletes_nothing(backend_name):
+    write_pipeline_entries(age=2 * DEFAULT_ORPHAN_GRACE)
+    before = stored()
+
+    report = collect_garbage(older_than=0, dry_run=True)
+
+    assert report['dry_run']
+    assert report['deleted']['age']['entries'] == len(before)
+    assert stored() == before
+
+
+def test_export_and_import_round_trip(backend_name, monkeypatch, tmp_path):
+    write_pipeline_entries(age=DAY)
+    originals = {(key, ext): (read_cache_entry(key, ext), round(updated_at))
+                 for key, ext, _, updated_at in iter_cache_entries()}
+    archive = io.BytesIO()
+
+    exported = export_cache(archive)
+    # An empty cache in another directory
+    monkeypatch.chdir(tmp_path / 'cache')
+    monkeypatch.setattr(cache, '__backend', None)
+    monkeypatch.setattr(cache, '__memory', None)
+    imported = import_cache(io.BytesIO(archive.getvalue()))
+
+    assert exported == {'entries': len(originals), 'bytes': imported['bytes']}
+    assert imported['entries'] == len(originals) and imported['skipped'] == imported['invalid'] == 0
+    assert {(key, ext): (read_cache_entry(key, ext), round(updated_at))
+            for key, ext, _, updated_at in iter_cache_entries()} == originals
+
+
+def test_export_of_kinds(backend_name):
+    write_pipeline_entries(age=DAY)
+    archive = io.BytesIO()
+
+    export_cache(archive, kinds=['captions'])
+
+    with tarfile.open(fileobj=io.BytesIO(archive.getvalue())) as f:
+        assert sorted(f.getnames()) == [f'{SUMMARIZED}.txt', f'{UNSUMMARIZED}.txt']
+
+
+def test_import_keeps_existing_entries_unless_overwritten(backend_name):
+    write(SUMMARIZED, 'txt', data=b'exported')
+    archive = io.BytesIO()
+    export_cache(archive)
+    write(SUMMARIZED, 'txt', data=b'changed since')
+
+    skipped = import_cache(io.BytesIO(archive.getvalue()))
+    kept = read_cache_entry(SUMMARIZED, 'txt')
+    overwritten = import_cache(io.BytesIO(archive.getvalue()), overwrite=True)
+
+    assert (skipped['skipped'], kept) == (1, b'changed since')
+    assert (overwritten['entries'], read_cache_entry(SUMMARIZED, 'txt')) == (1, b'exported')
+
+
+def test_import_skips_members_that_are_not_cache_entries(backend_name):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w:gz') as f:
+        for name in ['notes.md', 'nested/dir.txt', f'{SUMMARIZED}.txt']:
+            member = tarfile.TarInfo(name)
+            member.size = 4
+            f.addfile(member, io.BytesIO(b'data'))
+
+    report = import_cache(io.BytesIO(archive.getvalue()))
+
+    assert (report['entries'], report['invalid']) == (1, 2)
+    assert stored() == {(SUMMARIZED, 'txt')}
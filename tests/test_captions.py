@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+from bench_captions import render_captions
+from conftest import ROOT_DIR
+from youtube_captions import dedupe_yt_cues, iter_ttml_cues, iter_vtt_cues, join_cues, parse_captions
+
+CAPTIONS_DIR = os.path.join(ROOT_DIR, 'benchmarks', 'fixtures', 'captions')
+GOLDEN_DIR = os.path.join(ROOT_DIR, 'tests', 'golden', 'captions')
+
+# Caption fixture and the text webvtt-py gave for it before the parser was replaced
+VTT_FIXTURES = [
+    ('rocket-lecture.vtt', 'rocket-lecture.txt'),
+    ('staging-explainer.vtt', 'staging-explainer.txt'),
+    (os.path.join('asr', 'rocket-lecture.vtt'), 'asr-rocket-lecture.txt'),
+]
+OTHER_FORMATS = ['srt', 'ttml', 'json3', 'srv3']
+TTML_PARAMETERS = 'xmlns:ttp="http://www.w3.org/ns/ttml#parameter"'
+
+
+def read_fixture(name):
+    with open(os.path.join(CAPTIONS_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def read_golden(name):
+    with open(os.path.join(GOLDEN_DIR, name), 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('fixture, golden', VTT_FIXTURES)
+def test_vtt_text_matches_the_golden_text(fixture, golden):
+    text = parse_captions('vtt', read_fixture(fixture))
+
+    assert text.encode('utf-8') == read_golden(golden)
+
+
+@pytest.mark.parametrize('ext', OTHER_FORMATS)
+@pytest.mark.parametrize('fixture, golden', VTT_FIXTURES)
+def test_other_formats_give_the_golden_text(fixture, golden, ext):
+    # The cues of the VTT fixture served in another format
+    content = render_captions(iter_vtt_cues(read_fixture(fixture)), ext)
+
+    assert parse_captions(ext, content).encode('utf-8') == read_golden(golden)
+
+
+@pytest.mark.parametrize('ext', ['json3', 'srv3'])
+def test_automatic_tracks_give_the_golden_words(ext):
+    # Their cues overlap, so only the paragraph breaks differ from the VTT track
+    text = parse_captions(ext, read_fixture(os.path.join('asr', f'rocket-lecture.{ext}')))
+
+    assert text.split() == read_golden('asr-rocket-lecture.txt').decode('utf-8').split()
+
+
+def ttml(begin, end, parameters=''):
+    return (f'<tt xmlns="http://www.w3.org/ns/ttml" {TTML_PARAMETERS} {parameters}>'
+            f'<body><div><p begin="{begin}" end="{end}">lift off</p></div></body></tt>')
+
+
+@pytest.mark.parametrize('begin, end, parameters, expected', [
+    ('00:00:01.500', '00:01:02', '', (1500, 62000)),
+    ('1.5s', '1500ms', '', (1500, 1500)),
+    ('0.5m', '0.01h', '', (30000, 36000)),
+    # Frames at the default 30 frames per second and at a declared frame rate
+    ('00:00:01:15', '45f', '', (1500, 1500)),
+    ('00:00:01:12', '00:00:01:12.1', 'ttp:frameRate="24" ttp:subFrameRate="2"', (1500, 1521)),
+    ('00:00:00:30', '30f', 'ttp:frameRate="30" ttp:frameRateMultiplier="1000 1001"', (1001, 1001)),
+    # Ticks at the declared tick rate, at the frame rate and at the default of one per second
+    ('15000000t', '20000000t', 'ttp:tickRate="10000000"', (1500, 2000)),
+    ('45t', '60t', 'ttp:frameRate="30"', (1500, 2000)),
+    ('2t', '3t', '', (2000, 3000)),
+])
+def test_ttml_time_expressions(begin, end, parameters, expected):
+    [(start_ms, end_ms, text)] = iter_ttml_cues(ttml(begin, end, parameters))
+
+    assert (start_ms, end_ms) == expected
+    assert text == 'lift off'
+
+
+@pytest.mark.parametrize('begin', ['00:01', '1:00:00:00:00', '12 s', 'soon', '00:00:01;15'])
+def test_ttml_rejects_malformed_times(begin):
+    with pytest.raises(ValueError, match='Invalid TTML time'):
+        list(iter_ttml_cues(ttml(begin, '5s')))
+
+
+@pytest.mark.parametrize('parameters', ['ttp:frameRate="0"', 'ttp:tickRate="fast"', 'ttp:frameRateMultiplier="1000"'])
+def test_ttml_rejects_malformed_rates(parameters):
+    with pytest.raises(ValueError, match='Invalid TTML frame or tick rate'):
+        list(iter_ttml_cues(ttml('1s', '5s', parameters)))
+
+
+def test_rolling_automatic_captions_are_deduplicated():
+    cues = [
+        [0, 2000, ' \nso the rocket'],
+        # The line that rolled up stays on screen for 10ms
+        [2000, 2010, 'so the rocket\n '],
+        [2010, 4000, 'so the rocket\nengine pushes'],
+        [4000, 4010, 'engine pushes\n '],
+        [4010, 6000, 'engine pushes\nexhaust gas'],
+    ]
+
+    deduped = list(dedupe_yt_cues(cues))
+
+    assert [text for _, _, text in deduped] == [' \nso the rocket', 'engine pushes', 'exhaust gas']
+    assert [(start, end) for start, end, _ in deduped] == [(0, 2009), (2010, 4009), (4010, 6000)]
+    assert join_cues(deduped) == 'so the rocket engine pushes exhaust gas'
+
+
+def test_single_words_are_joined_to_the_previous_cue():
+    deduped = list(dedupe_yt_cues([[0, 1000, 'the bell shape'], [1000, 1500, 'expands']]))
+
+    assert deduped == [[0, 1500, 'the bell shape expands']]
+
+
+@pytest.mark.parametrize('pause, separator', [(500, ' '), (1000, '\n'), (1999, '\n'), (2000, '\n\n')])
+def test_pauses_break_lines_and_paragraphs(pause, separator):
+    cues = [[0, 1000, 'drop the empty tanks\n'], [1000 + pause, 3000 + pause, 'on the way  up']]
+
+    assert join_cues(cues) == f'drop the empty tanks{separator}on the way up'
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker, CircuitOpen
+from stage_limits import STAGE_OPENAI, Overloaded
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def fail(breaker, error=UpstreamError('upstream failed')):
+    with pytest.raises(type(error)):
+        with breaker.guard():
+            raise error
+
+
+def open_circuit(reset_timeout=0.05):
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=reset_timeout)
+    fail(breaker)
+    fail(breaker)
+    assert breaker.status()['state'] == STATE_OPEN
+    return breaker
+
+
+def test_failures_open_the_circuit():
+    breaker = open_circuit(reset_timeout=60)
+
+    with pytest.raises(CircuitOpen):
+        with breaker.guard():
+            pytest.fail('an open circuit must not call the upstream')
+
+
+def test_successful_probe_closes_the_circuit():
+    breaker = open_circuit()
+    time.sleep(0.06)
+
+    with breaker.guard():
+        pass
+
+    assert breaker.status() == {'state': STATE_CLOSED, 'failures': 0}
+
+
+def test_overloaded_probe_leaves_the_circuit_half_open():
+    breaker = open_circuit()
+    time.sleep(0.06)
+
+    fail(breaker, Overloaded(STAGE_OPENAI, 5))
+
+    assert breaker.status()['state'] == STATE_HALF_OPEN
+    assert breaker.status()['failures'] == 2
+    # The next call is let through as the probe
+    with breaker.guard():
+        pass
+    assert breaker.status()['state'] == STATE_CLOSED
+
+
+def test_overloaded_call_does_not_reset_the_failures():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+    fail(breaker)
+
+    fail(breaker, Overloaded(STAGE_OPENAI, 5))
+    fail(breaker)
+
+    assert breaker.status()['state'] == STATE_OPEN
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import uuid
+
+import httpx
+import pytest
+import requests
+
+import http_session
+
+# Resolves nowhere, a request for it only succeeds through the proxy
+UNRESOLVABLE_HOST = 'upstream.invalid'
+
+
+@pytest.fixture
+def http_config(monkeypatch):
+    monkeypatch.setenv('HTTP_RETRIES', '3')
+    monkeypatch.setenv('HTTP_BACKOFF', '0')
+    # Sessions read the retry configuration when they are created
+    monkeypatch.setattr(http_session, '__sessions', threading.local())
+    monkeypatch.setattr(http_session, '__proxy_url', None)
+    return monkeypatch
+
+
+def flaky_url(base_url, fail, status=503):
+    key = uuid.uuid4().hex
+    return key, f'{base_url}/flaky/{key}?fail={fail}&status={status}'
+
+
+async def read_stream(url):
+    async with http_session.stream_async(url) as response:
+        return b''.join([chunk async for chunk in response.aiter_bytes()]).decode('utf-8')
+
+
+def test_get_retries_until_ok(http_config, stub_server):
+    key, url = flaky_url(stub_server.base_url, fail=2)
+
+    response = http_session.get(url)
+
+    assert response.text == 'ok after 2 failures'
+    assert stub_server.flaky_attempts[key] == 3
+
+
+def test_get_raises_when_retries_run_out(http_config, stub_server):
+    http_config.setenv('HTTP_RETRIES', '1')
+    key, url = flaky_url(stub_server.base_url, fail=5)
+
+    with pytest.raises(requests.HTTPError) as error:
+        http_session.get(url)
+
+    assert error.value.response.status_code == 503
+    assert http_session.is_upstream_failure(error.value)
+    assert stub_server.flaky_attempts[key] == 2
+
+
+def test_get_does_not_retry_client_errors(http_config, stub_server):
+    key, url = flaky_url(stub_server.base_url, fail=1, status=404)
+
+    with pytest.raises(requests.HTTPError) as error:
+        http_session.get(url)
+
+    assert not http_session.is_upstream_failure(error.value)
+    assert stub_server.flaky_attempts[key] == 1
+
+
+def test_get_async_retries_until_ok(http_config, stub_server):
+    key, url = flaky_url(stub_server.base_url, fail=2)
+
+    response = asyncio.run(http_session.get_async(url))
+
+    assert response.text == 'ok after 2 failures'
+    assert stub_server.flaky_attempts[key] == 3
+
+
+def test_get_async_raises_when_retries_run_out(http_config, stub_server):
+    http_config.setenv('HTTP_RETRIES', '1')
+    key, url = flaky_url(stub_server.base_url, fail=5, status=429)
+
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        asyncio.run(http_session.get_async(url))
+
+    assert error.value.response.status_code == 429
+    assert http_session.is_upstream_failure(error.value)
+    assert stub_server.flaky_attempts[key] == 2
+
+
+def test_stream_async_retries_until_ok(http_config, stub_server):
+    key, url = flaky_url(stub_server.base_url, fail=1)
+
+    assert asyncio.run(read_stream(url)) == 'ok after 1 failures'
+    assert stub_server.flaky_attempts[key] == 2
+
+
+def test_get_goes_through_the_proxy(http_config, stub_server):
+    key, url = flaky_url(f'http://{UNRESOLVABLE_HOST}', fail=1)
+    http_session.set_proxy_url(stub_server.base_url)
+
+    response = http_session.get(url)
+
+    assert response.text == 'ok after 1 failures'
+    assert stub_server.proxied_urls.count(url) == 2
+
+
+def test_get_async_goes_through_the_proxy(http_config, stub_server):
+    key, url = flaky_url(f'http://{UNRESOLVABLE_HOST}', fail=1)
+    http_session.set_proxy_url(stub_server.base_url)
+
+    response = asyncio.run(http_session.get_async(url))
+
+    assert response.text == 'ok after 1 failures'
+    assert stub_server.proxied_urls.count(url) == 2
+
+
+def test_proxy_change_replaces_the_session(http_config, stub_server):
+    http_session.set_proxy_url(stub_server.base_url)
+    proxied = http_session.get_session()
+
+    http_session.set_proxy_url(None)
+    direct = http_session.get_session()
+
+    assert direct is not proxied
+    key, url = flaky_url(stub_server.base_url, fail=0)
+    http_session.get(url)
+    assert url not in stub_server.proxied_urls
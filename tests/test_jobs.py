@@ -0,0 +1,159 @@
+import os
+import sqlite3
+import time
+
+import jobs
+from circuit_breaker import CircuitOpen
+from jobs import JOB_DONE, JOB_FAILED, JOB_RUNNING, JobQueue
+from stage_limits import STAGE_OPENAI, Overloaded
+
+
+def wait_for_job(queue, job_id, statuses=(JOB_DONE, JOB_FAILED), timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'Job {job_id} did not finish: {queue.get(job_id)}')
+
+
+def insert_running_job(path, owner, owner_token, updated_at):
+    # A schema made by a queue that never runs anything
+    JobQueue(path, {}, workers=0).start()
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            'INSERT INTO jobs (id, kind, url, status, owner, owner_token, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ('interrupted', 'youtube', 'https://youtu.be/x', JOB_RUNNING, owner, owner_token, updated_at, updated_at))
+    return 'interrupted'
+
+
+class RejectingHandler:
+    def __init__(self, rejections):
+        self.rejections = list(rejections)
+        self.calls = []
+
+    def __call__(self, url, on_stage):
+        self.calls.append(time.monotonic())
+        if self.rejections:
+            raise self.rejections.pop(0)
+        return {'url': url}
+
+
+def test_overloaded_job_is_retried_after_the_delay(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.01)
+    handler = RejectingHandler([Overloaded(STAGE_OPENAI, 0.2), CircuitOpen('openai', 0.2)])
+    queue = JobQueue(str(tmp_path / 'jobs.db'), {'youtube': handler}, workers=1)
+
+    job = wait_for_job(queue, queue.submit('youtube', 'https://youtu.be/x'))
+
+    assert job['status'] == JOB_DONE
+    assert job['result'] == {'url': 'https://youtu.be/x'}
+    assert job['error'] is None
+    assert len(handler.calls) == 3
+    assert all(later - earlier >= 0.2 for earlier, later in zip(handler.calls, handler.calls[1:]))
+
+
+def test_failing_job_is_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.01)
+    handler = RejectingHandler([ValueError('no captions')])
+    queue = JobQueue(str(tmp_path / 'jobs.db'), {'youtube': handler}, workers=1)
+
+    job = wait_for_job(queue, queue.submit('youtube', 'https://youtu.be/x'))
+
+    assert job['status'] == JOB_FAILED
+    assert job['error'] == 'no captions'
+    assert len(handler.calls) == 1
+
+
+def test_database_without_run_after_is_upgraded(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            'CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, url TEXT NOT NULL, status TEXT NOT NULL,'
+            ' stage TEXT, result TEXT, error TEXT, owner INTEGER, created_at REAL NOT NULL, updated_at REAL NOT NULL)')
+    queue = JobQueue(path, {'youtube': RejectingHandler([])}, workers=1)
+
+    assert wait_for_job(queue, queue.submit('youtube', 'https://youtu.be/x'))['status'] == JOB_DONE
+
+
+def test_job_of_a_previous_process_with_the_same_pid_is_requeued(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    job_id = insert_running_job(path, os.getpid(), 'previous process', time.time())
+    queue = JobQueue(path, {'youtube': RejectingHandler([])}, workers=1)
+
+    assert wait_for_job(queue, job_id)['status'] == JOB_DONE
+
+
+def test_job_with_an_expired_lease_is_requeued(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.01)
+    path = str(tmp_path / 'jobs.db')
+    # The owner pid is alive (it is our parent), but it stopped renewing the lease
+    job_id = insert_running_job(path, os.getppid(), 'hung process', time.time())
+    queue = JobQueue(path, {'youtube': RejectingHandler([])}, workers=1, lease_seconds=0.2)
+
+    assert queue.get(job_id)['status'] == JOB_RUNNING
+    assert wait_for_job(queue, job_id)['status'] == JOB_DONE
+
+
+def test_lease_of_a_long_job_is_renewed(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.01)
+    path = str(tmp_path / 'jobs.db')
+    calls = []
+
+    def slow_handler(url, on_stage):
+        calls.append(url)
+        time.sleep(0.6)
+        return {'url': url}
+
+    queue = JobQueue(path, {'youtube': slow_handler}, workers=1, lease_seconds=0.2)
+    # A second process sharing the database must not take the job over while it runs
+    JobQueue(path, {'youtube': slow_handler}, workers=1, lease_seconds=0.2).start()
+
+    job = wait_for_job(queue, queue.submit('youtube', 'https://youtu.be/x'))
+
+    assert job['status'] == JOB_DONE
+    assert len(calls) == 1
+
+
+def test_worker_survives_a_failing_claim(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.01)
+    claim = JobQueue._JobQueue__claim
+    failures = [sqlite3.OperationalError('database is locked')] * 2
+
+    def flaky_claim(queue):
+        if failures:
+            raise failures.pop()
+        return claim(queue)
+
+    monkeypatch.setattr(JobQueue, '_JobQueue__claim', flaky_claim)
+    handler = RejectingHandler([])
+    queue = JobQueue(str(tmp_path / 'jobs.db'), {'youtube': handler}, workers=1)
+
+    job = wait_for_job(queue, queue.submit('youtube', 'https://youtu.be/x'))
+
+    assert job['status'] == JOB_DONE
+    assert not failures
+    assert len(handler.calls) == 1
+
+
+def test_job_whose_outcome_was_not_recorded_is_run_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.01)
+    update = JobQueue._JobQueue__update
+    failures = [sqlite3.OperationalError('database is locked')]
+
+    def flaky_update(queue, job_id, **fields):
+        if fields.get('status') == JOB_DONE and failures:
+            raise failures.pop()
+        return update(queue, job_id, **fields)
+
+    monkeypatch.setattr(JobQueue, '_JobQueue__update', flaky_update)
+    handler = RejectingHandler([])
+    queue = JobQueue(str(tmp_path / 'jobs.db'), {'youtube': handler}, workers=1, lease_seconds=0.2)
+
+    job = wait_for_job(queue, queue.submit('youtube', 'https://youtu.be/x'))
+
+    assert job['status'] == JOB_DONE
+    # The lease of the unrecorded run ran out and the same worker picked the job up again
+    assert len(handler.calls) == 2
@@ -0,0 +1,85 @@
+import pytest
+
+import cache
+import openai_clients
+import prompts
+from openai_batch import OpenAIBatchBackend
+from stub_server import BATCH_FAIL_MARKER
+from youtube_summarizer import YoutubeSummarizer
+
+LANGUAGES = ['pl', 'de']
+
+
+@pytest.fixture
+def openai_stub(stub_server, cache_dir, monkeypatch):
+    monkeypatch.setenv('OPENAI_BASE_URL', f'{stub_server.base_url}/v1')
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setenv('SUMMARY_LANGUAGES', ','.join(LANGUAGES))
+    # The process-wide client is created again for the stub
+    monkeypatch.setattr(openai_clients, '__client', None)
+    return stub_server
+
+
+def instruction(text):
+    return [{'role': 'user', 'content': text}]
+
+
+def test_complete_submits_polls_and_collects(openai_stub):
+    batches_before = set(openai_stub.batches)
+
+    answers = OpenAIBatchBackend(poll_interval=0).complete({
+        'first': instruction('Summarize the first text'),
+        'second': instruction('Summarize the second text'),
+        'broken': instruction(f'Summarize the third text {BATCH_FAIL_MARKER}'),
+    })
+
+    assert set(answers) == {'first', 'second'}
+    assert all(answer.endswith('.') for answer in answers.values())
+    assert answers['first'] != answers['second']
+
+    [batch_id] = set(openai_stub.batches) - batches_before
+    batch = openai_stub.batches[batch_id]
+    # Polled while in progress and once more when completed
+    assert batch['polls'] == 2
+    assert batch['request_counts'] == {'total': 3, 'completed': 2, 'failed': 1}
+
+
+def test_complete_without_instructions_submits_nothing(openai_stub):
+    batches_before = len(openai_stub.batches)
+
+    assert OpenAIBatchBackend(poll_interval=0).complete({}) == {}
+    assert len(openai_stub.batches) == batches_before
+
+
+def test_summarize_batch_caches_summaries_and_translations(openai_stub):
+    videos = [
+        ('video-one', 'engines turn fuel into thrust', 'Engines', 'First video'),
+        ('video-two', 'stages are dropped on the way to orbit', 'Stages', 'Second video'),
+        ('video-bad', f'the rocket equation {BATCH_FAIL_MARKER}', 'Equation', 'Failing video'),
+    ]
+
+    results = YoutubeSummarizer().summarize_batch(videos, OpenAIBatchBackend(poll_interval=0))
+
+    assert results['video-bad'] is None
+    assert cache.reuse_cache_json(prompts.summary_cache_key('video-bad')) is None
+    for video_id, _, title, _ in videos[:2]:
+        cache_key = prompts.summary_cache_key(video_id)
+        summary = cache.reuse_cache_json(cache_key)
+        assert summary['title'] == title
+        assert results[video_id]['paragraph'] == summary['paragraph']
+        for lang in LANGUAGES:
+            translation = cache.reuse_cache_json(f'{cache_key}_{lang}')
+            assert translation['paragraph']
+            assert results[video_id][f'paragraph_{lang}'] == translation['paragraph']
+
+
+def test_summarize_batch_skips_cached_summaries(openai_stub):
+    videos = [('video-one', 'engines turn fuel into thrust', 'Engines', 'First video')]
+    summarizer = YoutubeSummarizer()
+    first = summarizer.summarize_batch(videos, OpenAIBatchBackend(poll_interval=0))
+    batches_before = len(openai_stub.batches)
+
+    second = summarizer.summarize_batch(videos, OpenAIBatchBackend(poll_interval=0))
+
+    assert second == first
+    assert len(openai_stub.batches) == batches_before
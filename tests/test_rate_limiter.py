@@ -0,0 +1,30 @@
+import pytest
+
+from rate_limiter import (BUDGET_HIT, BUDGET_MISS, CLOSED_RETRY_AFTER, MemoryBucketStore, RateLimiter,
+                          SqliteBucketStore)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBucketStore()
+    return SqliteBucketStore(str(tmp_path / 'ratelimit.db'))
+
+
+def test_budget_allows_a_burst_then_limits(store):
+    limiter = RateLimiter(store, {BUDGET_MISS: 2, BUDGET_HIT: 60})
+
+    assert limiter.take('client', BUDGET_MISS) == 0
+    assert limiter.take('client', BUDGET_MISS) == 0
+    assert 0 < limiter.take('client', BUDGET_MISS) <= 30
+    assert limiter.take('other client', BUDGET_MISS) == 0
+    assert limiter.take('client', BUDGET_HIT) == 0
+
+
+@pytest.mark.parametrize('per_minute', [0, -1])
+def test_closed_budget_always_limits(store, per_minute):
+    limiter = RateLimiter(store, {BUDGET_MISS: per_minute, BUDGET_HIT: 60})
+
+    assert limiter.take('client', BUDGET_MISS) == CLOSED_RETRY_AFTER
+    assert limiter.take('client', BUDGET_MISS) == CLOSED_RETRY_AFTER
+    assert limiter.take('client', BUDGET_HIT) == 0
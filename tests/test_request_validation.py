@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+import rate_limiter
+from conftest import load_app
+from rate_limiter import BUDGET_BATCH, BUDGET_HIT, BUDGET_MISS, MemoryBucketStore, RateLimiter
+
+ENDPOINTS = ['/api/summarize/youtube', '/api/summarize/article', '/api/summarize/youtube/stream']
+MALFORMED_BODIES = [{'url': 123}, {'url': ['https://youtu.be/x']}, {'url': None}, {'link': 'x'}, ['url']]
+
+
+def limiter(miss_per_minute):
+    return RateLimiter(MemoryBucketStore(), {BUDGET_MISS: miss_per_minute, BUDGET_HIT: 1000, BUDGET_BATCH: 1000})
+
+
+def app_client(file_name):
+    app = load_app(file_name)
+    if file_name == 'tldw-web.py':
+        return app.test_client()
+
+    from starlette.testclient import TestClient
+    return TestClient(app)
+
+
+@pytest.fixture(params=['tldw-web.py', 'tldw-asgi.py'])
+def client(request, cache_dir, monkeypatch):
+    monkeypatch.setattr(rate_limiter, '__limiter', limiter(1000))
+    return app_client(request.param)
+
+
+@pytest.mark.parametrize('body', MALFORMED_BODIES)
+@pytest.mark.parametrize('endpoint', ENDPOINTS)
+def test_malformed_url_is_a_bad_request(client, endpoint, body):
+    response = client.post(endpoint, json=body)
+
+    assert response.status_code == 400
+    assert json.loads(response.text) == {'error': 'Missing URL in request body'}
+
+
+@pytest.mark.parametrize('body', MALFORMED_BODIES)
+def test_malformed_job_url_is_a_bad_request(cache_dir, monkeypatch, body):
+    monkeypatch.setattr(rate_limiter, '__limiter', limiter(1000))
+
+    response = app_client('tldw-web.py').post('/api/jobs', json=body)
+
+    assert response.status_code == 400
+    assert json.loads(response.text) == {'error': 'Missing URL in request body'}
+
+
+def test_malformed_url_counts_against_the_miss_budget(cache_dir, monkeypatch):
+    monkeypatch.setattr(rate_limiter, '__limiter', limiter(1))
+    client = app_client('tldw-web.py')
+
+    assert client.post('/api/summarize/youtube', json={'url': 123}).status_code == 400
+    assert client.post('/api/summarize/youtube', json={'url': 123}).status_code == 429
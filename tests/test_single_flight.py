@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tldw
+from single_flight import SingleFlight
+
+CALLERS = 8
+VIDEO_ID = 'dQw4w9WgXcQ'
+VIDEO_URL = f'https://www.youtube.com/watch?v={VIDEO_ID}'
+
+
+def wait_for_followers(caplog, count, timeout=5):
+    # Callers that found a call in flight log it before waiting for its result
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if sum('Waiting for in-flight request' in record.getMessage() for record in caplog.records) >= count:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f'{count} callers did not join the call in flight')
+
+
+def release_when_joined(caplog, release, count=CALLERS - 1):
+    def release_later():
+        wait_for_followers(caplog, count)
+        release.set()
+
+    threading.Thread(target=release_later, daemon=True).start()
+
+
+def run_concurrently(fn, callers=CALLERS):
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        futures = [executor.submit(fn) for _ in range(callers)]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result(timeout=10))
+            except Exception as e:
+                outcomes.append(e)
+        return outcomes
+
+
+class StubInfoExtractor:
+    def __init__(self, release):
+        self.release = release
+        self.calls = 0
+
+    def extract_video_info(self, url):
+        self.calls += 1
+        # Held until every other caller waits for this run
+        assert self.release.wait(5)
+        return {
+            'id': VIDEO_ID,
+            'duration': 212,
+            'fulltitle': 'Stub video',
+            'title': 'Stub video',
+            'description': 'A video served by the test stubs',
+            'webpage_url': VIDEO_URL,
+            'subtitles': {'en': [{'ext': 'vtt', 'url': 'http://captions.invalid', 'name': 'English'}]},
+            'automatic_captions': {},
+        }
+
+
+class StubCaptionsExtractor:
+    def __init__(self):
+        self.calls = 0
+
+    def prepare_captions(self, video_id, subtitles, automatic_captions):
+        self.calls += 1
+        return 'never gonna give you up never gonna let you down'
+
+
+class StubSummarizer:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def summarize(self, video_id, subtitles, video_title, video_description, on_stage=None):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return {'title': video_title, 'paragraph': 'A summary.', 'paragraph_pl': 'Streszczenie.'}
+
+
+@pytest.fixture
+def followers_logged(caplog):
+    caplog.set_level(logging.INFO, logger='single_flight')
+    return caplog
+
+
+@pytest.fixture
+def pipeline(cache_dir, monkeypatch, followers_logged):
+    monkeypatch.setenv('SUMMARY_LANGUAGES', 'pl')
+    monkeypatch.setenv('NEGATIVE_CACHE', '0')
+
+    release = threading.Event()
+    stubs = {
+        'info': StubInfoExtractor(release),
+        'captions': StubCaptionsExtractor(),
+        'summarizer': StubSummarizer(),
+    }
+    monkeypatch.setattr(tldw, '__get_youtube_video_info_extractor', lambda: stubs['info'])
+    monkeypatch.setattr(tldw, '__get_youtube_video_captions_extractor', lambda: stubs['captions'])
+    monkeypatch.setattr(tldw, '__get_youtube_summarizer', lambda: stubs['summarizer'])
+    return release, stubs
+
+
+def test_concurrent_callers_share_one_call(followers_logged):
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        assert release.wait(5)
+        return object()
+
+    release_when_joined(followers_logged, release)
+    results = run_concurrently(lambda: single_flight.do('key', fn))
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert single_flight.calls == {}
+
+
+def test_concurrent_callers_get_the_same_exception(followers_logged):
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    error = ValueError('upstream failed')
+
+    def fn():
+        calls.append(1)
+        assert release.wait(5)
+        raise error
+
+    release_when_joined(followers_logged, release)
+    errors = run_concurrently(lambda: single_flight.do('key', fn))
+
+    assert len(calls) == 1
+    assert all(e is error for e in errors)
+    assert single_flight.calls == {}
+
+
+def test_summarize_video_runs_the_pipeline_once(pipeline, caplog):
+    release, stubs = pipeline
+
+    release_when_joined(caplog, release)
+    results = run_concurrently(lambda: tldw.summarize_video(VIDEO_URL))
+
+    assert stubs['info'].calls == 1
+    assert stubs['captions'].calls == 1
+    assert stubs['summarizer'].calls == 1
+    assert all(result is results[0] for result in results)
+    assert results[0]['video_id'] == VIDEO_ID
+    assert results[0]['summary']['paragraph'] == 'A summary.'
+
+
+def test_summarize_video_shares_the_failure(pipeline, caplog):
+    release, stubs = pipeline
+    error = Exception('Failed to summarize video: stub')
+    stubs['summarizer'] = StubSummarizer(error)
+
+    release_when_joined(caplog, release)
+    outcomes = run_concurrently(lambda: tldw.summarize_video(VIDEO_URL))
+
+    assert stubs['info'].calls == 1
+    assert stubs['summarizer'].calls == 1
+    assert all(outcome is error for outcome in outcomes)
+
+
+def test_cached_result_skips_the_pipeline(pipeline):
+    release, stubs = pipeline
+    release.set()
+
+    first = tldw.summarize_video(VIDEO_URL)
+    second = tldw.summarize_video(VIDEO_URL)
+
+    assert stubs['info'].calls == 1
+    assert second == first
@@ -0,0 +1,37 @@
+from token_utils import estimate_tokens
+from transcript_compaction import compact_transcript
+
+
+def paragraph(topic, words):
+    return ' '.join(f'{topic}{i % 50}' for i in range(words))
+
+
+def test_drops_the_least_informative_paragraphs():
+    novel = paragraph('orbit', 200)
+    repeated = paragraph('rocket', 200)
+    text = '\n\n'.join([repeated, novel, repeated])
+
+    result, stats = compact_transcript(text, token_budget=estimate_tokens(novel) + 10)
+
+    assert result == novel
+    assert stats['dropped_paragraphs'] == 2
+
+
+def test_keeps_the_best_paragraph_when_each_is_over_the_budget():
+    # Two paragraphs of ~33k tokens each with a budget of 20k
+    text = paragraph('alpha', 20000) + '\n\n' + paragraph('beta', 20000)
+
+    result, stats = compact_transcript(text, token_budget=20000)
+
+    assert result
+    assert stats['dropped_paragraphs'] == 1
+    assert stats['tokens_after'] <= 20000
+    assert not result.endswith(' ')
+    assert result.split(' ')[-1] in text.split(' ')
+
+
+def test_sound_cues_only_compact_to_nothing():
+    result, stats = compact_transcript('[Music]\n\n♪♪ [Applause]\n\num uh', token_budget=100)
+
+    assert result == ''
+    assert stats['tokens_after'] == 0
@@ -0,0 +1,67 @@
+import gzip
+import json
+import os
+
+import pytest
+
+import cache
+import youtube_info
+from conftest import ROOT_DIR
+from youtube_info import INFO_FIELDS, YoutubeVideoInfoExtractor
+
+VIDEO_ID = 'rocketLect1'
+VIDEO_URL = f'https://www.youtube.com/watch?v={VIDEO_ID}'
+
+
+class UnusedPool:
+    def acquire(self, ydl_opts):
+        raise AssertionError('yt-dlp must not be called for a cached video')
+
+
+@pytest.fixture
+def legacy_info(cache_dir, monkeypatch):
+    """
+    The full yt-dlp info dict of a video, cached as `{id}.json` the way it was before the compact record.
+    """
+    monkeypatch.setattr(youtube_info, 'ydl_pool', UnusedPool())
+    with open(os.path.join(ROOT_DIR, 'benchmarks', 'fixtures', 'videos', 'rocket-lecture.json'), encoding='utf-8') as f:
+        info = json.loads(f.read().replace('{video_id}', VIDEO_ID))
+
+    os.makedirs(cache_dir)
+    with open(cache_dir / f'{VIDEO_ID}.json', 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=4)
+    return info
+
+
+def test_legacy_info_is_migrated_to_the_compact_record(cache_dir, legacy_info):
+    result = YoutubeVideoInfoExtractor().extract_video_info(VIDEO_URL)
+
+    assert not os.path.exists(cache_dir / f'{VIDEO_ID}.json')
+    with open(cache_dir / f'{VIDEO_ID}.json.gz', 'rb') as f:
+        data = gzip.decompress(f.read())
+    # Compact JSON without indentation, holding the record that was returned
+    assert b'\n' not in data and b': ' not in data
+    assert json.loads(data) == result
+
+
+def test_compact_record_keeps_only_what_the_pipeline_reads(legacy_info):
+    result = YoutubeVideoInfoExtractor().extract_video_info(VIDEO_URL)
+
+    assert set(result) == {*INFO_FIELDS, 'thumbnails', 'subtitles', 'automatic_captions'}
+    assert {field: result[field] for field in INFO_FIELDS} == {field: legacy_info[field] for field in INFO_FIELDS}
+    best_thumbnail = max(legacy_info['thumbnails'], key=lambda x: x.get('preference', 0))
+    assert result['thumbnails'] == [{'url': best_thumbnail['url'], 'preference': best_thumbnail['preference']}]
+    assert set(result['automatic_captions']) == {'en', 'en-orig'}
+    tracks = [track for tracks in result['automatic_captions'].values() for track in tracks]
+    assert tracks and all(track['protocol'] != 'm3u8_native' for track in tracks)
+    assert all(set(track) <= {'ext', 'url', 'name', 'protocol'} for track in tracks)
+
+
+def test_migrated_record_is_read_after_a_restart(cache_dir, legacy_info, monkeypatch):
+    first = YoutubeVideoInfoExtractor().extract_video_info(VIDEO_URL)
+    # A new process, the in-memory tier is empty
+    monkeypatch.setattr(cache, '__backend', None)
+    monkeypatch.setattr(cache, '__memory', None)
+
+    assert YoutubeVideoInfoExtractor().extract_video_info(VIDEO_URL) == first
+    assert sorted(os.listdir(cache_dir)) == [f'{VIDEO_ID}.json.gz']
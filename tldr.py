@@ -1,21 +1,145 @@
+import functools
+import hashlib
+from time import perf_counter
+
+import metrics
 from article_content import ArticleContentExtractor
-from article_summarizer import ArticleContentSummarizer
+from article_summarizer import ArticleContentSummarizer, article_content_hash
+from cache import create_cache_json, reuse_cache_json
+from single_flight import SingleFlight, AsyncSingleFlight
+from url_utils import canonical_url
+
+in_flight_articles = SingleFlight()
+in_flight_articles_async = AsyncSingleFlight()
+
+
+def summarize_article(url, on_stage=None):
+    """
+    on_stage, if given, is called with the name of each pipeline stage as it starts
+    (info, summary, translation).
+    """
+    start = perf_counter()
+    # Concurrent requests for the same article share a single pipeline run
+    result, cached = in_flight_articles.do(canonical_url(url), __summarize_article, url, on_stage)
+    metrics.observe('tldw_request_seconds', perf_counter() - start, kind='article', cache='hit' if cached else 'miss')
+    return result
+
+
+def __summarize_article(url, on_stage):
+    if on_stage:
+        on_stage('info')
+    page = __summarized_page(url)
+    with metrics.timed('tldw_stage_seconds', stage='article_download'):
+        article_content_extractor = ArticleContentExtractor(url, validators=page)
+    title, content, content_hash = __read_article(url, article_content_extractor, page)
+
+    article_content_summarizer = __get_article_content_summarizer()
+    cached = article_content_summarizer.is_cached(content_hash)
+    article_info = article_content_summarizer.summarize(content_hash, title, content, on_stage)
+
+    return __prepare_result(article_info), cached
+
+
+def is_article_cached(url):
+    """
+    Whether summarize_article would be answered without calling OpenAI (the page itself is still
+    requested, conditionally). Only known for URLs summarized before, up to tracking parameters.
+    """
+    return __summarized_page(url) is not None
+
+
+async def summarize_article_async(url):
+    start = perf_counter()
+    result, cached = await in_flight_articles_async.do(canonical_url(url), __summarize_article_async, url)
+    metrics.observe('tldw_request_seconds', perf_counter() - start, kind='article', cache='hit' if cached else 'miss')
+    return result
+
+
+async def __summarize_article_async(url):
+    page = __summarized_page(url)
+    with metrics.timed('tldw_stage_seconds', stage='article_download'):
+        article_content_extractor = await ArticleContentExtractor.create_async(url, validators=page)
+    title, content, content_hash = __read_article(url, article_content_extractor, page)
+
+    article_content_summarizer = __get_article_content_summarizer()
+    cached = article_content_summarizer.is_cached(content_hash)
+    article_info = await article_content_summarizer.summarize_async(content_hash, title, content)
 
+    return __prepare_result(article_info), cached
 
-def summarize_article(url):
-    article_content_extractor = ArticleContentExtractor(url)
-    article_metadata = article_content_extractor.run()
+
+def stream_article_summary(url):
+    """
+    Run the pipeline yielding (event, data) tuples: ('metadata', ...), ('paragraph', delta),
+    ('translation', delta) and finally ('done', result) with the same result summarize_article returns.
+    """
+    page = __summarized_page(url)
+    with metrics.timed('tldw_stage_seconds', stage='article_download'):
+        article_content_extractor = ArticleContentExtractor(url, validators=page)
+    title, content, content_hash = __read_article(url, article_content_extractor, page)
+
+    yield 'metadata', {'title': title}
+
+    article_content_summarizer = __get_article_content_summarizer()
+    for event, data in article_content_summarizer.summarize_stream(content_hash, title, content):
+        if event == 'summary':
+            yield 'done', __prepare_result(data)
+        else:
+            yield event, data
+
+
+@functools.cache
+def __get_article_content_summarizer():
+    # Holds no per-request state, one instance serves the whole process
+    return ArticleContentSummarizer()
+
+
+def __summarized_page(url):
+    """
+    The cached page record of a URL whose summary is cached, its validators make the download conditional.
+    """
+    page = reuse_cache_json(__page_cache_key(url))
+    if page and __get_article_content_summarizer().is_cached(page['content_hash']):
+        return page
+    return None
+
+
+def __read_article(url, article_content_extractor, page):
+    """
+    Returns the title, the content (None when the page was not modified) and the content hash of the article.
+    """
+    if article_content_extractor.not_modified:
+        return page['title'], None, page['content_hash']
+
+    with metrics.timed('tldw_stage_seconds', stage='article_extract'):
+        article_metadata = article_content_extractor.run()
     title = article_metadata['title']
     content = article_metadata['content']
+    content_hash = article_content_hash(title, content)
+
+    # The canonical URL points at the content hash, the summary itself is cached under the hash
+    create_cache_json(__page_cache_key(url), {
+        'url': canonical_url(url),
+        'title': title,
+        'content_hash': content_hash,
+        'etag': article_content_extractor.etag,
+        'last_modified': article_content_extractor.last_modified,
+    })
+    return title, content, content_hash
 
-    article_content_summarizer = ArticleContentSummarizer()
-    article_info = article_content_summarizer.summarize(url, title, content)
-    title = article_info['title']
-    paragraph = article_info['paragraph']
-    paragraph_pl = article_info['paragraph_pl']
 
-    return {
-        "title": title,
-        "summary": paragraph,
-        "summary_pl": paragraph_pl
+def __page_cache_key(url):
+    # URLs cannot be used as file names directly
+    return f'article_page_{hashlib.sha256(canonical_url(url).encode("utf-8")).hexdigest()}'
+
+
+def __prepare_result(article_info):
+    result = {
+        "title": article_info['title'],
+        "summary": article_info['paragraph'],
     }
+    for field, value in article_info.items():
+        if field.startswith('paragraph_'):
+            result[f"summary_{field[len('paragraph_'):]}"] = value
+
+    return result
@@ -0,0 +1,248 @@
+import json
+import logging
+import math
+import os
+from collections.abc import Mapping
+
+import dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import http_session
+import metrics
+from batch import is_batch_api_authorized, is_batch_api_enabled, is_valid_concurrency, summarize_videos
+from circuit_breaker import STATE_CLOSED, circuit_states
+from rate_limiter import BUDGET_BATCH, BUDGET_HIT, BUDGET_MISS, get_rate_limiter
+from stage_limits import Overloaded
+from tldr import summarize_article_async, stream_article_summary, is_article_cached
+from tldw import summarize_video_async, stream_video_summary, is_video_cached
+
+# Load environment variables
+dotenv.load_dotenv()
+
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+
+async def health_check(request):
+    # Stays 200 while an upstream is down, restarting the server would not bring it back
+    circuits = circuit_states()
+    status = "degraded" if any(circuit['state'] != STATE_CLOSED for circuit in circuits.values()) else "healthy"
+    return JSONResponse({"status": status, "circuits": circuits}, status_code=200)
+
+
+async def handle_metrics(request):
+    return PlainTextResponse(metrics.render_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+async def handle_summarize_article(request):
+    return await __handle_summarize(request, summarize_article_async, is_article_cached)
+
+
+async def handle_summarize_youtube(request):
+    return await __handle_summarize(request, summarize_video_async, is_video_cached)
+
+
+async def __handle_summarize(request, summarize, is_cached):
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+
+        url = __request_url(data)
+        if url is None:
+            return JSONResponse({
+                "error": "Missing URL in request body"
+            }, status_code=400)
+
+        rate_limited = __check_rate_limit(request, url, is_cached)
+        if rate_limited:
+            return rate_limited
+
+        return JSONResponse(await summarize(url), status_code=200)
+    except Overloaded as e:
+        # A stage of the pipeline has no free slot, the client should come back instead of queueing here
+        return JSONResponse({
+            "error": str(e)
+        }, status_code=503, headers={'Retry-After': str(e.retry_after)})
+    except Exception as e:
+        logger.exception(f"Error processing request: {str(e)}")
+        return JSONResponse({
+            "error": f"An error occurred: {str(e)}"
+        }, status_code=500)
+
+
+async def handle_summarize_article_stream(request):
+    return await __stream_summary(request, stream_article_summary, is_article_cached)
+
+
+async def handle_summarize_youtube_stream(request):
+    return await __stream_summary(request, stream_video_summary, is_video_cached)
+
+
+async def __stream_summary(request, stream_summary, is_cached):
+    """
+    Server-Sent Events response, the URL comes from the query string (EventSource) or the JSON body.
+    The synchronous stream generator is iterated in the thread pool by StreamingResponse.
+    """
+    if request.method == 'POST':
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+    else:
+        data = request.query_params
+
+    url = __request_url(data)
+    if url is None:
+        return JSONResponse({
+            "error": "Missing URL in request body"
+        }, status_code=400)
+
+    rate_limited = __check_rate_limit(request, url, is_cached)
+    if rate_limited:
+        return rate_limited
+
+    def generate():
+        try:
+            for event, event_data in stream_summary(url):
+                yield __sse_event(event, event_data)
+        except Overloaded as e:
+            # The response has already started, the client gets the retry delay in the event instead
+            yield __sse_event('error', {"error": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            logger.exception(f"Error processing stream: {str(e)}")
+            yield __sse_event('error', {"error": f"An error occurred: {str(e)}"})
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # let reverse proxies pass events through immediately
+    })
+
+
+async def handle_summarize_youtube_batch(request):
+    """
+    NDJSON stream of per-video results and a final report, see batch.summarize_videos.
+
+    Answers 404 unless BATCH_API_TOKEN is set and sent as the bearer token. The request counts against
+    the client's hit budget, every video without a cached summary against its batch budget.
+    """
+    if not is_batch_api_enabled():
+        return JSONResponse({
+            "error": "Not found"
+        }, status_code=404)
+    if not is_batch_api_authorized(request.headers.get('Authorization')):
+        return JSONResponse({
+            "error": "Missing or invalid token"
+        }, status_code=401, headers={'WWW-Authenticate': 'Bearer'})
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+
+    urls = __batch_urls(data)
+    if not urls:
+        return JSONResponse({
+            "error": "Missing URLs in request body"
+        }, status_code=400)
+
+    concurrency = data.get('concurrency')
+    if not is_valid_concurrency(concurrency):
+        return JSONResponse({
+            "error": "concurrency must be a positive integer"
+        }, status_code=400)
+
+    rate_limited = __check_rate_limit(request, None, lambda url: True)
+    if rate_limited:
+        return rate_limited
+
+    client = request.client.host if request.client else None
+
+    def generate():
+        try:
+            for item in summarize_videos(urls, concurrency, skip_cached=data.get('skip_cached', True),
+                                         rate_limit=lambda video_id: get_rate_limiter().take(client, BUDGET_BATCH)):
+                yield json.dumps(item) + '\n'
+        except Exception as e:
+            logger.exception(f"Error processing batch: {str(e)}")
+            yield json.dumps({"error": f"An error occurred: {str(e)}"}) + '\n'
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+def __batch_urls(data):
+    if not isinstance(data, dict):
+        return []
+    urls = data.get('urls') or []
+    if isinstance(urls, str):
+        urls = [urls]
+    if data.get('url'):
+        urls = [data['url'], *urls]
+    return [url for url in urls if isinstance(url, str) and url.strip()]
+
+
+def __request_url(data):
+    # The URL of a JSON body or query string, None unless it is a string
+    url = data.get('url') if isinstance(data, Mapping) else None
+    return url if isinstance(url, str) else None
+
+
+def __check_rate_limit(request, url, is_cached):
+    """
+    Returns a 429 response when the client is out of its budget, requests served from the cache
+    are counted against a separate, larger budget.
+    """
+    budget = BUDGET_HIT if is_cached(url) else BUDGET_MISS
+    retry_after = get_rate_limiter().take(request.client.host if request.client else None, budget)
+    if not retry_after:
+        return None
+
+    return JSONResponse({
+        "error": "Rate limit exceeded. Please try again later."
+    }, status_code=429, headers={'Retry-After': str(math.ceil(retry_after))})
+
+
+def __sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+app = Starlette(
+    routes=[
+        Route('/api/health', health_check, methods=['GET']),
+        Route('/api/metrics', handle_metrics, methods=['GET']),
+        Route('/api/summarize/article', handle_summarize_article, methods=['POST']),
+        Route('/api/summarize/youtube', handle_summarize_youtube, methods=['POST']),
+        Route('/api/summarize/article/stream', handle_summarize_article_stream, methods=['GET', 'POST']),
+        Route('/api/summarize/youtube/stream', handle_summarize_youtube_stream, methods=['GET', 'POST']),
+        Route('/api/summarize/youtube/batch', handle_summarize_youtube_batch, methods=['POST']),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware,
+                   allow_origins=[
+                       "https://tldw.tube",
+                       "http://localhost:5173",  # for local development
+                   ],
+                   allow_methods=["GET", "POST", "OPTIONS"]),
+    ],
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Server configuration')
+    parser.add_argument('--port', type=int, default=5000, help='Port number (default: 5000)')
+    parser.add_argument('--proxy', default=os.getenv('PROXY_URL'),
+                        help='Proxy URL (default: PROXY_URL environment variable or None)')
+    args = parser.parse_args()
+    http_session.set_proxy_url(args.proxy)
+    logger.info(f'Serving on port {args.port}')
+    uvicorn.run(app, host="0.0.0.0", port=args.port)
@@ -0,0 +1,100 @@
+import argparse
+import contextlib
+import itertools
+import json
+import logging
+import os
+import sys
+
+import dotenv
+
+import http_session
+from cache_maintenance import DEFAULT_ORPHAN_GRACE, cache_stats, export_cache, import_cache, warm_cache, collect_garbage
+
+# Load environment variables
+dotenv.load_dotenv()
+
+# Logs go to stderr, stdout carries the reports (and the archive of `export -`)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(value):
+    unit = SIZE_UNITS.get(value[-1:].upper())
+    return int(float(value[:-1]) * unit) if unit else int(value)
+
+
+parser = argparse.ArgumentParser(description='Maintain the cache of the configured backend (CACHE_BACKEND)')
+commands = parser.add_subparsers(dest='command', required=True)
+
+stats_parser = commands.add_parser('stats', help='Count and size of the entries by kind')
+stats_parser.add_argument('--metrics-url', help='Metrics of a running server (e.g. http://localhost:5555/api/metrics) '
+                                                'to report its cache hit ratio by kind')
+
+export_parser = commands.add_parser('export', help='Write entries to a compressed archive (.tar.gz)')
+export_parser.add_argument('archive', help='Archive file, - for stdout')
+export_parser.add_argument('--kind', action='append', help='Only entries of this kind, repeatable (e.g. result, info)')
+
+import_parser = commands.add_parser('import', help='Read entries from an archive written by export')
+import_parser.add_argument('archive', help='Archive file, - for stdin')
+import_parser.add_argument('--overwrite', action='store_true', help='Replace entries that exist already')
+
+warm_parser = commands.add_parser('warm', help='Summarize videos given by id or URL, one per line')
+warm_parser.add_argument('ids', nargs='*', help='Video ids or URLs')
+warm_parser.add_argument('--file', help='Read ids from a file, one per line (- for stdin)')
+warm_parser.add_argument('--concurrency', type=int, default=None,
+                         help='Videos summarized at once (default: BATCH_CONCURRENCY or 4)')
+warm_parser.add_argument('--no-skip-cached', action='store_true', help='Run videos with a cached summary too')
+
+gc_parser = commands.add_parser('gc', help='Delete entries by age, total size or orphan status')
+gc_parser.add_argument('--older-than', type=float, help='Delete entries not updated for this many days')
+gc_parser.add_argument('--kind', action='append', help='Kinds --older-than applies to, repeatable (default: all)')
+gc_parser.add_argument('--max-size', type=parse_size,
+                       help='Delete the least recently updated entries until the cache fits, e.g. 20G')
+gc_parser.add_argument('--orphans', action='store_true',
+                       help='Delete video info and captions without a summary, summaries without the video info, '
+                            'translations without their summary and article pages without a summary')
+gc_parser.add_argument('--orphan-grace', type=float, default=DEFAULT_ORPHAN_GRACE,
+                       help=f'Seconds an orphan has to be old (default: {DEFAULT_ORPHAN_GRACE})')
+gc_parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+
+args = parser.parse_args()
+
+if args.command == 'stats':
+    metrics_text = http_session.get(args.metrics_url).text if args.metrics_url else None
+    print(json.dumps(cache_stats(metrics_text), indent=2))
+
+elif args.command == 'export':
+    with (contextlib.nullcontext(sys.stdout.buffer) if args.archive == '-' else open(args.archive, 'wb')) as f:
+        report = export_cache(f, args.kind)
+    print(json.dumps(report), file=sys.stderr if args.archive == '-' else sys.stdout)
+
+elif args.command == 'import':
+    with (contextlib.nullcontext(sys.stdin.buffer) if args.archive == '-' else open(args.archive, 'rb')) as f:
+        print(json.dumps(import_cache(f, args.overwrite)))
+
+elif args.command == 'warm':
+    source = contextlib.nullcontext(())
+    if args.file:
+        source = contextlib.nullcontext(sys.stdin) if args.file == '-' else open(args.file, encoding='utf-8')
+
+    # Pipeline progress goes to stderr so stdout stays valid NDJSON
+    stdout = sys.stdout
+    with source as f, contextlib.redirect_stdout(sys.stderr):
+        for item in warm_cache(itertools.chain(args.ids, f), args.concurrency, skip_cached=not args.no_skip_cached):
+            stdout.write(json.dumps(item) + '\n')
+            stdout.flush()
+
+elif args.command == 'gc':
+    if args.older_than is None and args.max_size is None and not args.orphans:
+        parser.error('gc needs --older-than, --max-size or --orphans')
+    report = collect_garbage(
+        older_than=args.older_than * 86400 if args.older_than is not None else None,
+        max_bytes=args.max_size,
+        orphans=args.orphans,
+        kinds=args.kind,
+        orphan_grace=args.orphan_grace,
+        dry_run=args.dry_run,
+    )
+    print(json.dumps(report, indent=2))
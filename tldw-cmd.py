@@ -1,8 +1,55 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
 import sys
+
+import dotenv
+
 from tldw import summarize_video
 
-url = sys.argv[1]
+# Load environment variables
+dotenv.load_dotenv()
+
+# Logs go to stderr, stdout carries the results
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+parser = argparse.ArgumentParser(description='Summarize YouTube videos')
+parser.add_argument('urls', nargs='*', help='Video URLs, or playlist and channel URLs with --batch')
+parser.add_argument('--batch', action='store_true',
+                    help='Summarize many videos, printing one JSON line per video and a final report')
+parser.add_argument('--file', help='Read URLs from a file, one per line (- for stdin), implies --batch')
+parser.add_argument('--concurrency', type=int, default=None,
+                    help='Videos summarized at once in batch mode (default: BATCH_CONCURRENCY or 4)')
+parser.add_argument('--no-skip-cached', action='store_true',
+                    help='Run videos with a cached summary too, instead of reporting them as skipped')
+parser.add_argument('--openai-batch', action='store_true',
+                    help='Send completions through the OpenAI Batch API (cheaper, finishes within 24h), implies --batch')
+args = parser.parse_args()
+
+urls = list(args.urls)
+if args.file:
+    with (contextlib.nullcontext(sys.stdin) if args.file == '-' else open(args.file, encoding='utf-8')) as f:
+        urls += [line.strip() for line in f if line.strip()]
+
+if not urls:
+    parser.error('no URLs given')
+
+if not args.batch and not args.file and not args.openai_batch:
+    for url in urls:
+        summarize = summarize_video(url)
+
+        print(summarize)
+    sys.exit(0)
 
-summarize = summarize_video(url)
+# Batch mode pulls in the OpenAI Batch backend, a single cached video is answered without it
+from batch import summarize_videos, summarize_videos_with_openai_batch  # noqa: E402
 
-print(summarize)
+# Pipeline progress goes to stderr so stdout stays valid NDJSON
+stdout = sys.stdout
+summarize_many = summarize_videos_with_openai_batch if args.openai_batch else summarize_videos
+with contextlib.redirect_stdout(sys.stderr):
+    for item in summarize_many(urls, args.concurrency, skip_cached=not args.no_skip_cached):
+        stdout.write(json.dumps(item) + '\n')
+        stdout.flush()
@@ -1,14 +1,25 @@
+import json
+import logging
+import math
 import os
-import time
 import traceback
+from collections.abc import Mapping
 from functools import wraps
 
 import dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 
-from tldr import summarize_article
-from tldw import summarize_video
+import http_session
+import metrics
+from batch import is_batch_api_authorized, is_batch_api_enabled, is_valid_concurrency, summarize_videos
+from cache import CACHE_DIR
+from circuit_breaker import STATE_CLOSED, circuit_states
+from jobs import DEFAULT_LEASE_SECONDS, JobQueue
+from rate_limiter import BUDGET_BATCH, BUDGET_HIT, BUDGET_MISS, get_rate_limiter
+from stage_limits import Overloaded
+from tldr import summarize_article, stream_article_summary, is_article_cached
+from tldw import summarize_video, stream_video_summary, is_video_cached
 
 app = Flask(__name__)
 app.config['PROXY_URL'] = None  # Default value
@@ -29,26 +40,29 @@ CORS(app, resources={
 # Load environment variables
 dotenv.load_dotenv()
 
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+# Background summarizations, JOB_WORKERS bounds how many pipelines run at once,
+# JOB_LEASE_SECONDS is how long a job of a hung or vanished process stays running before it is queued again
+job_queue = JobQueue(os.getenv('JOBS_DB_PATH', os.path.join(CACHE_DIR, 'jobs.db')),
+                     {'youtube': summarize_video, 'article': summarize_article},
+                     workers=int(os.getenv('JOB_WORKERS', 2)),
+                     lease_seconds=float(os.getenv('JOB_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)))
+JOB_CACHE_PROBES = {'youtube': is_video_cached, 'article': is_article_cached}
 
-# Rate limiting decorator
-def rate_limit(limit=5):  # 60 requests per minute by default
-    def decorator(f):
-        requests = {}
 
+# Rate limiting decorator, is_cached(url) picks the budget the request is counted against
+def rate_limit(is_cached):
+    def decorator(f):
         @wraps(f)
         def wrapped(*args, **kwargs):
-            now = time.time()
-            ip = request.remote_addr
-
-            # Clean old entries
-            requests[ip] = [t for t in requests.get(ip, []) if now - t < 60]
-
-            if len(requests.get(ip, [])) >= limit:
-                return jsonify({
-                    "error": "Rate limit exceeded. Please try again later."
-                }), 429
+            data = request.get_json(silent=True) if request.method == 'POST' else request.args
+            # A missing or malformed URL costs a miss, the handler answers it with 400
+            url = __request_url(data)
+            rate_limited = __check_rate_limit(BUDGET_HIT if url and is_cached(url) else BUDGET_MISS)
+            if rate_limited:
+                return rate_limited
 
-            requests.setdefault(ip, []).append(now)
             return f(*args, **kwargs)
 
         return wrapped
@@ -56,26 +70,56 @@ def rate_limit(limit=5):  # 60 requests per minute by default
     return decorator
 
 
+def __check_rate_limit(budget):
+    retry_after = get_rate_limiter().take(request.remote_addr, budget)
+    if not retry_after:
+        return None
+
+    return jsonify({
+        "error": "Rate limit exceeded. Please try again later."
+    }), 429, {'Retry-After': str(math.ceil(retry_after))}
+
+
+def __request_url(data):
+    # The URL of a JSON body or query string, None unless it is a string
+    url = data.get('url') if isinstance(data, Mapping) else None
+    return url if isinstance(url, str) else None
+
+
+def is_job_cached(url):
+    data = request.get_json(silent=True) or {}
+    return JOB_CACHE_PROBES.get(data.get('type', 'youtube'), lambda _: False)(url)
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "healthy"}), 200
+    # Stays 200 while an upstream is down, restarting the server would not bring it back
+    circuits = circuit_states()
+    status = "degraded" if any(circuit['state'] != STATE_CLOSED for circuit in circuits.values()) else "healthy"
+    return jsonify({"status": status, "circuits": circuits}), 200
+
+
+@app.route('/api/metrics', methods=['GET'])
+def handle_metrics():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/api/summarize/article', methods=['POST'])
-@rate_limit()
+@rate_limit(is_article_cached)
 def handle_summarize_article():
     try:
         data = request.get_json()
-        print(f"Handling: {data}")
+        app.logger.info(f"Handling: {data}")
 
-        if not data or 'url' not in data:
+        url = __request_url(data)
+        if url is None:
             return jsonify({
                 "error": "Missing URL in request body"
             }), 400
 
-        url = data['url']
-
         return jsonify(summarize_article(url)), 200
+    except Overloaded as e:
+        return __overloaded(e)
     except Exception as e:
         app.logger.error(f"Error processing video: {str(e)}")
         app.logger.error(traceback.format_exc())
@@ -85,19 +129,20 @@ def handle_summarize_article():
 
 
 @app.route('/api/summarize/youtube', methods=['POST'])
-@rate_limit()
+@rate_limit(is_video_cached)
 def handle_summarize_youtube():
     try:
         data = request.get_json()
 
-        if not data or 'url' not in data:
+        url = __request_url(data)
+        if url is None:
             return jsonify({
                 "error": "Missing URL in request body"
             }), 400
 
-        url = data['url']
-
         return jsonify(summarize_video(url)), 200
+    except Overloaded as e:
+        return __overloaded(e)
     except Exception as e:
         app.logger.error(f"Error processing video: {str(e)}")
         app.logger.error(traceback.format_exc())
@@ -106,6 +151,172 @@ def handle_summarize_youtube():
         }), 500
 
 
+@app.route('/api/summarize/article/stream', methods=['GET', 'POST'])
+@rate_limit(is_article_cached)
+def handle_summarize_article_stream():
+    return __stream_summary(stream_article_summary)
+
+
+@app.route('/api/summarize/youtube/stream', methods=['GET', 'POST'])
+@rate_limit(is_video_cached)
+def handle_summarize_youtube_stream():
+    return __stream_summary(stream_video_summary)
+
+
+# Keeps an endpoint off the public app, it answers 404 unless BATCH_API_TOKEN is set and sent as the bearer token
+def batch_api_token_required(f):
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        if not is_batch_api_enabled():
+            return jsonify({
+                "error": "Not found"
+            }), 404
+        if not is_batch_api_authorized(request.headers.get('Authorization')):
+            return jsonify({
+                "error": "Missing or invalid token"
+            }), 401, {'WWW-Authenticate': 'Bearer'}
+
+        return f(*args, **kwargs)
+
+    return wrapped
+
+
+@app.route('/api/summarize/youtube/batch', methods=['POST'])
+@batch_api_token_required
+def handle_summarize_youtube_batch():
+    """
+    Summarize many videos ('urls', playlist and channel URLs are expanded), streaming one JSON line per video
+    and a final throughput report. 'concurrency' is capped by BATCH_CONCURRENCY.
+
+    The request counts against the client's hit budget, every video without a cached summary against
+    its batch budget (RATE_LIMIT_BATCH_PER_MINUTE); videos over it are reported as failed with 'retry_after'.
+    """
+    data = request.get_json(silent=True)
+    urls = __batch_urls(data)
+    if not urls:
+        return jsonify({
+            "error": "Missing URLs in request body"
+        }), 400
+
+    concurrency = data.get('concurrency')
+    if not is_valid_concurrency(concurrency):
+        return jsonify({
+            "error": "concurrency must be a positive integer"
+        }), 400
+
+    rate_limited = __check_rate_limit(BUDGET_HIT)
+    if rate_limited:
+        return rate_limited
+
+    client = request.remote_addr
+
+    def generate():
+        try:
+            for item in summarize_videos(urls, concurrency, skip_cached=data.get('skip_cached', True),
+                                         rate_limit=lambda video_id: get_rate_limiter().take(client, BUDGET_BATCH)):
+                yield json.dumps(item) + '\n'
+        except Exception as e:
+            app.logger.error(f"Error processing batch: {str(e)}")
+            app.logger.error(traceback.format_exc())
+            yield json.dumps({"error": f"An error occurred: {str(e)}"}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+def __batch_urls(data):
+    if not isinstance(data, dict):
+        return []
+    urls = data.get('urls') or []
+    if isinstance(urls, str):
+        urls = [urls]
+    if data.get('url'):
+        urls = [data['url'], *urls]
+    return [url for url in urls if isinstance(url, str) and url.strip()]
+
+
+def __stream_summary(stream_summary):
+    """
+    Server-Sent Events response, the URL comes from the query string (EventSource) or the JSON body.
+    """
+    data = request.get_json(silent=True) if request.method == 'POST' else request.args
+    url = __request_url(data)
+    if url is None:
+        return jsonify({
+            "error": "Missing URL in request body"
+        }), 400
+
+    def generate():
+        try:
+            for event, event_data in stream_summary(url):
+                yield __sse_event(event, event_data)
+        except Overloaded as e:
+            # The response has already started, the client gets the retry delay in the event instead
+            yield __sse_event('error', {"error": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            app.logger.error(f"Error processing stream: {str(e)}")
+            app.logger.error(traceback.format_exc())
+            yield __sse_event('error', {"error": f"An error occurred: {str(e)}"})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # let reverse proxies pass events through immediately
+    })
+
+
+def __overloaded(e):
+    # A stage of the pipeline has no free slot, the client should come back instead of queueing here
+    return jsonify({
+        "error": str(e)
+    }), 503, {'Retry-After': str(e.retry_after)}
+
+
+def __sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+@app.route('/api/jobs', methods=['POST'])
+@rate_limit(is_job_cached)
+def handle_submit_job():
+    try:
+        data = request.get_json()
+
+        url = __request_url(data)
+        if url is None:
+            return jsonify({
+                "error": "Missing URL in request body"
+            }), 400
+
+        job_type = data.get('type', 'youtube')
+        if job_type not in job_queue.handlers:
+            return jsonify({
+                "error": f"Unsupported job type: {job_type}"
+            }), 400
+
+        job_id = job_queue.submit(job_type, url)
+
+        return jsonify({"job_id": job_id, "status": "queued"}), 202
+    except Exception as e:
+        app.logger.error(f"Error submitting job: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({
+            "error": f"An error occurred: {str(e)}"
+        }), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def handle_get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({
+            "error": "Job not found"
+        }), 404
+
+    return jsonify(job), 200
+
+
 if __name__ == '__main__':
     from waitress import serve
     import argparse
@@ -116,5 +327,8 @@ if __name__ == '__main__':
                         help='Proxy URL (default: PROXY_URL environment variable or None)')
     args = parser.parse_args()
     app.config['PROXY_URL'] = args.proxy
-    print(f'Serving on port {args.port}')
+    http_session.set_proxy_url(app.config['PROXY_URL'])
+    # Resume jobs interrupted by a previous shutdown without waiting for a new submission
+    job_queue.start()
+    app.logger.info(f'Serving on port {args.port}')
     serve(app, host="0.0.0.0", port=args.port)
@@ -1,55 +1,368 @@
-from youtube_info import YoutubeVideoInfoExtractor
+import functools
+import hashlib
+import logging
+import os
+import time
+from contextlib import contextmanager
+from time import perf_counter
+
+import metrics
+import prompts
+from cache import create_cache_json, reuse_cache_json, delete_cache_json
+from summarization_engine import get_target_languages
+from youtube_info import YoutubeVideoInfoExtractor, VideoUnavailable
 from youtube_captions import YoutubeVideoCaptionsExtractor
 from youtube_summarizer import YoutubeSummarizer
+from single_flight import SingleFlight, AsyncSingleFlight
+from stage_limits import Overloaded
+from transcript_compaction import compact_transcript
 
+logger = logging.getLogger(__name__)
 
-def summarize_video(url):
-    # Download metadata
-    youtube_video_info_extractor = YoutubeVideoInfoExtractor()
+# Long videos are summarized in chunks (see YoutubeSummarizer), this only guards against runaway costs
+DEFAULT_MAX_VIDEO_DURATION = 12 * 3600
+
+# Videos that cannot be summarized are remembered for a while, so retries fail right away instead of
+# running yt-dlp through the proxy again. Seconds per failure reason, NEGATIVE_CACHE=0 disables it:
+#   NEGATIVE_CACHE_TTL_UNAVAILABLE - private, removed or restricted videos (default: 600)
+#   NEGATIVE_CACHE_TTL_NO_CAPTIONS - videos without English captions, generated ones come later (default: 3600)
+#   NEGATIVE_CACHE_TTL_TOO_LONG    - videos over MAX_VIDEO_DURATION (default: 86400)
+# Failures of the upstreams themselves are not cached, their circuit breakers fail fast instead.
+FAILURE_UNAVAILABLE = 'unavailable'
+FAILURE_NO_CAPTIONS = 'no_captions'
+FAILURE_TOO_LONG = 'too_long'
+DEFAULT_NEGATIVE_CACHE_TTLS = {
+    FAILURE_UNAVAILABLE: 600,
+    FAILURE_NO_CAPTIONS: 3600,
+    FAILURE_TOO_LONG: 86400,
+}
+
+in_flight_videos = SingleFlight()
+in_flight_videos_async = AsyncSingleFlight()
+
+
+def summarize_video(url, on_stage=None):
+    """
+    on_stage, if given, is called with the name of each pipeline stage as it starts
+    (info, captions, summary, translation). None of them run when the final result is cached.
+    """
+    start = perf_counter()
     try:
-        video_info = youtube_video_info_extractor.extract_video_info(url)
+        video_id = YoutubeVideoInfoExtractor.extract_video_id(url)
     except Exception as e:
         raise Exception(f"Failed to download video info: {str(e)}")
 
+    result = __reuse_result(video_id, start)
+    if result:
+        return result
+    __reuse_failure(video_id)
+
+    # Concurrent requests for the same video share a single pipeline run
+    result = in_flight_videos.do(video_id, __summarize_video, url, on_stage)
+    metrics.observe('tldw_request_seconds', perf_counter() - start, kind='youtube', cache='miss')
+    return result
+
+
+def __summarize_video(url, on_stage):
+    video_info, caption_text = __prepare_video(url, on_stage)
     video_id = video_info.get('id')
-    duration = video_info.get('duration')
-    video_title = video_info.get("fulltitle")
-    video_description = video_info.get("description")
-    aspect_ratio = video_info.get('aspect_ratio', 1.78)
-    webpage_url = video_info.get('webpage_url', 'https://www.youtube.com/watch?v=' + video_id)
-    thumbnails = video_info.get('thumbnails', [])
-    title = video_info.get('title', '')
-    subtitles = video_info.get('subtitles')
-    automatic_captions = video_info.get('automatic_captions')
 
-    # If video too long, reject
-    if duration >= 9000:
-        raise Exception(f"Too long video: {video_id}")
+    # Generate summaries
+    youtube_summarizer = __get_youtube_summarizer()
+    summaries = youtube_summarizer.summarize(
+        video_id, caption_text, video_info.get("fulltitle"), video_info.get("description"), on_stage)
+    if not summaries:
+        raise Exception(f"Failed to summarize video: {video_id}")
+
+    return __store_result(video_info, summaries)
+
+
+def prepare_video_summary(url):
+    """
+    Download the metadata and the (compacted) captions of a video, the input of its summary.
+
+    With complete_video_summary, lets videos be summarized outside summarize_video (see batch.py).
+
+    Returns:
+        Tuple of the video info and the caption text
+    """
+    try:
+        video_id = YoutubeVideoInfoExtractor.extract_video_id(url)
+    except Exception as e:
+        raise Exception(f"Failed to download video info: {str(e)}")
+    __reuse_failure(video_id)
+
+    return __prepare_video(url, None)
+
+
+def complete_video_summary(video_info, summaries):
+    """
+    Cache and return the final result for summaries produced outside summarize_video.
+    """
+    return __store_result(video_info, summaries)
+
+
+def __prepare_video(url, on_stage):
+    video_info = __extract_video_info(url, on_stage)
+    caption_text = __extract_captions(video_info, on_stage)
+    return video_info, caption_text
 
+
+def __extract_video_info(url, on_stage):
+    # Download metadata
+    __report_stage(on_stage, 'info')
+    youtube_video_info_extractor = __get_youtube_video_info_extractor()
+    with __video_info_errors(url), metrics.timed('tldw_stage_seconds', stage='info'):
+        video_info = youtube_video_info_extractor.extract_video_info(url)
+    __check_duration(video_info)
+    return video_info
+
+
+def __extract_captions(video_info, on_stage):
     # Get captions
-    youtube_video_captions_extractor = YoutubeVideoCaptionsExtractor()
-    caption_text = youtube_video_captions_extractor.prepare_captions(video_id, subtitles, automatic_captions)
-    if not caption_text:
-        raise Exception(f"Captions are not available for video: {video_id}")
+    __report_stage(on_stage, 'captions')
+    video_id = video_info.get('id')
+    youtube_video_captions_extractor = __get_youtube_video_captions_extractor()
+    with metrics.timed('tldw_stage_seconds', stage='captions'):
+        caption_text = youtube_video_captions_extractor.prepare_captions(
+            video_id, video_info.get('subtitles'), video_info.get('automatic_captions'))
+    return __prepare_captions(video_id, caption_text)
+
+
+def is_video_cached(url):
+    """
+    Whether summarize_video would be answered from the cached final result.
+    """
+    try:
+        video_id = YoutubeVideoInfoExtractor.extract_video_id(url)
+    except Exception:
+        return False
+    return reuse_cache_json(__result_cache_key(video_id)) is not None
+
+
+async def summarize_video_async(url):
+    start = perf_counter()
+    try:
+        video_id = YoutubeVideoInfoExtractor.extract_video_id(url)
+    except Exception as e:
+        raise Exception(f"Failed to download video info: {str(e)}")
+
+    result = __reuse_result(video_id, start)
+    if result:
+        return result
+    __reuse_failure(video_id)
+
+    result = await in_flight_videos_async.do(video_id, __summarize_video_async, url)
+    metrics.observe('tldw_request_seconds', perf_counter() - start, kind='youtube', cache='miss')
+    return result
+
+
+async def __summarize_video_async(url):
+    # Same stages as __prepare_video, with the blocking downloads awaited
+    youtube_video_info_extractor = __get_youtube_video_info_extractor()
+    with __video_info_errors(url), metrics.timed('tldw_stage_seconds', stage='info'):
+        video_info = await youtube_video_info_extractor.extract_video_info_async(url)
+    __check_duration(video_info)
+    video_id = video_info.get('id')
+
+    youtube_video_captions_extractor = __get_youtube_video_captions_extractor()
+    with metrics.timed('tldw_stage_seconds', stage='captions'):
+        caption_text = await youtube_video_captions_extractor.prepare_captions_async(
+            video_id, video_info.get('subtitles'), video_info.get('automatic_captions'))
+    caption_text = __prepare_captions(video_id, caption_text)
 
     # Generate summaries
-    youtube_summarizer = YoutubeSummarizer()
-    summaries = youtube_summarizer.summarize(video_id, caption_text, video_title, video_description)
+    youtube_summarizer = __get_youtube_summarizer()
+    summaries = await youtube_summarizer.summarize_async(
+        video_id, caption_text, video_info.get("fulltitle"), video_info.get("description"))
     if not summaries:
         raise Exception(f"Failed to summarize video: {video_id}")
 
-    thumbnail_url = __prepare_thumbnail_url(thumbnails)
+    return __store_result(video_info, summaries)
+
+
+def stream_video_summary(url):
+    """
+    Run the pipeline yielding (event, data) tuples as each stage completes:
+    ('metadata', ...), ('captions', ...), ('paragraph', delta), ('translation', delta)
+    and finally ('done', result) with the same result summarize_video returns.
+
+    Streams are not coalesced with concurrent requests, the completed summary is cached as usual.
+    A cached final result is replayed as ('metadata', ...) and ('done', result) right away.
+    """
+    start = perf_counter()
+    try:
+        video_id = YoutubeVideoInfoExtractor.extract_video_id(url)
+    except Exception as e:
+        raise Exception(f"Failed to download video info: {str(e)}")
 
+    result = __reuse_result(video_id, start)
+    if result:
+        yield 'metadata', {field: value for field, value in result.items() if field != 'summary'}
+        yield 'done', result
+        return
+    __reuse_failure(video_id)
+
+    video_info = __extract_video_info(url, None)
+    video_id = video_info.get('id')
+    yield 'metadata', __prepare_metadata(video_info)
+
+    caption_text = __extract_captions(video_info, None)
+    yield 'captions', {'length': len(caption_text)}
+
+    # Generate summaries
+    youtube_summarizer = __get_youtube_summarizer()
+    summaries = None
+    for event, data in youtube_summarizer.summarize_stream(
+            video_id, caption_text, video_info.get("fulltitle"), video_info.get("description")):
+        if event == 'summary':
+            summaries = data
+        else:
+            yield event, data
+    if not summaries:
+        raise Exception(f"Failed to summarize video: {video_id}")
+
+    yield 'done', __store_result(video_info, summaries)
+
+
+# Extractors and the summarizer hold no per-request state, one instance of each serves the whole process
+@functools.cache
+def __get_youtube_video_info_extractor():
+    return YoutubeVideoInfoExtractor()
+
+
+@functools.cache
+def __get_youtube_video_captions_extractor():
+    return YoutubeVideoCaptionsExtractor()
+
+
+@functools.cache
+def __get_youtube_summarizer():
+    return YoutubeSummarizer()
+
+
+def __result_cache_key(video_id):
+    """
+    The final result depends on the configured target languages and the prompts, so they are part of the key
+    and changing them falls back to the per-stage caches instead of serving a stale result.
+    """
+    fingerprint = hashlib.sha256(
+        f"{prompts.PROMPT_VERSION}:{','.join(get_target_languages())}".encode('utf-8')).hexdigest()[:12]
+    return f'result_{video_id}_{fingerprint}'
+
+
+def __reuse_result(video_id, start):
+    # Warm path: a single lookup of the complete summarize_video result, before any other stage
+    result = reuse_cache_json(__result_cache_key(video_id))
+    if result:
+        metrics.observe('tldw_request_seconds', perf_counter() - start, kind='youtube', cache='hit')
+    return result
+
+
+def __store_result(video_info, summaries):
+    result = __prepare_result(video_info, summaries)
+    create_cache_json(__result_cache_key(result['video_id']), result)
+    return result
+
+
+def __failure_cache_key(video_id, reason):
+    return f'failure_{video_id}_{reason}'
+
+
+def __reuse_failure(video_id):
+    # Raises the remembered failure of a video, checked after the final result and before any stage runs
+    if os.getenv('NEGATIVE_CACHE', '1') == '0':
+        return
+
+    for reason in DEFAULT_NEGATIVE_CACHE_TTLS:
+        failure = reuse_cache_json(__failure_cache_key(video_id, reason))
+        if not failure:
+            continue
+        if failure['expires_at'] > time.time():
+            logger.info(f'Reusing cached failure of {video_id}: {reason}')
+            raise Exception(failure['error'])
+        delete_cache_json(__failure_cache_key(video_id, reason))
+
+
+def __remember_failure(video_id, reason, error):
+    """
+    Cache a failure of a video for the TTL of its reason and return the exception to raise.
+    """
+    ttl = int(os.getenv(f'NEGATIVE_CACHE_TTL_{reason.upper()}', DEFAULT_NEGATIVE_CACHE_TTLS[reason]))
+    if os.getenv('NEGATIVE_CACHE', '1') != '0' and ttl > 0:
+        create_cache_json(__failure_cache_key(video_id, reason), {
+            'reason': reason,
+            'error': error,
+            'expires_at': time.time() + ttl,
+        })
+    return Exception(error)
+
+
+@contextmanager
+def __video_info_errors(url):
+    # Unavailable videos are remembered, stage limits and open circuits are reported as they are
+    try:
+        yield
+    except Overloaded:
+        raise
+    except VideoUnavailable as e:
+        raise __remember_failure(YoutubeVideoInfoExtractor.extract_video_id(url), FAILURE_UNAVAILABLE,
+                                 f"Failed to download video info: {str(e)}")
+    except Exception as e:
+        raise Exception(f"Failed to download video info: {str(e)}")
+
+
+def __prepare_captions(video_id, caption_text):
+    # Captions of nothing but sound cues and fillers are empty once compacted
+    if caption_text:
+        caption_text = __compact_captions(video_id, caption_text)
+    if not caption_text:
+        raise __remember_failure(video_id, FAILURE_NO_CAPTIONS, f"Captions are not available for video: {video_id}")
+    return caption_text
+
+
+def __compact_captions(video_id, caption_text):
+    # TRANSCRIPT_COMPACTION=0 sends the captions unchanged, TRANSCRIPT_TOKEN_BUDGET caps their size
+    if os.getenv('TRANSCRIPT_COMPACTION', '1') == '0':
+        return caption_text
+
+    with metrics.timed('tldw_stage_seconds', stage='compaction'):
+        caption_text, stats = compact_transcript(caption_text, int(os.getenv('TRANSCRIPT_TOKEN_BUDGET', 0)) or None)
+    logger.info(f'Compacted captions of {video_id}: {stats["tokens_before"]} -> {stats["tokens_after"]} tokens, '
+                f'{stats["dropped_paragraphs"]} paragraphs dropped')
+    return caption_text
+
+
+def __report_stage(on_stage, stage):
+    if on_stage:
+        on_stage(stage)
+
+
+def __check_duration(video_info):
+    # If video too long, reject
+    if video_info.get('duration') >= int(os.getenv('MAX_VIDEO_DURATION', DEFAULT_MAX_VIDEO_DURATION)):
+        raise __remember_failure(video_info.get('id'), FAILURE_TOO_LONG, f"Too long video: {video_info.get('id')}")
+
+
+def __prepare_result(video_info, summaries):
     return {
-        "video_id": video_id,
-        "title": title,
-        "thumbnail_url": thumbnail_url,
-        "aspect_ratio": aspect_ratio,
-        "webpage_url": webpage_url,
+        **__prepare_metadata(video_info),
         "summary": summaries
     }
 
 
+def __prepare_metadata(video_info):
+    video_id = video_info.get('id')
+
+    return {
+        "video_id": video_id,
+        "title": video_info.get('title', ''),
+        "thumbnail_url": __prepare_thumbnail_url(video_info.get('thumbnails', [])),
+        "aspect_ratio": video_info.get('aspect_ratio', 1.78),
+        "webpage_url": video_info.get('webpage_url', 'https://www.youtube.com/watch?v=' + video_id),
+    }
+
+
 def __prepare_thumbnail_url(thumbnails):
     if thumbnails:
         best_thumbnail = max(thumbnails, key=lambda x: x.get('preference', 0))
@@ -0,0 +1,83 @@
+import math
+from typing import List
+
+# Rough average for English text with OpenAI tokenizers, good enough for budgeting prompts
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text.
+
+    Args:
+        text: Any text
+
+    Returns:
+        Approximate token count
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def split_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """
+    Split text on its paragraph breaks into chunks of at most max_tokens.
+
+    Paragraphs are kept whole and packed greedily, only a paragraph longer than the budget
+    on its own is split further on word boundaries.
+
+    Args:
+        text: Text with paragraphs separated by blank lines
+        max_tokens: Token budget of a single chunk
+
+    Returns:
+        List of chunks, joined back with the original paragraph separator
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks = []
+    current = []
+    current_length = 0
+
+    for paragraph in __split_long_paragraphs(text.split('\n\n'), max_chars):
+        if current and current_length + len(paragraph) + 2 > max_chars:
+            chunks.append('\n\n'.join(current))
+            current = []
+            current_length = 0
+        current.append(paragraph)
+        current_length += len(paragraph) + 2
+
+    if current:
+        chunks.append('\n\n'.join(current))
+
+    return chunks
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut text to at most max_tokens on a word boundary.
+
+    Args:
+        text: Any text
+        max_tokens: Token budget of the result
+
+    Returns:
+        The longest prefix of whole words within the budget (cut mid-word only for a single longer word)
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:__word_boundary_cut(text, max_chars)]
+
+
+def __split_long_paragraphs(paragraphs, max_chars):
+    for paragraph in paragraphs:
+        while len(paragraph) > max_chars:
+            cut = __word_boundary_cut(paragraph, max_chars)
+            yield paragraph[:cut]
+            paragraph = paragraph[cut:].lstrip()
+        if paragraph:
+            yield paragraph
+
+
+def __word_boundary_cut(text, max_chars):
+    cut = text.rfind(' ', 0, max_chars)
+    return cut if cut > 0 else max_chars
@@ -0,0 +1,120 @@
+import re
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from token_utils import estimate_tokens, truncate_to_tokens
+
+# Sound cues of auto-generated captions: [Music], [Applause], [Laughter], ♪ lyrics markers
+SOUND_CUE_PATTERN = re.compile(r'\[[^\]\n]*\]|♪+')
+FILLER_PATTERN = re.compile(r'\b(?:u+m+|u+h+|e+r+m+|a+h+|h+m+|mhm|uh-huh)\b[,.]?', re.IGNORECASE)
+SPACES_PATTERN = re.compile(r'[ \t]+')
+WORD_PATTERN = re.compile(r"[\w']+")
+
+# Longest phrase checked for immediate repetition ("you know you know", "I think that I think that")
+MAX_REPEATED_NGRAM = 8
+
+# Words ignored when scoring how informative a paragraph is, including spoken discourse markers
+STOP_WORDS = frozenset(
+    'a an and are as at be but by do for from have he i if in is it its of on or she so that the their '
+    'them then there they this to was we were what when which who will with you your '
+    'actually basically gonna just know like mean oh okay really right well yeah'.split())
+
+
+def compact_transcript(text: str, token_budget: Optional[int] = None) -> Tuple[str, Dict]:
+    """
+    Remove tokens that carry no meaning for the summary from caption text.
+
+    Strips bracketed sound cues and filler words, collapses immediately repeated phrases
+    and, when a token budget is given, drops the least informative paragraphs until the text fits.
+    The most informative paragraph is always kept, cut to the budget when it is larger on its own.
+    Paragraph breaks ('\\n\\n' for long pauses) are preserved.
+
+    Args:
+        text: Caption text as produced by YoutubeVideoCaptionsExtractor.prepare_captions
+        token_budget: Maximum estimated tokens of the result, None for no limit
+
+    Returns:
+        Tuple containing:
+        - Compacted text
+        - Dictionary with tokens_before, tokens_after and dropped_paragraphs
+    """
+    tokens_before = estimate_tokens(text)
+
+    paragraphs = []
+    for paragraph in text.split('\n\n'):
+        lines = [__compact_line(line) for line in paragraph.split('\n')]
+        paragraph = '\n'.join(line for line in lines if line)
+        if paragraph:
+            paragraphs.append(paragraph)
+
+    dropped_paragraphs = 0
+    if token_budget:
+        paragraphs, dropped_paragraphs = __fit_token_budget(paragraphs, token_budget)
+
+    result = '\n\n'.join(paragraphs)
+
+    return result, {
+        'tokens_before': tokens_before,
+        'tokens_after': estimate_tokens(result),
+        'dropped_paragraphs': dropped_paragraphs,
+    }
+
+
+def __compact_line(line):
+    line = SOUND_CUE_PATTERN.sub(' ', line)
+    line = FILLER_PATTERN.sub(' ', line)
+    words = SPACES_PATTERN.sub(' ', line).strip().split(' ')
+    return ' '.join(__collapse_repeats(words)) if words != [''] else ''
+
+
+def __collapse_repeats(words):
+    """
+    Drop immediate repetitions of phrases up to MAX_REPEATED_NGRAM words, longest first.
+    """
+    keys = [WORD_PATTERN.findall(word.lower()) for word in words]
+
+    for n in range(min(MAX_REPEATED_NGRAM, len(words) // 2), 0, -1):
+        i = 0
+        while i + 2 * n <= len(words):
+            if keys[i:i + n] == keys[i + n:i + 2 * n] and any(keys[i:i + n]):
+                del words[i + n:i + 2 * n]
+                del keys[i + n:i + 2 * n]
+            else:
+                i += 1
+
+    return words
+
+
+def __fit_token_budget(paragraphs, token_budget):
+    """
+    Drop paragraphs with the least novel content until the estimated size fits the budget,
+    down to the highest scoring one.
+
+    A word contributes 1 / (number of its occurrences in the transcript), so paragraphs
+    repeating what is said elsewhere score low. Order of the remaining paragraphs is kept.
+    """
+    paragraph_words = [
+        [word for word in WORD_PATTERN.findall(paragraph.lower()) if word not in STOP_WORDS]
+        for paragraph in paragraphs
+    ]
+    counts = Counter(word for words in paragraph_words for word in words)
+    scores = [
+        sum(1 / counts[word] for word in words) / max(len(words), 1)
+        for words in paragraph_words
+    ]
+
+    total_tokens = sum(estimate_tokens(paragraph) + 1 for paragraph in paragraphs)
+    ranked = sorted(range(len(paragraphs)), key=lambda i: scores[i])
+    dropped = set()
+    for index in ranked[:-1]:
+        if total_tokens <= token_budget:
+            break
+        dropped.add(index)
+        total_tokens -= estimate_tokens(paragraphs[index]) + 1
+
+    kept = [paragraph for i, paragraph in enumerate(paragraphs) if i not in dropped]
+    if total_tokens > token_budget:
+        # Even the best paragraph alone is over the budget
+        kept = [truncate_to_tokens(kept[0], token_budget)]
+
+    return kept, len(dropped)
@@ -1,11 +1,34 @@
+import json
+import logging
 import re
-from typing import Dict, Optional
-
-import requests
-import webvtt
+from typing import Dict, Iterable, Iterator, List, Optional
+from xml.etree import ElementTree
 
+import http_session
+import metrics
+from circuit_breaker import UPSTREAM_CAPTIONS, get_circuit_breaker
 from cache import reuse_cache_txt, ensure_cache_dir, create_cache_txt
-from time_utils import ts_to_secs, seconds_to_timestamp, timestamp_to_seconds
+
+logger = logging.getLogger(__name__)
+
+
+# Same patterns webvtt-py uses for cue timings, timestamps and cue text tags
+VTT_CUE_TIMINGS_PATTERN = re.compile(r'\s*((?:\d+:)?\d{2}:\d{2}.\d{3})\s*-->\s*((?:\d+:)?\d{2}:\d{2}.\d{3})')
+VTT_TIMESTAMP_PATTERN = re.compile(r'(?:(\d{1,2}):)?(\d{1,2}):(\d{1,2})\.(\d{3})')
+VTT_CUE_TAGS_PATTERN = re.compile('<.*?>')
+SRT_CUE_TIMINGS_PATTERN = re.compile(r'\s*(\d+):(\d{2}):(\d{2})[,.](\d{3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{3})')
+MULTIPLE_SPACES_PATTERN = re.compile(' {2,}')
+# TTML clock time (hh:mm:ss.fraction or hh:mm:ss:frames.subframes) and offset time (a count of a unit)
+TTML_CLOCK_TIME_PATTERN = re.compile(r'(\d+):(\d{1,2}):(\d{1,2}(?:\.\d+)?)(?::(\d+)(?:\.(\d+))?)?$')
+TTML_OFFSET_TIME_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(h|ms|m|s|f|t)$')
+TTML_PARAMETER_NAMESPACE = '{http://www.w3.org/ns/ttml#parameter}'
+
+# Caption formats by preference, cheapest to parse first: json3 is plain JSON, srv3 and ttml need an XML parser,
+# vtt and srt regexes. In json3 and srv3 automatic captions a line stays on screen until the line after next
+# appears, so their cues overlap and the pauses between lines are lost; automatic captions are read from vtt
+# until those formats give the same text (see benchmarks/bench_captions.py).
+SUBTITLE_FORMAT_PRIORITIES = ['json3', 'srv3', 'vtt', 'srt', 'ttml']
+AUTOMATIC_CAPTION_FORMAT_PRIORITIES = ['vtt', 'json3', 'srv3', 'srt', 'ttml']
 
 
 class YoutubeVideoCaptionsExtractor:
@@ -13,27 +36,49 @@ class YoutubeVideoCaptionsExtractor:
         ensure_cache_dir()
 
     def prepare_captions(self, video_id, subtitles, automatic_captions):
-        print("=== PREPARING VIDEO CAPTIONS ===")
+        logger.info(f"Preparing captions of {video_id}")
+
+        result = reuse_cache_txt(video_id)
+        if result:
+            return result
+
+        caption_track = self.__select_caption_track(video_id, subtitles, automatic_captions)
+        if not caption_track:
+            return None
+
+        downloaded_content = self.__download_captions(caption_track['url'])
+
+        return self.__store_captions(video_id, caption_track['ext'], downloaded_content)
+
+    async def prepare_captions_async(self, video_id, subtitles, automatic_captions):
+        logger.info(f"Preparing captions of {video_id}")
 
         result = reuse_cache_txt(video_id)
         if result:
             return result
 
-        # Get captions
+        caption_track = self.__select_caption_track(video_id, subtitles, automatic_captions)
+        if not caption_track:
+            return None
+
+        downloaded_content = await self.__download_captions_async(caption_track['url'])
+
+        return self.__store_captions(video_id, caption_track['ext'], downloaded_content)
+
+    def __select_caption_track(self, video_id, subtitles, automatic_captions) -> Optional[Dict]:
         caption_track = self.__get_captions_by_priority(subtitles, automatic_captions)
         if not caption_track:
-            print(f'Captions are not available for video {video_id}')
+            logger.warning(f'Captions are not available for video {video_id}')
             return None
 
-        ext = caption_track['ext']
-        name = caption_track["name"]
-        url = caption_track['url']
+        logger.info(f'Using captions track: {caption_track["name"]} ({caption_track["ext"]})')
+        return caption_track
 
-        print(f'Using captions track: {name} ({ext})')
-        downloaded_content = self.__download_captions(url)
-        caption_text = self.__parse_captions(ext, downloaded_content)
+    def __store_captions(self, video_id, ext, downloaded_content) -> str:
+        with metrics.timed('tldw_stage_seconds', stage='captions_parse'):
+            caption_text = self.__parse_captions(ext, downloaded_content)
 
-        print(f'Caption length: {len(caption_text)}')
+        logger.info(f'Caption length: {len(caption_text)}')
 
         create_cache_txt(video_id, caption_text)
 
@@ -55,7 +100,7 @@ class YoutubeVideoCaptionsExtractor:
         # Priority order for subtitle languages
         subtitle_priorities = ['en-US', 'en-CA', 'en']
         auto_caption_priorities = ['en-orig', 'en-US', 'en-CA', 'en']
-        format_priorities = ['vtt', 'srt', 'ttml']
+        format_priorities = SUBTITLE_FORMAT_PRIORITIES
 
         caption_track = None
 
@@ -80,6 +125,7 @@ class YoutubeVideoCaptionsExtractor:
                 for lang in auto_caption_priorities:
                     if lang in automatic_captions:
                         caption_track = automatic_captions[lang]
+                        format_priorities = AUTOMATIC_CAPTION_FORMAT_PRIORITIES
                         break
 
         if not caption_track:
@@ -97,116 +143,337 @@ class YoutubeVideoCaptionsExtractor:
         return None
 
     def __download_captions(self, url: str) -> str:
-        # Download caption content
-        response = requests.get(url)
-        response.raise_for_status()
-        content = response.text
+        # Download caption content over the shared, proxy-aware session
+        with get_circuit_breaker(UPSTREAM_CAPTIONS).guard(http_session.is_upstream_failure), \
+                metrics.timed('tldw_stage_seconds', stage='captions_download'):
+            return http_session.get(url).text
 
-        return content
+    async def __download_captions_async(self, url: str) -> str:
+        with get_circuit_breaker(UPSTREAM_CAPTIONS).guard(http_session.is_upstream_failure), \
+                metrics.timed('tldw_stage_seconds', stage='captions_download'):
+            response = await http_session.get_async(url)
+        return response.text
 
     def __parse_captions(self, ext: str, content: str) -> str:
-        """
-        Parse caption content with formatting based on timing.
+        return parse_captions(ext, content)
+
+
+def parse_captions(ext: str, content: str) -> str:
+    """
+    Parse caption content with formatting based on timing.
+
+    Args:
+        ext: Captions file extension
+        content: Downloaded captions content
+
+    Returns:
+        Plain text of the captions with paragraph breaks for pauses > 3 seconds
+
+    Raises:
+        ValueError: If caption format is not supported
+    """
+
+    if ext not in CAPTION_PARSERS:
+        raise ValueError(f"Unsupported caption format: {ext}")
+
+    return join_cues(dedupe_yt_cues(CAPTION_PARSERS[ext](content)))
+
+
+def iter_vtt_cues(content: str) -> Iterator[List]:
+    """
+    Parse WebVTT content in a single pass, yielding cues as [start_ms, end_ms, text].
+
+    Follows the block rules of webvtt-py, which this replaces: blocks are separated by blank
+    (or whitespace-only) lines, a cue block starts with an optional identifier and the timing line,
+    and cue text tags like <c> or <00:00:01.000> are removed.
+
+    Raises:
+        ValueError: If content is not WebVTT or a timestamp is malformed
+    """
+    lines = content.splitlines()
+    if not lines or not lines[0].startswith('WEBVTT'):
+        raise ValueError('Invalid WebVTT content')
+
+    for block in __iter_blocks(lines):
+        cue = __parse_vtt_block(block)
+        if cue:
+            yield cue
+
+
+def iter_srt_cues(content: str) -> Iterator[List]:
+    """
+    Parse SubRip content, yielding cues as [start_ms, end_ms, text] with formatting tags removed.
+    """
+    for block in __iter_blocks(content.splitlines()):
+        for i, line in enumerate(block[:2]):
+            timing = SRT_CUE_TIMINGS_PATTERN.match(line)
+            if timing:
+                hours, minutes, seconds, milliseconds = (int(value) for value in timing.groups()[:4])
+                start = ((hours * 60 + minutes) * 60 + seconds) * 1000 + milliseconds
+                hours, minutes, seconds, milliseconds = (int(value) for value in timing.groups()[4:])
+                end = ((hours * 60 + minutes) * 60 + seconds) * 1000 + milliseconds
+                yield [start, end, __strip_cue_tags('\n'.join(block[i + 1:]))]
+                break
+
+
+def iter_json3_cues(content: str) -> Iterator[List]:
+    """
+    Parse YouTube json3 timed text, yielding cues as [start_ms, end_ms, text].
+
+    Window definitions and appended line breaks carry no text and are skipped.
+    """
+    for event in json.loads(content).get('events', []):
+        segments = event.get('segs')
+        if not segments:
+            continue
+        text = ''.join(segment.get('utf8', '') for segment in segments)
+        if not text.strip():
+            continue
+        start = event.get('tStartMs', 0)
+        yield [start, start + event.get('dDurationMs', 0), text]
+
+
+def iter_srv3_cues(content: str) -> Iterator[List]:
+    """
+    Parse YouTube srv3 timed text (<p t="start ms" d="duration ms">), yielding cues as [start_ms, end_ms, text].
+    """
+    for paragraph in ElementTree.fromstring(content).iter('p'):
+        text = ''.join(paragraph.itertext())
+        if not text.strip():
+            continue
+        start = int(paragraph.get('t', 0))
+        yield [start, start + int(paragraph.get('d', 0)), text]
+
+
+def iter_ttml_cues(content: str) -> Iterator[List]:
+    """
+    Parse TTML, yielding cues as [start_ms, end_ms, text] with <br/> turned into line breaks.
+
+    Frame and tick times use the ttp:frameRate, ttp:subFrameRate, ttp:frameRateMultiplier and
+    ttp:tickRate of the document.
+
+    Raises:
+        ValueError: If a time expression or a rate is malformed
+    """
+    root = ElementTree.fromstring(content)
+    rates = __ttml_rates(root)
+    for element in root.iter():
+        if not element.tag.endswith('}p') and element.tag != 'p':
+            continue
+
+        parts = [element.text or '']
+        for child in element:
+            parts.append('\n' if child.tag.endswith('br') else ''.join(child.itertext()))
+            parts.append(child.tail or '')
+        text = ''.join(parts)
+        if not text.strip():
+            continue
+
+        yield [__parse_ttml_time(element.get('begin'), rates), __parse_ttml_time(element.get('end'), rates), text]
+
+
+def __ttml_rates(root):
+    # TTML defaults: 30 frames per second, one subframe per frame and, without a frame rate, one tick per second
+    try:
+        frame_rate = float(root.get(f'{TTML_PARAMETER_NAMESPACE}frameRate', 30))
+        sub_frame_rate = float(root.get(f'{TTML_PARAMETER_NAMESPACE}subFrameRate', 1))
+        numerator, denominator = root.get(f'{TTML_PARAMETER_NAMESPACE}frameRateMultiplier', '1 1').split()
+        frame_rate *= float(numerator) / float(denominator)
+        if f'{TTML_PARAMETER_NAMESPACE}tickRate' in root.attrib:
+            tick_rate = float(root.get(f'{TTML_PARAMETER_NAMESPACE}tickRate'))
+        elif f'{TTML_PARAMETER_NAMESPACE}frameRate' in root.attrib:
+            tick_rate = frame_rate * sub_frame_rate
+        else:
+            tick_rate = 1
+    except (ValueError, ZeroDivisionError):
+        raise ValueError('Invalid TTML frame or tick rate')
+
+    if frame_rate <= 0 or sub_frame_rate <= 0 or tick_rate <= 0:
+        raise ValueError('Invalid TTML frame or tick rate')
+    return frame_rate, sub_frame_rate, tick_rate
+
+
+def __parse_ttml_time(value, rates):
+    if not value:
+        return 0
+    frame_rate, sub_frame_rate, tick_rate = rates
+
+    offset = TTML_OFFSET_TIME_PATTERN.match(value.strip())
+    if offset:
+        unit_milliseconds = {
+            'h': 3600000, 'm': 60000, 's': 1000, 'ms': 1, 'f': 1000 / frame_rate, 't': 1000 / tick_rate,
+        }[offset.group(2)]
+        return round(float(offset.group(1)) * unit_milliseconds)
+
+    clock = TTML_CLOCK_TIME_PATTERN.match(value.strip())
+    if not clock:
+        raise ValueError(f'Invalid TTML time {value!r}')
+
+    hours, minutes, seconds, frames, sub_frames = clock.groups()
+    seconds = (int(hours) * 60 + int(minutes)) * 60 + float(seconds)
+    if frames:
+        seconds += (int(frames) + int(sub_frames or 0) / sub_frame_rate) / frame_rate
+    return round(seconds * 1000)
+
+
+def __iter_blocks(lines):
+    # Blocks of non-blank lines, whitespace-only lines separate blocks like blank ones
+    block = []
+    for line in lines:
+        if line.strip():
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+
+    if block:
+        yield block
+
+
+def __parse_vtt_block(block):
+    if not (len(block) >= 2 and VTT_CUE_TIMINGS_PATTERN.match(block[0]) and '-->' not in block[1]) and \
+            not (len(block) >= 3 and '-->' not in block[0] and VTT_CUE_TIMINGS_PATTERN.match(block[1])
+                 and '-->' not in block[2]):
+        return None
 
-        Args:
-            ext: Captions file extension
-            content: Downloaded captions content
+    start = end = None
+    payload = []
+    for line in block:
+        timing = VTT_CUE_TIMINGS_PATTERN.match(line)
+        if timing:
+            start, end = timing.group(1), timing.group(2)
+        elif start:
+            payload.append(line)
 
-        Returns:
-            Plain text of the captions with paragraph breaks for pauses > 3 seconds
+    return [__parse_vtt_timestamp(start), __parse_vtt_timestamp(end), __strip_cue_tags('\n'.join(payload))]
 
-        Raises:
-            ValueError: If caption format is not supported
-        """
 
-        if ext == 'vtt':
-            captions = webvtt.from_string(content)
-            result = ''
+def __parse_vtt_timestamp(value):
+    match = VTT_TIMESTAMP_PATTERN.match(value)
+    if not match or int(match.group(2)) > 59 or int(match.group(3)) > 59:
+        raise ValueError(f'Invalid timestamp {value!r}')
 
-            captions = list(self.__dedupe_yt_captions(captions))
+    hours, minutes, seconds, milliseconds = match.groups()
+    return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(milliseconds)
 
-            for i, caption in enumerate(captions):
-                # Clean up the current caption text
-                current_text = caption.text.replace('\n', ' ').strip()
 
-                if i > 0:
-                    # Calculate time difference with previous caption
-                    prev_end = timestamp_to_seconds(captions[i - 1].end)
-                    current_start = timestamp_to_seconds(caption.start)
-                    time_diff = current_start - prev_end
+def __strip_cue_tags(text):
+    return VTT_CUE_TAGS_PATTERN.sub('', text) if '<' in text else text
 
-                    # Add double newline for pauses > 3 seconds, space otherwise
-                    if time_diff >= 2:
-                        result += '\n\n'
-                    elif time_diff >= 1:
-                        result += '\n'
-                    else:
-                        result += ' '
 
-                result += current_text
-        else:
-            raise ValueError(f"Unsupported caption format: {ext}")
+def __set_cue_text(text):
+    # Same normalization webvtt-py applies when caption text is assigned (split into lines and joined back)
+    if '\n' in text or '<' in text:
+        return __strip_cue_tags('\n'.join(text.splitlines()))
+    return text
 
-        # Final cleanup to remove any multiple spaces
-        result = ' '.join(re.split(' +', result))
 
-        return result
+def __cue_seconds(milliseconds):
+    # Same float arithmetic as time_utils.ts_to_secs, so comparisons match the original implementation
+    return milliseconds // 1000 + (milliseconds % 1000) / 1000
 
-    # adapted from https://github.com/bindestriche/srt_fix/blob/5b4442a8cdcae06c53545f4d0c99c3e624416919/simplesrt.py#L132C1-L201C28
-    def __dedupe_yt_captions(self, subs_iter):
-        previous_subtitle = None
-        for subtitle in subs_iter:
 
-            if previous_subtitle is None:  # first interation set previous subtitle for comparison
-                previous_subtitle = subtitle
-                continue
+def __timestamp_seconds(milliseconds):
+    # Same float arithmetic as time_utils.timestamp_to_seconds on the formatted timestamp
+    hours, remainder = divmod(milliseconds, 3600000)
+    minutes, remainder = divmod(remainder, 60000)
+    return hours * 3600.0 + minutes * 60.0 + remainder / 1000
 
-            subtitle.text = subtitle.text.strip()  # remove trailing linebreaks
 
-            if len(subtitle.text) == 0:  # skip over empty subtitles
-                continue
+# adapted from https://github.com/bindestriche/srt_fix/blob/5b4442a8cdcae06c53545f4d0c99c3e624416919/simplesrt.py#L132C1-L201C28
+def dedupe_yt_cues(cues: Iterable[List]) -> Iterator[List]:
+    """
+    Merge the rolling, overlapping cues of YouTube captions. Cues are [start_ms, end_ms, text] lists
+    and are modified in place; every yielded cue is final.
+    """
+    START, END, TEXT = 0, 1, 2
+    previous = None
+    for cue in cues:
 
-            if (ts_to_secs(subtitle.start_time) - ts_to_secs(subtitle.end_time) < 0.15 and  # very short
-                    subtitle.text in previous_subtitle.text):  # same text as previous
-                previous_subtitle.end = subtitle.end  # lengthen previous subtitle
-                continue
+        if previous is None:  # first interation set previous subtitle for comparison
+            previous = cue
+            continue
 
-            current_lines = subtitle.text.split("\n")
-            last_lines = previous_subtitle.text.split("\n")
+        cue[TEXT] = __set_cue_text(cue[TEXT].strip())  # remove trailing linebreaks
 
-            singleword = False
+        if len(cue[TEXT]) == 0:  # skip over empty subtitles
+            continue
 
-            if current_lines[0] == last_lines[-1]:  # if first current is  last previous
-                if len(last_lines) == 1:
-                    if len(last_lines[0].split(" ")) < 2 and len(last_lines[0]) > 2:  # if  is just one word
-                        singleword = True
-                        subtitle.text = current_lines[0] + " " + "\n".join(
-                            current_lines[1:])  # remove line break after single word
+        if (__cue_seconds(cue[START]) - __cue_seconds(cue[END]) < 0.15 and  # very short
+                cue[TEXT] in previous[TEXT]):  # same text as previous
+            previous[END] = cue[END]  # lengthen previous subtitle
+            continue
+
+        current_lines = cue[TEXT].split("\n")
+        last_lines = previous[TEXT].split("\n")
+
+        singleword = False
+
+        if current_lines[0] == last_lines[-1]:  # if first current is  last previous
+            if len(last_lines) == 1:
+                if len(last_lines[0].split(" ")) < 2 and len(last_lines[0]) > 2:  # if  is just one word
+                    singleword = True
+                    cue[TEXT] = __set_cue_text(current_lines[0] + " " + "\n".join(
+                        current_lines[1:]))  # remove line break after single word
 
-                    else:
-                        subtitle.text = "\n".join(current_lines[1:])  # discard first line of current
                 else:
-                    subtitle.text = "\n".join(current_lines[1:])  # discard first line of current
-            else:  # not fusing two lines
-                if len(subtitle.text.split(" ")) <= 2:  # only one word in subtitle
-
-                    previous_subtitle.end = subtitle.end  # lengthen previous subtitle
-                    title_text = subtitle.text
-                    if title_text[0] != " ":
-                        title_text = " " + title_text
-
-                    previous_subtitle.text += title_text  # add text to previous
-                    continue  # drop this subtitle
-
-            if ts_to_secs(subtitle.start_time) <= ts_to_secs(
-                    previous_subtitle.end_time):  # remove overlap and let 1ms gap
-                new_time = max(ts_to_secs(subtitle.start_time) - 0.001, 0)
-                previous_subtitle.end = seconds_to_timestamp(new_time)
-            if ts_to_secs(subtitle.start_time) >= ts_to_secs(
-                    subtitle.end_time):  # swap start and end if wrong order
-                subtitle.start, subtitle.end = subtitle.end, subtitle.start
-
-            if not singleword:
-                yield previous_subtitle
-            previous_subtitle = subtitle
-        yield previous_subtitle
+                    cue[TEXT] = __set_cue_text("\n".join(current_lines[1:]))  # discard first line of current
+            else:
+                cue[TEXT] = __set_cue_text("\n".join(current_lines[1:]))  # discard first line of current
+        else:  # not fusing two lines
+            if len(cue[TEXT].split(" ")) <= 2:  # only one word in subtitle
+
+                previous[END] = cue[END]  # lengthen previous subtitle
+                title_text = cue[TEXT]
+                if title_text[0] != " ":
+                    title_text = " " + title_text
+
+                previous[TEXT] = __set_cue_text(previous[TEXT] + title_text)  # add text to previous
+                continue  # drop this subtitle
+
+        if cue[START] <= previous[END]:  # remove overlap and let 1ms gap
+            previous[END] = max(cue[START] - 1, 0)
+        if cue[START] >= cue[END]:  # swap start and end if wrong order
+            cue[START], cue[END] = cue[END], cue[START]
+
+        if not singleword:
+            yield previous
+        previous = cue
+
+    if previous is not None:
+        yield previous
+
+
+def join_cues(cues: Iterable[List]) -> str:
+    """
+    Join cue texts into plain text, breaking lines on pauses: a blank line for pauses of 2 seconds
+    or more, a new line for pauses of at least a second and a space otherwise.
+    """
+    parts = []
+    previous_end = None
+    for start, end, text in cues:
+        if previous_end is not None:
+            # Calculate time difference with previous caption
+            time_diff = __timestamp_seconds(start) - __timestamp_seconds(previous_end)
+            if time_diff >= 2:
+                parts.append('\n\n')
+            elif time_diff >= 1:
+                parts.append('\n')
+            else:
+                parts.append(' ')
+
+        # Clean up the current caption text
+        parts.append(text.replace('\n', ' ').strip())
+        previous_end = end
+
+    # Final cleanup to remove any multiple spaces
+    return MULTIPLE_SPACES_PATTERN.sub(' ', ''.join(parts))
+
+
+CAPTION_PARSERS = {
+    'json3': iter_json3_cues,
+    'srv3': iter_srv3_cues,
+    'vtt': iter_vtt_cues,
+    'srt': iter_srt_cues,
+    'ttml': iter_ttml_cues,
+}
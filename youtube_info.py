@@ -1,9 +1,94 @@
-from typing import Dict, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
 
-import yt_dlp
-from yt_dlp.utils import YoutubeDLError
+import http_session
+from circuit_breaker import UPSTREAM_YTDLP, get_circuit_breaker
+from cache import ensure_cache_dir, reuse_cache_json, reuse_cache_json_gz, create_cache_json_gz, delete_cache_json
+from stage_limits import STAGE_YTDLP, get_stage_limit
 
-from cache import ensure_cache_dir, create_cache_json, reuse_cache_json
+logger = logging.getLogger(__name__)
+# yt-dlp progress and warnings go through logging instead of stdout
+ytdlp_logger = logging.getLogger('yt_dlp')
+
+# Fields of the yt-dlp info dict used by the rest of the pipeline, everything else is dropped before caching
+INFO_FIELDS = ['id', 'duration', 'fulltitle', 'title', 'description', 'aspect_ratio', 'webpage_url']
+CAPTION_TRACK_FIELDS = ['ext', 'url', 'name', 'protocol']
+
+# Idle YoutubeDL instances kept for reuse (YTDLP_POOL_SIZE), more are created under load and closed after use
+DEFAULT_YTDLP_POOL_SIZE = 4
+
+# yt-dlp is imported on the first extraction, its import alone takes longer than answering a cached request.
+# Ids of the usual single video URLs are read with this pattern, anything else (playlists, unusual hosts)
+# is left to the YouTube extractor of yt-dlp.
+VIDEO_URL_PATTERN = re.compile(
+    r'https?://(?:(?:www|m|music)\.)?'
+    r'(?:youtube\.com/(?:watch/?\?(?:[^#]*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)'
+    r'([0-9A-Za-z_-]{11})(?![0-9A-Za-z_-])')
+
+# Errors yt-dlp reports as expected that still mean YouTube is refusing us rather than the video being unavailable
+UPSTREAM_ERROR_MARKERS = ("not a bot", "HTTP Error 429", "rate-limit")
+
+
+class VideoUnavailable(Exception):
+    """
+    yt-dlp reached YouTube and the video itself cannot be extracted (private, removed, age or region restricted).
+    """
+
+
+class YoutubeDLPool:
+    """
+    Reuses YoutubeDL instances across requests, so extractors are initialized once per instance.
+
+    A YoutubeDL is not safe for concurrent extractions, so every instance serves one caller at a time.
+    Instances are grouped by their options, a change of the proxy does not reuse the old ones.
+
+    Only the YouTube extractors are registered, instead of the hundreds yt-dlp loads by default.
+    """
+
+    def __init__(self, max_idle):
+        self.lock = threading.Lock()
+        self.max_idle = max_idle
+        self.idle = {}
+
+    @contextmanager
+    def acquire(self, ydl_opts):
+        key = json.dumps(ydl_opts, sort_keys=True)
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            ydl = self.__create(ydl_opts)
+
+        try:
+            yield ydl
+        finally:
+            with self.lock:
+                idle = self.idle.setdefault(key, [])
+                keep = len(idle) < self.max_idle
+                if keep:
+                    idle.append(ydl)
+            if not keep:
+                ydl.close()
+
+    def __create(self, ydl_opts):
+        import yt_dlp
+        from yt_dlp.extractor.youtube import (
+            YoutubeIE, YoutubeYtBeIE, YoutubePlaylistIE, YoutubeTabIE, YoutubeYtUserIE)
+
+        ydl = yt_dlp.YoutubeDL({**ydl_opts, 'logger': ytdlp_logger}, auto_init=False)
+        # Checked in this order, other extractors a result refers to are still loaded on demand
+        for extractor in (YoutubeIE, YoutubeYtBeIE, YoutubePlaylistIE, YoutubeTabIE, YoutubeYtUserIE):
+            ydl.add_info_extractor(extractor())
+        return ydl
+
+
+ydl_pool = YoutubeDLPool(int(os.getenv('YTDLP_POOL_SIZE', DEFAULT_YTDLP_POOL_SIZE)))
 
 
 class YoutubeVideoInfoExtractor:
@@ -21,6 +106,51 @@ class YoutubeVideoInfoExtractor:
             'no-playlist': True
         }
 
+    @staticmethod
+    def extract_video_id(url: str) -> str:
+        match = VIDEO_URL_PATTERN.match(url)
+        if match and 'list=' not in url:
+            return match.group(1)
+
+        from yt_dlp.extractor.youtube import YoutubeIE
+        from yt_dlp.utils import YoutubeDLError
+        try:
+            return YoutubeIE.extract_id(url)
+        except YoutubeDLError as e:
+            logger.warning(f"Failed to extract video id from {url}: {str(e)}")
+            raise Exception(f"Cannot extract id for {url}")
+
+    @staticmethod
+    def is_video_url(url: str) -> bool:
+        if VIDEO_URL_PATTERN.match(url) and 'list=' not in url:
+            return True
+
+        from yt_dlp.extractor.youtube import YoutubeIE
+        return YoutubeIE.suitable(url)
+
+    def extract_playlist_video_ids(self, url: str) -> List[str]:
+        """
+        List the ids of the videos of a playlist or channel without extracting the videos themselves.
+
+        Args:
+            url: Playlist, channel or channel tab URL
+
+        Returns:
+            Video ids in playlist order
+        """
+        logger.info(f"Listing videos of {url}")
+        from yt_dlp.utils import YoutubeDLError
+        try:
+            with get_circuit_breaker(UPSTREAM_YTDLP).guard(self.__is_upstream_failure), \
+                    get_stage_limit(STAGE_YTDLP).acquire(), \
+                    ydl_pool.acquire({**self.__ydl_opts(), 'extract_flat': 'in_playlist', 'quiet': True}) as ydl:
+                playlist = ydl.extract_info(url, download=False)
+        except YoutubeDLError as e:
+            logger.error(f"Error listing playlist {url}: {str(e)}")
+            raise Exception(f"Cannot list videos of {url}")
+
+        return self.__playlist_video_ids(playlist)
+
     def extract_video_info(self, url: str) -> Tuple[Optional[Dict], Optional[str]]:
         """
         Extract video description and captions from a YouTube URL.
@@ -34,28 +164,109 @@ class YoutubeVideoInfoExtractor:
             - String containing the captions/subtitles
         """
 
-        print("=== GATHERING VIDEO INFO ===")
-        try:
-            video_id = yt_dlp.extractor.youtube.YoutubeIE.extract_id(url)
-        except YoutubeDLError as e:
-            print(f"Failed to download video info for {url}: {str(e)}")
-            raise Exception(f"Cannot extract id for {url}")
+        logger.info(f"Gathering video info: {url}")
+        video_id = self.extract_video_id(url)
 
-        result = reuse_cache_json(video_id)
+        result = reuse_cache_json_gz(video_id)
         if result:
             return result
 
+        # Entries cached before the compact format are converted on first use
+        legacy_result = reuse_cache_json(video_id)
+        if legacy_result:
+            result = self.__compact_video_info(legacy_result)
+            create_cache_json_gz(video_id, result)
+            delete_cache_json(video_id)
+            return result
+
+        from yt_dlp.utils import YoutubeDLError
         try:
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
+            # Extractions beyond YTDLP_MAX_CONCURRENCY across all workers wait for a slot or raise Overloaded,
+            # none are attempted while the circuit of yt-dlp is open
+            with get_circuit_breaker(UPSTREAM_YTDLP).guard(self.__is_upstream_failure), \
+                    get_stage_limit(STAGE_YTDLP).acquire(), ydl_pool.acquire(self.__ydl_opts()) as ydl:
                 # Get video info
                 video_info = ydl.extract_info(url, download=False)
         except YoutubeDLError as e:
-            print(f"Error extracting video information: {str(e)}")
-            raise Exception(f"Cannot extract info for {url}")
+            logger.error(f"Error extracting video information: {str(e)}")
+            if self.__is_upstream_failure(e):
+                raise Exception(f"Cannot extract info for {url}")
+            raise VideoUnavailable(f"Cannot extract info for {url}")
 
         duration = video_info.get('duration')
-        print(f'Video id: {video_id}, duration: {duration} = {duration // 60}:{duration % 60:02}')
+        logger.info(f'Video id: {video_id}, duration: {duration} = {duration // 60}:{duration % 60:02}')
+
+        result = self.__compact_video_info(video_info)
+        create_cache_json_gz(video_id, result)
+
+        return result
+
+    async def extract_video_info_async(self, url: str) -> Dict:
+        """
+        Same as extract_video_info, with the blocking yt-dlp extraction run in the default executor.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.extract_video_info, url)
+
+    def __playlist_video_ids(self, playlist: Dict) -> List[str]:
+        # Channel pages list their tabs (videos, shorts, ...) as nested playlists
+        video_ids = []
+        for entry in playlist.get('entries') or []:
+            if not entry:
+                continue
+            if entry.get('entries'):
+                video_ids += self.__playlist_video_ids(entry)
+            elif entry.get('ie_key') == 'Youtube' and entry.get('id'):
+                video_ids.append(entry['id'])
+            elif entry.get('url') and self.is_video_url(entry['url']):
+                video_ids.append(self.extract_video_id(entry['url']))
+            elif entry.get('url') and entry.get('ie_key') == 'YoutubeTab':
+                video_ids += self.extract_playlist_video_ids(entry['url'])
+        return video_ids
+
+    def __is_upstream_failure(self, e: Exception) -> bool:
+        # yt-dlp marks errors about the video itself (unavailable, private, ...) as expected
+        from yt_dlp.utils import DownloadError, YoutubeDLError
+        if not isinstance(e, YoutubeDLError):
+            return False
+        cause = e.exc_info[1] if isinstance(e, DownloadError) and e.exc_info else e
+        if not getattr(cause, 'expected', False):
+            return True
+        return any(marker in str(e) for marker in UPSTREAM_ERROR_MARKERS)
+
+    def __ydl_opts(self) -> Dict:
+        # The proxy is read on every extraction, it can be configured after the extractor was created
+        proxy_url = http_session.get_proxy_url()
+        return {**self.ydl_opts, 'proxy': proxy_url} if proxy_url else self.ydl_opts
+
+    def __compact_video_info(self, video_info: Dict) -> Dict:
+        """
+        Trim the yt-dlp info dict to the fields the pipeline consumes.
+
+        Only the best thumbnail and the English caption tracks are kept.
+        """
+        result = {field: video_info[field] for field in INFO_FIELDS if field in video_info}
+
+        thumbnails = video_info.get('thumbnails')
+        if thumbnails:
+            best_thumbnail = max(thumbnails, key=lambda x: x.get('preference', 0))
+            result['thumbnails'] = [{key: best_thumbnail[key] for key in ['url', 'preference'] if key in best_thumbnail}]
+
+        result['subtitles'] = self.__english_caption_tracks(video_info.get('subtitles'))
+        result['automatic_captions'] = self.__english_caption_tracks(video_info.get('automatic_captions'))
+
+        return result
 
-        create_cache_json(video_id, video_info)
+    def __english_caption_tracks(self, captions: Optional[Dict]) -> Dict:
+        if not captions:
+            return {}
 
-        return video_info
+        result = {}
+        for lang, tracks in captions.items():
+            if lang != 'en' and not lang.startswith('en-'):
+                continue
+            result[lang] = [
+                {key: track[key] for key in CAPTION_TRACK_FIELDS if key in track}
+                for track in tracks
+                if track.get('protocol') != 'm3u8_native'
+            ]
+        return result
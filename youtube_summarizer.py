@@ -1,67 +1,108 @@
-from openai import OpenAI
+import logging
+import os
 
-from cache import ensure_cache_dir, create_cache_json, reuse_cache_json
+import prompts
+from summarization_engine import SummarizationEngine
+from token_utils import estimate_tokens, split_into_chunks
+
+logger = logging.getLogger(__name__)
+
+# Subtitles longer than CHUNK_THRESHOLD_TOKENS are summarized map-reduce style: chunks of at most
+# CHUNK_MAX_TOKENS are summarized in parallel, then the chunk summaries are summarized into the paragraph
+DEFAULT_CHUNK_THRESHOLD_TOKENS = 24000
+DEFAULT_CHUNK_MAX_TOKENS = 6000
 
 
 class YoutubeSummarizer:
     def __init__(self):
-        ensure_cache_dir()
-
-        self.client = OpenAI()
-        self.messages = []
-
-    def summarize(self, video_id, subtitles, video_title, video_description):
-        print("=== SUMMARIZING VIDEO ===")
-
-        result = reuse_cache_json(f'{video_id}_response')
-        if result:
-            return result
-
-        paragraph = self.__ask_assistant_persisting(
-            f"Summarize this video given its subtitles into increasing levels of conciseness. Begin by summarizing it into a single paragraph.\nTitle: {video_title}\nDescription:\n```{video_description}```\n\nDo not describe or mention the video itself. Simply summarize the points it makes. Focus on the overall or underlying takeaway, cause, reason, or answer BEYOND what's already in the title and description, which is already shown to the user. PROVIDE NO OTHER OUTPUT OTHER THAN THE PARAGRAPH.\nSubtitles follow: {subtitles}")
-        # sentence = self.__ask_assistant_persisting(
-        #     "Now summarize it into a single sentence. Focus on the overall or underlying takeaway, cause, reason, or answer BEYOND what's already in the title and description, which is already shown to the user. Basically, provide a single sentence answer to the question the video poses. PROVIDE NO OTHER OUTPUT OTHER THAN THE SENTENCE.")
-        # question = self.__ask_assistant_persisting(
-        #     f'Rephrase the video title into a single motivating question. Focus on the overall TOPIC or SUBJECT of the video. This could be just the video title verbatim, especially if it is already a question. Don\'t use information outside of the video title. For example, if the title is "This problem ...", the question would be "What problem ...?". As a reminder, here is the video title again: "{video_title}". PROVIDE NO OTHER OUTPUT OTHER THAN THE QUESTION.')
-        # word = self.__ask_assistant_persisting(
-        #     'Answer the question we just asked with just a single phrase, ideally one or two words. Examples: "Is EVOLUTION REAL?" -> "Yes." "Have scientists achieved fusion?" -> "No." "It depends." "Will AI take over the world?" -> "Nobody knows." "Why NO ONE lives here" -> "Poor geography." "Inside Disney\'s $1 BILLION disaster" -> "No market need." "Scientists FEAR this one thing" -> "Climate change." "Why is there war in the middle east?" -> "It\'s complicated." "Have we unlocked the secret to QUANTUM COMPUTING?" -> "Not really." "A day from Hell" -> "1999 Moore tornado" ... -> "Mostly." ... -> "Usually." PROVIDE NO OTHER OUTPUT OTHER THAN THE WORD(S) OF THE ANSWER.')
-        # search_term = self.__ask_assistant_persisting(
-        #     'Now suggest a search term for a Wikipedia search that replaces watching the video. Make the search SPECIFIC to the TOPIC of the video. For example: "The $6 Billion Transit Project with No Ridership" -> "FasTracks"; "Why NOBODY lives in this part of China" -> "Gobi Desert"; "This unknown professor REVOLUTIONIZED ..." -> "Joseph-Louis Lagrange"; "Every Computer Can Be Hacked!" -> "Zero-Day Vulnerability"; Provide the Wikipedia page name with no special punctuation:')
-        paragraph_pl = self.__ask_assistant_persisting(
-            f"Translate below text from English to Polish. Under no circumstances DO NOT change content, just provide translation.\n---\n{paragraph}")
-
-        response = {
-            'title': video_title,
-            'paragraph': paragraph,
-            'paragraph_pl': paragraph_pl,
-            # 'sentence': sentence,
-            # 'question': question,
-            # 'word': f'{word} ({search_term})',
-            # 'wikipedia': 'https://en.wikipedia.org/w/index.php?search=' + quote_plus(search_term)
-        }
-
-        create_cache_json(f'{video_id}_response', response)
-
-        return response
-
-    def __ask_assistant_persisting(self, instruction):
-        self.messages.append(
-            {
-                "role": "user",
-                "content": instruction
-            }
-        )
-        completion = self.client.chat.completions.create(
-            model="gpt-4o",
-            store=True,
-            messages=self.messages,
-        )
-        answer = completion.choices[0].message.content
-        self.messages.append(
-            {
-                "role": "assistant",
-                "content": answer
-            }
-        )
-        print(answer)
-        return answer
+        self.engine = SummarizationEngine()
+        self.chunk_threshold_tokens = int(os.getenv('CHUNK_THRESHOLD_TOKENS', DEFAULT_CHUNK_THRESHOLD_TOKENS))
+        self.chunk_max_tokens = int(os.getenv('CHUNK_MAX_TOKENS', DEFAULT_CHUNK_MAX_TOKENS))
+
+    def summarize(self, video_id, subtitles, video_title, video_description, on_stage=None):
+        logger.info(f"Summarizing video: {video_id}")
+
+        return self.engine.summarize(
+            prompts.summary_cache_key(video_id), video_title,
+            lambda: self.__prepare_instruction(subtitles, video_title, video_description), on_stage)
+
+    async def summarize_async(self, video_id, subtitles, video_title, video_description):
+        logger.info(f"Summarizing video: {video_id}")
+
+        return await self.engine.summarize_async(
+            prompts.summary_cache_key(video_id), video_title,
+            lambda: self.__prepare_instruction_async(subtitles, video_title, video_description))
+
+    def summarize_stream(self, video_id, subtitles, video_title, video_description):
+        """
+        Generator variant of summarize, see SummarizationEngine.summarize_stream for the events.
+        """
+        logger.info(f"Summarizing video: {video_id}")
+
+        yield from self.engine.summarize_stream(
+            prompts.summary_cache_key(video_id), video_title,
+            lambda: self.__prepare_instruction(subtitles, video_title, video_description))
+
+    def summarize_batch(self, videos, backend):
+        """
+        Summarize many videos through a batch backend, see SummarizationEngine.summarize_batch.
+
+        Long subtitles are summarized map-reduce style as in summarize: all chunk summaries are batched first,
+        the instruction of every video is then prepared from the cached chunk summaries.
+
+        Args:
+            videos: List of (video_id, subtitles, video_title, video_description) tuples
+            backend: Batch backend, e.g. openai_batch.OpenAIBatchBackend
+
+        Returns:
+            Dictionary of summaries keyed by video_id, None for videos that failed
+        """
+        logger.info(f"Summarizing {len(videos)} videos in batch")
+
+        chunk_instructions = []
+        for video_id, subtitles, video_title, video_description in videos:
+            if self.__needs_chunking(subtitles):
+                chunk_instructions += [self.__chunk_instruction(chunk, video_title)
+                                       for chunk in self.__split_subtitles(subtitles)]
+        self.engine.summarize_chunks_batch(chunk_instructions, backend)
+
+        results = self.engine.summarize_batch([
+            (prompts.summary_cache_key(video_id), video_title,
+             lambda subtitles=subtitles, video_title=video_title, video_description=video_description:
+             self.__prepare_instruction(subtitles, video_title, video_description))
+            for video_id, subtitles, video_title, video_description in videos
+        ], backend)
+        return {video_id: results[prompts.summary_cache_key(video_id)] for video_id, _, _, _ in videos}
+
+    def __prepare_instruction(self, subtitles, video_title, video_description):
+        if not self.__needs_chunking(subtitles):
+            return self.__summary_instruction(subtitles, video_title, video_description)
+
+        chunk_summaries = self.engine.summarize_chunks(
+            [self.__chunk_instruction(chunk, video_title) for chunk in self.__split_subtitles(subtitles)])
+        return self.__reduce_instruction(chunk_summaries, video_title, video_description)
+
+    async def __prepare_instruction_async(self, subtitles, video_title, video_description):
+        if not self.__needs_chunking(subtitles):
+            return self.__summary_instruction(subtitles, video_title, video_description)
+
+        chunk_summaries = await self.engine.summarize_chunks_async(
+            [self.__chunk_instruction(chunk, video_title) for chunk in self.__split_subtitles(subtitles)])
+        return self.__reduce_instruction(chunk_summaries, video_title, video_description)
+
+    def __summary_instruction(self, subtitles, video_title, video_description):
+        return prompts.video_summary(subtitles, video_title, video_description)
+
+    def __needs_chunking(self, subtitles):
+        return estimate_tokens(subtitles) > self.chunk_threshold_tokens
+
+    def __split_subtitles(self, subtitles):
+        chunks = split_into_chunks(subtitles, self.chunk_max_tokens)
+        logger.info(f'Summarizing subtitles in {len(chunks)} chunks')
+        return chunks
+
+    def __chunk_instruction(self, chunk, video_title):
+        return prompts.video_chunk_summary(chunk, video_title)
+
+    def __reduce_instruction(self, chunk_summaries, video_title, video_description):
+        return prompts.video_reduce(chunk_summaries, video_title, video_description)